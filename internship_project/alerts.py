@@ -0,0 +1,290 @@
+"""
+Low-stock alerts
+Product.update_stock writes a StockAlert row in the same transaction as
+any movement that moves a product across min_stock_level or zero, so new
+alerts are found without scanning the catalog. A dispatcher thread in each
+worker (started on the first request, woken by threshold events) claims
+pending alerts in batches and hands each batch to the configured sinks:
+the in-app inbox, an email stand-in and a webhook.
+
+Per batch only the latest alert of each product is delivered, and it is
+suppressed when it repeats the last alert sent for that product (or
+announces a restock nobody was warned about). A sink that fails is retried
+on a later pass without re-sending to the sinks that succeeded. Sinks run
+with no database transaction open (the inbox in a short one of its own),
+so a slow webhook never holds up stock movements.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import joinedload
+
+from events import alert_pending
+from metrics import inc as inc_metric, observe
+from models import db, StockAlert, AlertNotice
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = {
+    'out_of_stock': '{name} is out of stock.',
+    'low_stock': '{name} is low on stock: {quantity} left (minimum {minimum}).',
+    'in_stock': '{name} is back in stock: {quantity} available.',
+}
+
+_dispatcher_pid = None
+
+
+def alert_payload(alert):
+    """What sinks receive for one alert"""
+    product = alert.product
+    return {
+        'id': alert.id,
+        'product_id': alert.product_id,
+        'product_name': product.name,
+        'sku': product.sku,
+        'kind': alert.kind,
+        'old_quantity': alert.old_quantity,
+        'new_quantity': alert.new_quantity,
+        'min_stock_level': alert.min_stock_level,
+        'transaction_id': alert.transaction_id,
+        'created_at': alert.created_at.isoformat() if alert.created_at else None,
+        'message': MESSAGES[alert.kind].format(name=product.name, quantity=alert.new_quantity,
+                                               minimum=alert.min_stock_level),
+    }
+
+
+# Sinks
+
+class InboxSink:
+    """In-app inbox: one unread notice per product, updated by newer alerts"""
+
+    uses_database = True  # Delivered in its own short transaction, committed with its bookkeeping
+
+    def deliver(self, alerts):
+        unread = {notice.product_id: notice for notice in AlertNotice.query.filter(
+            AlertNotice.read_at.is_(None),
+            AlertNotice.product_id.in_([alert['product_id'] for alert in alerts])
+        )}
+        for alert in alerts:
+            notice = unread.get(alert['product_id'])
+            if notice is None:
+                notice = unread[alert['product_id']] = AlertNotice(product_id=alert['product_id'])
+                db.session.add(notice)
+            notice.alert_id = alert['id']
+            notice.kind = alert['kind']
+            notice.message = alert['message']
+            notice.created_at = datetime.utcnow()
+        db.session.flush()
+
+
+class EmailSink:
+    """Email stand-in: one digest per batch, appended to ALERT_EMAIL_LOG and logged"""
+
+    def deliver(self, alerts):
+        config = current_app.config
+        path = config['ALERT_EMAIL_LOG'] or os.path.join(current_app.instance_path, 'alert_emails.log')
+        subject = f'[Inventory] {len(alerts)} stock alert(s)'
+        body = '\n'.join(f'- {alert["message"]}' for alert in alerts)
+        message = (f'From: inventory@localhost\nTo: {config["ALERT_EMAIL_TO"]}\n'
+                   f'Date: {datetime.utcnow():%a, %d %b %Y %H:%M:%S} +0000\nSubject: {subject}\n\n{body}\n\n')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(message)
+        logger.info('%s to %s', subject, config['ALERT_EMAIL_TO'])
+
+
+class WebhookSink:
+    """POST the batch as JSON to ALERT_WEBHOOK_URL"""
+
+    def deliver(self, alerts):
+        config = current_app.config
+        request = urllib.request.Request(
+            config['ALERT_WEBHOOK_URL'],
+            data=json.dumps({'alerts': alerts}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        # urlopen raises HTTPError for non-2xx responses
+        with urllib.request.urlopen(request, timeout=config['ALERT_WEBHOOK_TIMEOUT']):
+            pass
+
+
+# name -> sink class; register_sink() adds more
+SINKS = {
+    'inbox': InboxSink,
+    'email': EmailSink,
+    'webhook': WebhookSink,
+}
+
+
+def register_sink(name, sink_class):
+    """Make a sink available to ALERT_SINKS; sink_class().deliver(alerts) gets each batch"""
+    SINKS[name] = sink_class
+
+
+def configured_sinks():
+    """{name: sink} for ALERT_SINKS (webhook only when ALERT_WEBHOOK_URL is set)"""
+    config = current_app.config
+    names = [name.strip() for name in config['ALERT_SINKS'].split(',') if name.strip()]
+    return {name: SINKS[name]() for name in names
+            if name in SINKS and (name != 'webhook' or config['ALERT_WEBHOOK_URL'])}
+
+
+# Dispatch
+
+def _claimable(table, now):
+    cutoff = now - timedelta(seconds=current_app.config['ALERT_CLAIM_TIMEOUT'])
+    return or_(table.c.status == 'pending',
+               and_(table.c.status == 'claimed', table.c.claimed_at < cutoff))
+
+
+def claim_batch(limit):
+    """Mark up to limit pending (or abandoned) alerts as claimed by this process; returns their ids"""
+    now = datetime.utcnow()
+    table = StockAlert.__table__
+    oldest = select(table.c.id).where(_claimable(table, now)).order_by(table.c.id).limit(limit)
+    # The condition is repeated so a row claimed meanwhile by another worker is skipped
+    ids = db.session.execute(
+        update(table)
+        .where(table.c.id.in_(oldest.scalar_subquery()), _claimable(table, now))
+        .values(status='claimed', claimed_at=now, attempts=table.c.attempts + 1)
+        .returning(table.c.id)
+    ).scalars().all()
+    db.session.commit()
+    return ids
+
+
+def _deduplicate(alerts):
+    """Split a batch (ordered by id) into (alerts to deliver, alerts to suppress)"""
+    latest = {}
+    for alert in alerts:
+        latest[alert.product_id] = alert
+    suppressed = [alert for alert in alerts if latest[alert.product_id] is not alert]
+
+    last_sent_ids = select(func.max(StockAlert.id)).where(
+        StockAlert.status == 'sent', StockAlert.product_id.in_(list(latest))
+    ).group_by(StockAlert.product_id)
+    last_sent = dict(db.session.query(StockAlert.product_id, StockAlert.kind)
+                     .filter(StockAlert.id.in_(last_sent_ids)))
+
+    deliver = []
+    for product_id, alert in latest.items():
+        # Nothing sent yet means everyone assumes the product is in stock
+        if alert.kind == last_sent.get(product_id, 'in_stock'):
+            suppressed.append(alert)
+        else:
+            deliver.append(alert)
+    return deliver, suppressed
+
+
+def dispatch_pending(limit=None):
+    """Claim one batch and deliver it; returns counts by outcome"""
+    config = current_app.config
+    counts = {'claimed': 0, 'sent': 0, 'suppressed': 0, 'retry': 0, 'failed': 0}
+    ids = claim_batch(limit or config['ALERT_BATCH_SIZE'])
+    if not ids:
+        return counts
+    counts['claimed'] = len(ids)
+
+    alerts = StockAlert.query.options(joinedload(StockAlert.product))\
+        .filter(StockAlert.id.in_(ids)).order_by(StockAlert.id).all()
+    now = datetime.utcnow()
+    deliver, suppressed = _deduplicate(alerts)
+    for alert in suppressed:
+        alert.status = 'suppressed'
+        alert.dispatched_at = now
+    payloads = {alert.id: alert_payload(alert) for alert in deliver}
+    done = {alert.id: [name for name in alert.sinks_done.split(',') if name] for alert in deliver}
+    # Nothing stays open while the sinks run: a slow webhook must not hold the write lock
+    db.session.commit()
+
+    sinks = configured_sinks()
+    errors = {}
+    for name, sink in sinks.items():
+        todo = [alert for alert in deliver if name not in done[alert.id]]
+        if not todo:
+            continue
+        started = time.perf_counter()
+        try:
+            sink.deliver([payloads[alert.id] for alert in todo])
+            if getattr(sink, 'uses_database', False):
+                for alert in todo:
+                    alert.sinks_done = ','.join(done[alert.id] + [name])
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()  # A failing inbox write leaves nothing behind
+            logger.warning('Alert sink %s failed: %s', name, e)
+            errors[name] = str(e)
+            inc_metric('alert_deliveries_total', sink=name, result='error')
+            continue
+        observe('alert_delivery_duration_seconds', time.perf_counter() - started, sink=name)
+        inc_metric('alert_deliveries_total', sink=name, result='ok')
+        for alert in todo:
+            done[alert.id].append(name)
+
+    for alert in deliver:
+        alert.sinks_done = ','.join(done[alert.id])
+        missing = [name for name in sinks if name not in done[alert.id]]
+        if not missing:
+            alert.status, alert.dispatched_at, alert.error = 'sent', now, None
+        else:
+            alert.error = '; '.join(f'{name}: {errors.get(name, "not delivered")}' for name in missing)
+            if alert.attempts >= config['ALERT_MAX_ATTEMPTS']:
+                alert.status, alert.dispatched_at = 'failed', now
+            else:
+                alert.claimed_at = now  # Stays claimed: retried once ALERT_CLAIM_TIMEOUT has passed
+    db.session.commit()
+
+    for alert in alerts:
+        result = 'retry' if alert.status == 'claimed' else alert.status
+        counts[result] += 1
+        inc_metric('inventory_alerts_total', kind=alert.kind, result=result)
+    return counts
+
+
+def dispatch_all():
+    """Dispatch batches until nothing is left to claim; returns summed counts"""
+    totals = {}
+    while True:
+        counts = dispatch_pending()
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+        if counts['claimed'] < current_app.config['ALERT_BATCH_SIZE']:
+            return totals
+
+
+def _dispatcher_loop(app):
+    while True:
+        alert_pending.wait(app.config['ALERT_DISPATCH_INTERVAL'])
+        alert_pending.clear()
+        time.sleep(app.config['ALERT_BATCH_DELAY'])  # Let a burst of movements collect into one batch
+        with app.app_context():
+            try:
+                dispatch_all()
+            except Exception:
+                app.logger.exception('Alert dispatch failed')
+            finally:
+                db.session.remove()
+
+
+def init_alerts(app):
+    """Start the alert dispatcher thread in each serving process"""
+    if not app.config['ALERTS_ENABLED']:
+        return
+
+    @app.before_request
+    def start_dispatcher():
+        # Started on the first request so forked workers each get their own thread
+        global _dispatcher_pid
+        if _dispatcher_pid == os.getpid():
+            return
+        _dispatcher_pid = os.getpid()
+        threading.Thread(target=_dispatcher_loop, args=(app,), name='alert-dispatcher', daemon=True).start()
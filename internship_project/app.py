@@ -1,28 +1,107 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, Response, abort, g, stream_with_context, current_app, send_from_directory
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import os
 import csv
+import itertools
+import threading
+import time
 from io import StringIO
 from functools import wraps
 import re
-from sqlalchemy import or_
+from sqlalchemy import or_, func, select
+from sqlalchemy.orm import joinedload
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+from config import Config
+from bulk import ACTIONS as BULK_ACTIONS, bulk_update_products
+from catalog import lookup_product, lookup_sku, product_record
+from concurrency import run_parallel, server_timing_header
+from deadlines import (QueryTimeout, cancel_deadline, check_deadline, lift_deadline, no_deadline,
+                       restart_deadline, skip_on_timeout)
+from exports import export_dir, resolve_format, split_name, write_export
+from assets import asset_url, send_asset
+from metrics import init_metrics, flush as flush_metrics, render_metrics, inc as inc_metric
+from archive import (LedgerPagination, archived_through, attach_relations,
+                     iter_archived_transactions, range_reaches_archive)
+from models import (db, User, Product, Supplier, Transaction, TransactionNote, Location, StockLevel,
+                    StockAlert, AlertNotice, MOVEMENT_NAMES, MOVEMENT_TYPES,
+                    create_default_admin, get_default_location, get_inventory_stats)
 
-from models import db, User, Product, Supplier, Transaction, create_default_admin, get_inventory_stats
+# All routes live on this blueprint and are attached by create_app()
+bp = Blueprint('main', __name__)
 
-# Initialize database with app
-db.init_app(app)
+def create_app(config=None):
+    """Application factory.
 
-# Create database tables and default admin
-with app.app_context():
-    db.create_all()
-    create_default_admin()
+    Building the app does not touch the database: schema creation and the
+    default admin are explicit CLI steps (see commands.py), and connection
+    pools are reset in forked workers so no connection crosses a fork.
+    """
+    started = time.perf_counter()
+    
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
+    
+    # Initialize database with app
+    db.init_app(app)
+    _reset_pools_after_fork(app)
+    
+    # Capture product/supplier changes for the change feed
+    from changefeed import register_change_capture
+    register_change_capture()
+    
+    from commands import register_commands
+    register_commands(app)
+    
+    if app.config['METRICS_ENABLED']:
+        init_metrics(app)
+    
+    from profiling import init_profiling
+    init_profiling(app, is_admin=current_user_is_admin)
+    
+    # After metrics so turned-away requests are still counted
+    from lanes import init_lanes
+    init_lanes(app)
+    
+    # After lanes so time spent queued for a slot is not taken from the budget
+    from deadlines import init_deadlines
+    init_deadlines(app)
+    
+    # Must run before anything touches app.jinja_env
+    from template_cache import init_template_cache
+    init_template_cache(app)
+    app.jinja_env.globals['asset_url'] = asset_url
+    
+    from maintenance import init_maintenance
+    init_maintenance(app)
+    
+    from alerts import init_alerts
+    init_alerts(app)
+    
+    # Registered after metrics so response sizes are recorded after compression
+    from compression import init_compression
+    init_compression(app)
+    
+    app.register_blueprint(bp)
+    
+    app.config['STARTUP_SECONDS'] = time.perf_counter() - started
+    return app
+
+def _reset_pools_after_fork(app):
+    """Drop pooled connections inherited from the parent in forked workers"""
+    if not hasattr(os, 'register_at_fork'):
+        return
+    
+    def reset():
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+    
+    os.register_at_fork(after_in_child=reset)
 
 def login_required(f):
     """Decorator to require login for protected routes"""
@@ -30,7 +109,7 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -40,12 +119,12 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
         
         user = User.query.get(session['user_id'])
         if not user or not user.is_admin():
             flash('Admin access required.', 'error')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -55,6 +134,69 @@ def get_current_user():
         return User.query.get(session['user_id'])
     return None
 
+def current_user_is_admin():
+    """Whether the logged-in user is an admin"""
+    user = get_current_user()
+    return bool(user and user.is_admin())
+
+def wants_rows():
+    """Whether the list page was asked for its table rows only (?partial=rows)"""
+    return request.args.get('partial') == 'rows'
+
+def render_rows(template, pagination, **context):
+    """Render just the <tbody> rows of a list page for live filtering"""
+    response = Response(render_template(template, partial=True, **context), mimetype='text/html')
+    response.headers['X-Total-Count'] = str(pagination.total)
+    response.headers['X-Page-Count'] = str(pagination.pages)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+class ExportWriter:
+    """csv.writer that counts data rows (everything after the header) for the metrics"""
+    
+    def __init__(self, output, report_type):
+        self.writer = csv.writer(output)
+        self.report_type = report_type
+        self.header_written = False
+    
+    def writerow(self, row):
+        self.writer.writerow(row)
+        if self.header_written:
+            inc_metric('inventory_export_rows_total', report=self.report_type)
+        else:
+            self.header_written = True
+
+_valuation_lock = threading.Lock()
+
+def catch_up_valuation():
+    """Fold up to one batch of movements recorded since the last run into the valuation.
+
+    Pages show the valuation as of valued_through(); a long backlog is left to
+    `flask value-inventory` rather than worked off inside a request. Requests
+    that find another thread already catching up don't wait for it. Runs
+    outside the request's query deadline, since an interrupted batch is rolled
+    back and would never make progress, and gives the request a fresh budget
+    afterwards so the catch-up is not charged to its own queries.
+    """
+    from valuation import run_valuation
+    if not _valuation_lock.acquire(blocking=False):
+        return
+    try:
+        with no_deadline():
+            run_valuation(max_batches=1)
+    finally:
+        _valuation_lock.release()
+    restart_deadline()
+
+def iter_chunks(iterable, size):
+    """Yield lists of up to size items from an iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 def validate_email(email):
     """Validate email format"""
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -68,20 +210,20 @@ def validate_password(password):
         return False, "Password must contain at least one letter"
     return True, "Password is valid"
 
-@app.route('/')
+@bp.route('/')
 def index():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
-    return redirect(url_for('dashboard'))
+        return redirect(url_for('main.login'))
+    return redirect(url_for('main.dashboard'))
 
-@app.route('/login', methods=['GET'])
+@bp.route('/login', methods=['GET'])
 def login():
     # Redirect if already logged in
     if 'user_id' in session:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     return render_template('login.html')
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login_post():
     """Handle login form submission"""
     username = request.form.get('username', '').strip()
@@ -90,7 +232,7 @@ def login_post():
     # Validate input
     if not username or not password:
         flash('Please enter both username and password.', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     
     # Find user
     user = User.query.filter_by(username=username).first()
@@ -110,19 +252,19 @@ def login_post():
         next_page = request.args.get('next')
         if next_page:
             return redirect(next_page)
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     else:
         flash('Invalid username or password.', 'error')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-@app.route('/register', methods=['GET'])
+@bp.route('/register', methods=['GET'])
 def register():
     # Redirect if already logged in
     if 'user_id' in session:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
     return render_template('register.html')
 
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register_post():
     """Handle registration form submission"""
     username = request.form.get('username', '').strip()
@@ -133,32 +275,32 @@ def register_post():
     # Validate input
     if not all([username, email, password, confirm_password]):
         flash('Please fill in all fields.', 'error')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
     
     # Validate username
     if len(username) < 3:
         flash('Username must be at least 3 characters long.', 'error')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
     
     if not re.match(r'^[a-zA-Z0-9_]+$', username):
         flash('Username can only contain letters, numbers, and underscores.', 'error')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
     
     # Validate email
     if not validate_email(email):
         flash('Please enter a valid email address.', 'error')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
     
     # Validate password
     is_valid, message = validate_password(password)
     if not is_valid:
         flash(message, 'error')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
     
     # Check password confirmation
     if password != confirm_password:
         flash('Passwords do not match.', 'error')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
     
     # Check if username or email already exists
     existing_user = User.query.filter(
@@ -170,7 +312,7 @@ def register_post():
             flash('Username already exists. Please choose a different one.', 'error')
         else:
             flash('Email already registered. Please use a different email.', 'error')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
     
     # Create new user
     try:
@@ -185,38 +327,62 @@ def register_post():
         db.session.commit()
         
         flash('Registration successful! Please log in.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
         
     except Exception as e:
         db.session.rollback()
         flash('Registration failed. Please try again.', 'error')
-        return redirect(url_for('register'))
+        return redirect(url_for('main.register'))
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
     """Dashboard with inventory overview"""
     user = get_current_user()
-    stats = get_inventory_stats()
-    
-    # Get recent transactions
-    recent_transactions = Transaction.query.order_by(
-        Transaction.created_at.desc()
-    ).limit(5).all()
     
-    # Get low stock products
+    # Independent reads run concurrently, each on its own session
     from models import get_low_stock_products, get_out_of_stock_products
-    low_stock_products = get_low_stock_products()
-    out_of_stock_products = get_out_of_stock_products()
+    results = run_parallel({
+        'stats': get_inventory_stats,
+        'recent_transactions': lambda: Transaction.query.options(
+            joinedload(Transaction.product), joinedload(Transaction.user)
+        ).order_by(Transaction.created_at.desc()).limit(5).all(),
+        'low_stock': get_low_stock_products,
+        'out_of_stock': get_out_of_stock_products,
+        'unread_alerts': lambda: AlertNotice.query.filter(AlertNotice.read_at.is_(None)).count()
+    })
+    stats = results['stats']
+    recent_transactions = results['recent_transactions']
+    low_stock_products = results['low_stock']
+    out_of_stock_products = results['out_of_stock']
     
     return render_template('dashboard.html', 
                          user=user,
                          stats=stats,
                          recent_transactions=recent_transactions,
                          low_stock_products=low_stock_products,
-                         out_of_stock_products=out_of_stock_products)
+                         out_of_stock_products=out_of_stock_products,
+                         unread_alerts=results['unread_alerts'])
 
-@app.route('/products')
+@bp.route('/dashboard/stream')
+@login_required
+def dashboard_stream():
+    """Server-Sent Events stream of stock movements for the dashboard"""
+    from events import broker, replay_events, start_event_poller, stream_events
+    
+    start_event_poller(current_app._get_current_object())
+    subscriber = broker.subscribe()
+    replay = replay_events(request.headers.get('Last-Event-ID', type=int), subscriber.start_id, broker.max_queue)
+    
+    # The generator needs no request context, so the DB session is released
+    # before streaming starts rather than being held for the connection lifetime
+    return Response(
+        stream_events(subscriber, replay),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/products')
 @login_required
 def products():
     """Display products with search and pagination"""
@@ -225,41 +391,19 @@ def products():
     category = request.args.get('category', '', type=str)
     supplier_id = request.args.get('supplier', '', type=int)
     stock_status = request.args.get('stock_status', '', type=str)
+    status = request.args.get('status', '', type=str)
     
-    # Build query
-    query = Product.query.filter_by(is_active=True)
-    
-    # Apply search filter
-    if search:
-        query = query.filter(
-            or_(
-                Product.name.contains(search),
-                Product.sku.contains(search),
-                Product.description.contains(search)
-            )
-        )
-    
-    # Apply category filter
-    if category:
-        query = query.filter(Product.category == category)
-    
-    # Apply supplier filter
-    if supplier_id:
-        query = query.filter(Product.supplier_id == supplier_id)
-    
-    # Apply stock status filter
-    if stock_status == 'low_stock':
-        query = query.filter(Product.quantity <= Product.min_stock_level)
-    elif stock_status == 'out_of_stock':
-        query = query.filter(Product.quantity <= 0)
-    elif stock_status == 'in_stock':
-        query = query.filter(Product.quantity > Product.min_stock_level)
+    query = Product.query.filter(*product_filter_conditions(search, category, supplier_id, stock_status, status))\
+        .options(joinedload(Product.supplier))
     
     # Paginate results
     products = query.order_by(Product.name).paginate(
         page=page, per_page=10, error_out=False
     )
     
+    if wants_rows():
+        return render_rows('partials/product_rows.html', products, products=products)
+    
     # Get filter options
     categories = db.session.query(Product.category).filter_by(is_active=True).distinct().all()
     categories = [cat[0] for cat in categories]
@@ -273,9 +417,82 @@ def products():
                          search=search,
                          selected_category=category,
                          selected_supplier=supplier_id,
-                         selected_stock_status=stock_status)
+                         selected_stock_status=stock_status,
+                         selected_status=status,
+                         bulk_actions=BULK_ACTIONS)
 
-@app.route('/products/add', methods=['GET', 'POST'])
+def product_filter_conditions(search='', category='', supplier_id=None, stock_status='', status=''):
+    """WHERE conditions of the product list filters (status 'deleted' lists inactive products)"""
+    conditions = [Product.is_active == (status != 'deleted')]
+    
+    # Apply search filter
+    if search:
+        conditions.append(or_(
+            Product.name.contains(search),
+            Product.sku.contains(search),
+            Product.description.contains(search)
+        ))
+    
+    # Apply category filter
+    if category:
+        conditions.append(Product.category == category)
+    
+    # Apply supplier filter
+    if supplier_id:
+        conditions.append(Product.supplier_id == supplier_id)
+    
+    # Apply stock status filter
+    if stock_status == 'low_stock':
+        conditions.append(Product.quantity <= Product.min_stock_level)
+    elif stock_status == 'out_of_stock':
+        conditions.append(Product.quantity <= 0)
+    elif stock_status == 'in_stock':
+        conditions.append(Product.quantity > Product.min_stock_level)
+    
+    return conditions
+
+@bp.route('/products/bulk', methods=['POST'])
+@login_required
+def bulk_products():
+    """Apply one bulk action to the selected products or to all products matching the filters"""
+    filters = {
+        'search': request.form.get('search', '').strip(),
+        'category': request.form.get('category', ''),
+        'supplier': request.form.get('supplier', '', type=int),
+        'stock_status': request.form.get('stock_status', ''),
+        'status': request.form.get('status', '')
+    }
+    back = redirect(url_for('main.products', **{k: v for k, v in filters.items() if v}))
+    
+    if request.form.get('scope') == 'filter':
+        conditions = product_filter_conditions(filters['search'], filters['category'], filters['supplier'],
+                                               filters['stock_status'], filters['status'])
+    else:
+        product_ids = request.form.getlist('product_ids', type=int)
+        if not product_ids:
+            flash('Select at least one product.', 'warning')
+            return back
+        conditions = [Product.id.in_(product_ids)]
+    
+    action = request.form.get('action', '')
+    value = {
+        'category': request.form.get('category_value'),
+        'supplier': request.form.get('supplier_value', type=int)
+    }.get(action, request.form.get('amount'))
+    
+    try:
+        changed = bulk_update_products(conditions, action, value)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return back
+    except Exception:
+        flash('Bulk update failed. No products were changed.', 'error')
+        return back
+    
+    flash(f'{BULK_ACTIONS.get(action, action)}: {changed} product(s) updated.', 'success' if changed else 'info')
+    return back
+
+@bp.route('/products/add', methods=['GET', 'POST'])
 @login_required
 def add_product():
     """Add new product"""
@@ -292,20 +509,20 @@ def add_product():
         # Validate input
         if not all([name, category, price is not None, quantity is not None, supplier_id]):
             flash('Please fill in all required fields.', 'error')
-            return redirect(url_for('add_product'))
+            return redirect(url_for('main.add_product'))
         
         if price < 0:
             flash('Price cannot be negative.', 'error')
-            return redirect(url_for('add_product'))
+            return redirect(url_for('main.add_product'))
         
         if quantity < 0:
             flash('Quantity cannot be negative.', 'error')
-            return redirect(url_for('add_product'))
+            return redirect(url_for('main.add_product'))
         
         # Check if SKU already exists
         if sku and Product.query.filter_by(sku=sku).first():
             flash('SKU already exists. Please use a different SKU.', 'error')
-            return redirect(url_for('add_product'))
+            return redirect(url_for('main.add_product'))
         
         # Create new product
         try:
@@ -319,23 +536,27 @@ def add_product():
                 sku=sku or None,
                 supplier_id=supplier_id
             )
+            if quantity:
+                new_product.stock_levels.append(
+                    StockLevel(location_id=get_default_location().id, quantity=quantity)
+                )
             
             db.session.add(new_product)
             db.session.commit()
             
             flash(f'Product "{name}" added successfully!', 'success')
-            return redirect(url_for('products'))
+            return redirect(url_for('main.products'))
             
         except Exception as e:
             db.session.rollback()
             flash('Failed to add product. Please try again.', 'error')
-            return redirect(url_for('add_product'))
+            return redirect(url_for('main.add_product'))
     
     # GET request - show form
     suppliers = Supplier.query.filter_by(is_active=True).all()
     return render_template('add_product.html', suppliers=suppliers)
 
-@app.route('/products/edit/<int:product_id>', methods=['GET', 'POST'])
+@bp.route('/products/edit/<int:product_id>', methods=['GET', 'POST'])
 @login_required
 def edit_product(product_id):
     """Edit existing product"""
@@ -354,50 +575,68 @@ def edit_product(product_id):
         # Validate input
         if not all([name, category, price is not None, quantity is not None, supplier_id]):
             flash('Please fill in all required fields.', 'error')
-            return redirect(url_for('edit_product', product_id=product_id))
+            return redirect(url_for('main.edit_product', product_id=product_id))
         
         if price < 0:
             flash('Price cannot be negative.', 'error')
-            return redirect(url_for('edit_product', product_id=product_id))
+            return redirect(url_for('main.edit_product', product_id=product_id))
         
         if quantity < 0:
             flash('Quantity cannot be negative.', 'error')
-            return redirect(url_for('edit_product', product_id=product_id))
+            return redirect(url_for('main.edit_product', product_id=product_id))
         
         # Check if SKU already exists (excluding current product)
         if sku:
             existing_sku = Product.query.filter(Product.sku == sku, Product.id != product_id).first()
             if existing_sku:
                 flash('SKU already exists. Please use a different SKU.', 'error')
-                return redirect(url_for('edit_product', product_id=product_id))
+                return redirect(url_for('main.edit_product', product_id=product_id))
         
         # Update product
         try:
+            old_status = product.get_stock_status()
             product.name = name
             product.category = category
             product.description = description
             product.price = price
-            product.quantity = quantity
             product.min_stock_level = min_stock_level or 10
             product.sku = sku or None
             product.supplier_id = supplier_id
             product.updated_at = datetime.utcnow()
             
-            db.session.commit()
+            # Stock is per location: a changed total is recorded as a
+            # movement at the default location (update_stock commits)
+            difference = quantity - product.quantity
+            if difference:
+                product.update_stock(
+                    quantity_change=abs(difference),
+                    transaction_type='add' if difference > 0 else 'remove',
+                    user_id=session['user_id'],
+                    notes='Stock corrected on product edit'
+                )
+            else:
+                # A changed minimum can cross the low-stock threshold without a movement
+                product.add_stock_alert(old_status, product.quantity)
+                db.session.commit()
             
             flash(f'Product "{name}" updated successfully!', 'success')
-            return redirect(url_for('products'))
+            return redirect(url_for('main.products'))
             
+        except ValueError:
+            db.session.rollback()
+            flash(f'Cannot lower stock to {quantity}: the default location does not hold enough. '
+                  'Record stock-out transactions at the other locations instead.', 'error')
+            return redirect(url_for('main.edit_product', product_id=product_id))
         except Exception as e:
             db.session.rollback()
             flash('Failed to update product. Please try again.', 'error')
-            return redirect(url_for('edit_product', product_id=product_id))
+            return redirect(url_for('main.edit_product', product_id=product_id))
     
     # GET request - show form
     suppliers = Supplier.query.filter_by(is_active=True).all()
     return render_template('edit_product.html', product=product, suppliers=suppliers)
 
-@app.route('/products/delete/<int:product_id>', methods=['POST'])
+@bp.route('/products/delete/<int:product_id>', methods=['POST'])
 @login_required
 def delete_product(product_id):
     """Delete product (soft delete)"""
@@ -416,23 +655,24 @@ def delete_product(product_id):
         db.session.rollback()
         flash('Failed to delete product. Please try again.', 'error')
     
-    return redirect(url_for('products'))
+    return redirect(url_for('main.products'))
 
-@app.route('/products/view/<int:product_id>')
+@bp.route('/products/view/<int:product_id>')
 @login_required
 def view_product(product_id):
     """View product details"""
     product = Product.query.get_or_404(product_id)
     
     # Get recent transactions for this product
-    recent_transactions = Transaction.query.filter_by(product_id=product_id)\
+    recent_transactions = Transaction.query.options(joinedload(Transaction.note)).filter_by(product_id=product_id)\
         .order_by(Transaction.created_at.desc()).limit(10).all()
     
     return render_template('view_product.html', 
                          product=product, 
+                         stock_by_location=product.get_stock_by_location(),
                          recent_transactions=recent_transactions)
 
-@app.route('/api/products/search')
+@bp.route('/api/products/search')
 @login_required
 def api_product_search():
     """API endpoint for product search (for AJAX)"""
@@ -462,7 +702,58 @@ def api_product_search():
     
     return jsonify(results)
 
-@app.route('/suppliers')
+@bp.route('/api/products')
+@login_required
+def api_product_list():
+    """API endpoint listing active products (also served by asgi.py)"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 200)
+    category = request.args.get('category', '')
+    
+    query = Product.query.filter_by(is_active=True)
+    if category:
+        query = query.filter(Product.category == category)
+    
+    products = query.order_by(Product.name).offset((page - 1) * per_page).limit(per_page).all()
+    
+    return jsonify({
+        'page': page,
+        'per_page': per_page,
+        'items': [{
+            'id': product.id,
+            'name': product.name,
+            'sku': product.sku,
+            'price': product.price,
+            'quantity': product.quantity,
+            'category': product.category
+        } for product in products]
+    })
+
+@bp.route('/api/products/sku/<sku>')
+@login_required
+def api_product_by_sku(sku):
+    """API endpoint to look up a product by SKU (for scanners)"""
+    info = lookup_sku(sku)
+    if info is None or not info['is_active']:
+        # Not in the catalog yet (or just reactivated): ask the database
+        product = Product.query.filter_by(sku=sku, is_active=True).first()
+        if not product:
+            return jsonify({'error': 'Product not found'}), 404
+        info = product_record(product)
+    
+    return jsonify({
+        'id': info['id'],
+        'name': info['name'],
+        'sku': info['sku'],
+        'current_stock': info['quantity'],
+        'price': info['price'],
+        'category': info['category'],
+        'supplier': info['supplier'],
+        'is_low_stock': info['is_low_stock'],
+        'is_out_of_stock': info['is_out_of_stock']
+    })
+
+@bp.route('/suppliers')
 @login_required
 def suppliers():
     """Display suppliers with search and pagination"""
@@ -487,11 +778,14 @@ def suppliers():
         page=page, per_page=10, error_out=False
     )
     
+    if wants_rows():
+        return render_rows('partials/supplier_rows.html', suppliers, suppliers=suppliers)
+    
     return render_template('suppliers.html', 
                          suppliers=suppliers,
                          search=search)
 
-@app.route('/suppliers/add', methods=['GET', 'POST'])
+@bp.route('/suppliers/add', methods=['GET', 'POST'])
 @login_required
 def add_supplier():
     """Add new supplier"""
@@ -504,25 +798,25 @@ def add_supplier():
         # Validate input
         if not name:
             flash('Please provide a supplier name.', 'error')
-            return redirect(url_for('add_supplier'))
+            return redirect(url_for('main.add_supplier'))
         
         # Validate email if provided
         if email and not validate_email(email):
             flash('Please enter a valid email address.', 'error')
-            return redirect(url_for('add_supplier'))
+            return redirect(url_for('main.add_supplier'))
         
         # Check if supplier name already exists
         existing_supplier = Supplier.query.filter_by(name=name, is_active=True).first()
         if existing_supplier:
             flash('A supplier with this name already exists.', 'error')
-            return redirect(url_for('add_supplier'))
+            return redirect(url_for('main.add_supplier'))
         
         # Check if email already exists
         if email:
             existing_email = Supplier.query.filter_by(email=email, is_active=True).first()
             if existing_email:
                 flash('A supplier with this email already exists.', 'error')
-                return redirect(url_for('add_supplier'))
+                return redirect(url_for('main.add_supplier'))
         
         # Create new supplier
         try:
@@ -537,17 +831,17 @@ def add_supplier():
             db.session.commit()
             
             flash(f'Supplier "{name}" added successfully!', 'success')
-            return redirect(url_for('suppliers'))
+            return redirect(url_for('main.suppliers'))
             
         except Exception as e:
             db.session.rollback()
             flash('Failed to add supplier. Please try again.', 'error')
-            return redirect(url_for('add_supplier'))
+            return redirect(url_for('main.add_supplier'))
     
     # GET request - show form
     return render_template('add_supplier.html')
 
-@app.route('/suppliers/edit/<int:supplier_id>', methods=['GET', 'POST'])
+@bp.route('/suppliers/edit/<int:supplier_id>', methods=['GET', 'POST'])
 @login_required
 def edit_supplier(supplier_id):
     """Edit existing supplier"""
@@ -562,12 +856,12 @@ def edit_supplier(supplier_id):
         # Validate input
         if not name:
             flash('Please provide a supplier name.', 'error')
-            return redirect(url_for('edit_supplier', supplier_id=supplier_id))
+            return redirect(url_for('main.edit_supplier', supplier_id=supplier_id))
         
         # Validate email if provided
         if email and not validate_email(email):
             flash('Please enter a valid email address.', 'error')
-            return redirect(url_for('edit_supplier', supplier_id=supplier_id))
+            return redirect(url_for('main.edit_supplier', supplier_id=supplier_id))
         
         # Check if supplier name already exists (excluding current supplier)
         existing_supplier = Supplier.query.filter(
@@ -577,7 +871,7 @@ def edit_supplier(supplier_id):
         ).first()
         if existing_supplier:
             flash('A supplier with this name already exists.', 'error')
-            return redirect(url_for('edit_supplier', supplier_id=supplier_id))
+            return redirect(url_for('main.edit_supplier', supplier_id=supplier_id))
         
         # Check if email already exists (excluding current supplier)
         if email:
@@ -588,7 +882,7 @@ def edit_supplier(supplier_id):
             ).first()
             if existing_email:
                 flash('A supplier with this email already exists.', 'error')
-                return redirect(url_for('edit_supplier', supplier_id=supplier_id))
+                return redirect(url_for('main.edit_supplier', supplier_id=supplier_id))
         
         # Update supplier
         try:
@@ -601,17 +895,17 @@ def edit_supplier(supplier_id):
             db.session.commit()
             
             flash(f'Supplier "{name}" updated successfully!', 'success')
-            return redirect(url_for('suppliers'))
+            return redirect(url_for('main.suppliers'))
             
         except Exception as e:
             db.session.rollback()
             flash('Failed to update supplier. Please try again.', 'error')
-            return redirect(url_for('edit_supplier', supplier_id=supplier_id))
+            return redirect(url_for('main.edit_supplier', supplier_id=supplier_id))
     
     # GET request - show form
     return render_template('edit_supplier.html', supplier=supplier)
 
-@app.route('/suppliers/delete/<int:supplier_id>', methods=['POST'])
+@bp.route('/suppliers/delete/<int:supplier_id>', methods=['POST'])
 @login_required
 def delete_supplier(supplier_id):
     """Delete supplier (soft delete)"""
@@ -620,8 +914,8 @@ def delete_supplier(supplier_id):
     # Check if supplier has active products
     active_products = Product.query.filter_by(supplier_id=supplier_id, is_active=True).count()
     if active_products > 0:
-        flash(f'Cannot delete supplier "{supplier.name}" because it has {active_products} active products. Please reassign or delete the products first.', 'error')
-        return redirect(url_for('suppliers'))
+        flash(f'Cannot delete supplier "{supplier.name}" because it has {active_products} active products. Reassign or delete them first (select them on the products page filtered by this supplier and use the bulk actions).', 'error')
+        return redirect(url_for('main.suppliers'))
     
     try:
         # Soft delete - mark as inactive
@@ -636,17 +930,23 @@ def delete_supplier(supplier_id):
         db.session.rollback()
         flash('Failed to delete supplier. Please try again.', 'error')
     
-    return redirect(url_for('suppliers'))
+    return redirect(url_for('main.suppliers'))
 
-@app.route('/suppliers/view/<int:supplier_id>')
+@bp.route('/suppliers/view/<int:supplier_id>')
 @login_required
 def view_supplier(supplier_id):
     """View supplier details"""
-    supplier = Supplier.query.get_or_404(supplier_id)
+    results = run_parallel({
+        'supplier': lambda: db.session.get(Supplier, supplier_id),
+        'products': lambda: Product.query.filter_by(supplier_id=supplier_id, is_active=True)
+            .order_by(Product.name).all()
+    })
+    supplier = results['supplier']
+    if supplier is None:
+        abort(404)
     
     # Get products from this supplier
-    products = Product.query.filter_by(supplier_id=supplier_id, is_active=True)\
-        .order_by(Product.name).all()
+    products = results['products']
     
     # Calculate supplier statistics
     total_products = len(products)
@@ -666,7 +966,7 @@ def view_supplier(supplier_id):
                          products=products,
                          supplier_stats=supplier_stats)
 
-@app.route('/api/suppliers/search')
+@bp.route('/api/suppliers/search')
 @login_required
 def api_supplier_search():
     """API endpoint for supplier search (for AJAX)"""
@@ -695,7 +995,7 @@ def api_supplier_search():
     
     return jsonify(results)
 
-@app.route('/transactions')
+@bp.route('/transactions')
 @login_required
 def transactions():
     """Display transactions with search and pagination"""
@@ -708,7 +1008,10 @@ def transactions():
     date_to = request.args.get('date_to', '', type=str)
     
     # Build query
-    query = Transaction.query
+    query = Transaction.query.options(
+        joinedload(Transaction.product), joinedload(Transaction.user), joinedload(Transaction.location),
+        joinedload(Transaction.note)
+    )
     
     # Apply search filter
     if search:
@@ -716,13 +1019,13 @@ def transactions():
             or_(
                 Product.name.contains(search),
                 Product.sku.contains(search),
-                Transaction.notes.contains(search)
+                Transaction.note.has(TransactionNote.text.contains(search))
             )
         )
     
     # Apply transaction type filter
     if transaction_type:
-        query = query.filter(Transaction.transaction_type == transaction_type)
+        query = query.filter(Transaction.movement == MOVEMENT_TYPES.get(transaction_type))
     
     # Apply product filter
     if product_id:
@@ -733,6 +1036,7 @@ def transactions():
         query = query.filter(Transaction.user_id == user_id)
     
     # Apply date filters
+    from_date = to_date = None
     if date_from:
         try:
             from_date = datetime.strptime(date_from, '%Y-%m-%d')
@@ -749,10 +1053,29 @@ def transactions():
         except ValueError:
             pass
     
-    # Paginate results
-    transactions = query.order_by(Transaction.created_at.desc()).paginate(
-        page=page, per_page=15, error_out=False
-    )
+    # Paginate results, continuing into the archive when the range reaches it
+    query = query.order_by(Transaction.created_at.desc())
+    if from_date and range_reaches_archive(from_date):
+        product_ids = None
+        if search:
+            product_ids = {pid for (pid,) in db.session.query(Product.id).filter(
+                or_(Product.name.contains(search), Product.sku.contains(search))
+            )}
+        archive_filters = dict(
+            start_date=from_date, end_date=to_date,
+            product_id=product_id or None, user_id=user_id or None,
+            transaction_type=transaction_type or None,
+            product_ids=product_ids, notes_search=search or None
+        )
+        
+        transactions = LedgerPagination(
+            query=query, archive_filters=archive_filters, page=page, per_page=15, error_out=False
+        )
+    else:
+        transactions = query.paginate(page=page, per_page=15, error_out=False)
+    
+    if wants_rows():
+        return render_rows('partials/transaction_rows.html', transactions, transactions=transactions)
     
     # Get filter options
     products = Product.query.filter_by(is_active=True).order_by(Product.name).all()
@@ -760,6 +1083,7 @@ def transactions():
     
     return render_template('transactions.html', 
                          transactions=transactions,
+                         archived_through=archived_through(),
                          products=products,
                          users=users,
                          search=search,
@@ -769,7 +1093,7 @@ def transactions():
                          date_from=date_from,
                          date_to=date_to)
 
-@app.route('/transactions/add', methods=['GET', 'POST'])
+@bp.route('/transactions/add', methods=['GET', 'POST'])
 @login_required
 def add_transaction():
     """Add new transaction (stock in/out)"""
@@ -777,31 +1101,38 @@ def add_transaction():
         product_id = request.form.get('product_id', type=int)
         transaction_type = request.form.get('transaction_type', '').strip()
         quantity = request.form.get('quantity', type=int)
+        location_id = request.form.get('location_id', type=int)
         notes = request.form.get('notes', '').strip()
         
         # Validate input
         if not all([product_id, transaction_type, quantity]):
             flash('Please fill in all required fields.', 'error')
-            return redirect(url_for('add_transaction'))
+            return redirect(url_for('main.add_transaction'))
         
         if transaction_type not in ['add', 'remove']:
             flash('Invalid transaction type.', 'error')
-            return redirect(url_for('add_transaction'))
+            return redirect(url_for('main.add_transaction'))
         
         if quantity <= 0:
             flash('Quantity must be greater than zero.', 'error')
-            return redirect(url_for('add_transaction'))
+            return redirect(url_for('main.add_transaction'))
         
         # Get product
         product = Product.query.get(product_id)
         if not product or not product.is_active:
             flash('Invalid product selected.', 'error')
-            return redirect(url_for('add_transaction'))
+            return redirect(url_for('main.add_transaction'))
+        
+        location = Location.query.get(location_id) if location_id else get_default_location()
+        if not location or not location.is_active:
+            flash('Invalid location selected.', 'error')
+            return redirect(url_for('main.add_transaction'))
         
         # Check if removing more stock than available
-        if transaction_type == 'remove' and product.quantity < quantity:
-            flash(f'Cannot remove {quantity} units. Only {product.quantity} units available.', 'error')
-            return redirect(url_for('add_transaction'))
+        available = product.quantity_at(location.id)
+        if transaction_type == 'remove' and available < quantity:
+            flash(f'Cannot remove {quantity} units. Only {available} units available at {location.code}.', 'error')
+            return redirect(url_for('main.add_transaction'))
         
         # Create transaction and update stock
         try:
@@ -809,7 +1140,8 @@ def add_transaction():
                 quantity_change=quantity,
                 transaction_type=transaction_type,
                 user_id=session['user_id'],
-                notes=notes or None
+                notes=notes or None,
+                location_id=location.id
             )
             
             # Set unit price for the transaction
@@ -818,47 +1150,120 @@ def add_transaction():
             
             action_word = 'added to' if transaction_type == 'add' else 'removed from'
             flash(f'Successfully {action_word} {product.name}: {quantity} units', 'success')
-            return redirect(url_for('transactions'))
+            return redirect(url_for('main.transactions'))
             
         except ValueError as e:
             flash(str(e), 'error')
-            return redirect(url_for('add_transaction'))
+            return redirect(url_for('main.add_transaction'))
         except Exception as e:
             db.session.rollback()
             flash('Failed to record transaction. Please try again.', 'error')
-            return redirect(url_for('add_transaction'))
+            return redirect(url_for('main.add_transaction'))
     
     # GET request - show form
     products = Product.query.filter_by(is_active=True).order_by(Product.name).all()
+    default_location = get_default_location()
+    db.session.commit()  # Keeps the default location if it was just added
+    locations = Location.query.filter_by(is_active=True).order_by(Location.code).all()
     
     # Pre-select product if provided in URL
     selected_product_id = request.args.get('product_id', type=int)
     selected_type = request.args.get('type', '')
+    selected_location_id = request.args.get('location_id', default_location.id, type=int)
     
     return render_template('add_transaction.html', 
                          products=products,
+                         locations=locations,
                          selected_product_id=selected_product_id,
-                         selected_type=selected_type)
+                         selected_type=selected_type,
+                         selected_location_id=selected_location_id)
 
-@app.route('/api/transactions/product-info/<int:product_id>')
+@bp.route('/api/transactions/product-info/<int:product_id>')
 @login_required
 def api_product_info(product_id):
     """API endpoint to get product info for transaction form"""
-    product = Product.query.get_or_404(product_id)
+    info = lookup_product(product_id)
+    if info is None:
+        info = product_record(Product.query.get_or_404(product_id))
     
     return jsonify({
-        'id': product.id,
-        'name': product.name,
-        'sku': product.sku,
-        'current_stock': product.quantity,
-        'price': product.price,
-        'category': product.category,
-        'supplier': product.supplier.name,
-        'is_low_stock': product.is_low_stock(),
-        'is_out_of_stock': product.is_out_of_stock()
+        'id': info['id'],
+        'name': info['name'],
+        'sku': info['sku'],
+        'current_stock': info['quantity'],
+        'stock_by_location': info['stock_by_location'],
+        'price': info['price'],
+        'category': info['category'],
+        'supplier': info['supplier'],
+        'is_low_stock': info['is_low_stock'],
+        'is_out_of_stock': info['is_out_of_stock']
     })
 
-@app.route('/reports')
+@bp.route('/api/changes/transactions')
+@login_required
+def api_transaction_changes():
+    """Change feed of ledger movements since a cursor (NDJSON)"""
+    from changefeed import parse_page_args, read_transaction_changes, to_ndjson
+    
+    cursor, limit = parse_page_args(request.args)
+    records, next_cursor = read_transaction_changes(cursor, limit)
+    
+    return Response(
+        to_ndjson(records),
+        mimetype='application/x-ndjson',
+        headers={'X-Next-Cursor': str(next_cursor), 'X-Has-More': str(len(records) == limit).lower()}
+    )
+
+@bp.route('/api/changes/catalog')
+@login_required
+def api_catalog_changes():
+    """Change feed of product and supplier changes since a cursor (NDJSON)"""
+    from changefeed import parse_page_args, read_catalog_changes, to_ndjson
+    
+    cursor, limit = parse_page_args(request.args)
+    entity = request.args.get('entity', '')
+    if entity not in ('', 'product', 'supplier'):
+        return jsonify({'error': 'entity must be product or supplier'}), 400
+    
+    records, next_cursor = read_catalog_changes(cursor, limit, entity or None)
+    
+    return Response(
+        to_ndjson(records),
+        mimetype='application/x-ndjson',
+        headers={'X-Next-Cursor': str(next_cursor), 'X-Has-More': str(len(records) == limit).lower()}
+    )
+
+def merge_archived_totals(transaction_totals, top_products, start_date, end_date, include_archive):
+    """Per-type totals and the top 10 products, with archived movements in the range added in"""
+    totals = {MOVEMENT_NAMES[movement]: [count, quantity or 0]
+              for movement, count, quantity in transaction_totals}
+    if not include_archive:
+        return totals, top_products
+    
+    by_product = {row.product_id: dict(row._mapping) for row in top_products}
+    for row in iter_archived_transactions(start_date=start_date, end_date=end_date):
+        check_deadline()
+        type_totals = totals.setdefault(row.transaction_type, [0, 0])
+        type_totals[0] += 1
+        type_totals[1] += row.quantity
+        
+        entry = by_product.get(row.product_id)
+        if entry is None:
+            entry = by_product[row.product_id] = {
+                'product_id': row.product_id, 'name': None, 'total_quantity': 0, 'transaction_count': 0
+            }
+        entry['total_quantity'] += row.quantity
+        entry['transaction_count'] += 1
+    
+    top_products = sorted(by_product.values(), key=lambda e: e['total_quantity'], reverse=True)[:10]
+    missing_names = [e['product_id'] for e in top_products if e['name'] is None]
+    if missing_names:
+        names = dict(db.session.query(Product.id, Product.name).filter(Product.id.in_(missing_names)))
+        for entry in top_products:
+            entry['name'] = entry['name'] or names.get(entry['product_id'])
+    return totals, top_products
+
+@bp.route('/reports')
 @login_required
 def reports():
     """Reports dashboard"""
@@ -885,43 +1290,85 @@ def reports():
         date_from = start_date.strftime('%Y-%m-%d')
         date_to = end_date.strftime('%Y-%m-%d')
     
-    # Get inventory statistics
-    stats = get_inventory_stats()
-    
-    # Get transactions in date range
-    transactions_in_range = Transaction.query.filter(
-        Transaction.created_at >= start_date,
-        Transaction.created_at <= end_date
-    ).all()
+    def transaction_totals():
+        # Count and sum movements per type in the database
+        return db.session.query(
+            Transaction.movement,
+            func.count(Transaction.id),
+            func.sum(Transaction.quantity)
+        ).filter(
+            Transaction.created_at >= start_date,
+            Transaction.created_at <= end_date
+        ).group_by(Transaction.movement).all()
+    
+    # Older parts of the range are read from the ledger archive
+    include_archive = range_reaches_archive(start_date)
+    
+    def top_products():
+        # Top products by transaction volume (all of them when archive totals get merged in)
+        query = db.session.query(
+            Product.id.label('product_id'),
+            Product.name,
+            func.sum(Transaction.quantity).label('total_quantity'),
+            func.count(Transaction.id).label('transaction_count')
+        ).join(Transaction).filter(
+            Transaction.created_at >= start_date,
+            Transaction.created_at <= end_date
+        ).group_by(Product.id).order_by(func.sum(Transaction.quantity).desc())
+        return query.all() if include_archive else query.limit(10).all()
+    
+    def category_stats():
+        # Category breakdown
+        return db.session.query(
+            Product.category,
+            func.count(Product.id).label('product_count'),
+            func.sum(Product.quantity * Product.price).label('total_value')
+        ).filter(Product.is_active == True).group_by(Product.category).all()
+    
+    # Catch the valuation up with movements recorded since the last run
+    from valuation import valuation_by_product, cogs_by_period, valued_through
+    catch_up_valuation()
+    
+    # Independent reads run concurrently, each on its own session. The range-dependent
+    # sections come last and are left out if the range is too large for the deadline
+    from models import get_low_stock_products, get_out_of_stock_products
+    from forecast import reorder_suggestions
+    results = run_parallel({
+        'stats': get_inventory_stats,
+        'low_stock': get_low_stock_products,
+        'out_of_stock': get_out_of_stock_products,
+        'category_stats': category_stats,
+        'reorder': reorder_suggestions,
+        'valuation': valuation_by_product,
+        'cogs': lambda: cogs_by_period(start_date.strftime('%Y-%m'), end_date.strftime('%Y-%m')),
+        'transaction_totals': skip_on_timeout(transaction_totals),
+        'top_products': skip_on_timeout(top_products)
+    })
     
     # Calculate transaction statistics
-    stock_in_count = len([t for t in transactions_in_range if t.transaction_type == 'add'])
-    stock_out_count = len([t for t in transactions_in_range if t.transaction_type == 'remove'])
-    stock_in_quantity = sum(t.quantity for t in transactions_in_range if t.transaction_type == 'add')
-    stock_out_quantity = sum(t.quantity for t in transactions_in_range if t.transaction_type == 'remove')
+    timed_out = results['transaction_totals'] is None or results['top_products'] is None
+    totals, top_products = {}, []
+    if not timed_out:
+        try:
+            totals, top_products = merge_archived_totals(
+                results['transaction_totals'], results['top_products'], start_date, end_date, include_archive
+            )
+        except QueryTimeout:
+            timed_out = True
+    narrow_from = None
+    if timed_out:
+        lift_deadline()  # Render the rest of the page
+        from datetime import timedelta
+        if (end_date - start_date).days > 30:
+            narrow_from = (end_date - timedelta(days=29)).strftime('%Y-%m-%d')
     
-    # Get low stock and out of stock products
-    from models import get_low_stock_products, get_out_of_stock_products
-    low_stock_products = get_low_stock_products()
-    out_of_stock_products = get_out_of_stock_products()
-    
-    # Get top products by transaction volume
-    from sqlalchemy import func
-    top_products = db.session.query(
-        Product.name,
-        func.sum(Transaction.quantity).label('total_quantity'),
-        func.count(Transaction.id).label('transaction_count')
-    ).join(Transaction).filter(
-        Transaction.created_at >= start_date,
-        Transaction.created_at <= end_date
-    ).group_by(Product.id).order_by(func.sum(Transaction.quantity).desc()).limit(10).all()
-    
-    # Get category breakdown
-    category_stats = db.session.query(
-        Product.category,
-        func.count(Product.id).label('product_count'),
-        func.sum(Product.quantity * Product.price).label('total_value')
-    ).filter(Product.is_active == True).group_by(Product.category).all()
+    stock_in_count, stock_in_quantity = totals.get('add', (0, 0))
+    stock_out_count, stock_out_quantity = totals.get('remove', (0, 0))
+    
+    stats = results['stats']
+    low_stock_products = results['low_stock']
+    out_of_stock_products = results['out_of_stock']
+    category_stats = results['category_stats']
     
     report_data = {
         'date_range': {
@@ -935,28 +1382,68 @@ def reports():
             'stock_out_count': stock_out_count,
             'stock_in_quantity': stock_in_quantity,
             'stock_out_quantity': stock_out_quantity,
-            'total_transactions': len(transactions_in_range)
+            'total_transactions': stock_in_count + stock_out_count
         },
         'alerts': {
             'low_stock_products': low_stock_products,
             'out_of_stock_products': out_of_stock_products
         },
         'top_products': top_products,
-        'category_stats': category_stats
+        'category_stats': category_stats,
+        # Most urgent first, regardless of supplier
+        'reorder': sorted(results['reorder'], key=lambda r: r['days_of_cover'])[:10],
+        'reorder_count': len(results['reorder']),
+        'valuation': {
+            'fifo_value': sum(row['fifo_value'] for row in results['valuation']),
+            'average_value': sum(row['average_value'] for row in results['valuation']),
+            'list_value': sum(row['list_value'] for row in results['valuation']),
+            'valued_through': valued_through()
+        },
+        'cogs': results['cogs'],
+        'timed_out': timed_out,
+        'narrow_from': narrow_from,
+        'deadline_seconds': current_app.config['QUERY_DEADLINES']['heavy']
     }
     
     return render_template('reports.html', 
                          report_data=report_data,
                          date_from=date_from,
-                         date_to=date_to)
+                         date_to=date_to,
+                         export_format_label='Parquet' if resolve_format('parquet') == 'parquet' else 'CSV, gzip')
 
-@app.route('/reports/export')
+def parse_as_of_date(value):
+    """Parse an 'as of' date, meaning the end of that day"""
+    return datetime.strptime(value, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+
+@bp.route('/reports/inventory-as-of')
+@login_required
+def inventory_as_of_report():
+    """Inventory levels and value as of a past date"""
+    from snapshots import inventory_as_of
+    
+    as_of = request.args.get('date', '') or datetime.utcnow().strftime('%Y-%m-%d')
+    try:
+        when = parse_as_of_date(as_of)
+    except ValueError:
+        flash('Invalid date format.', 'error')
+        return redirect(url_for('main.reports'))
+    
+    levels = inventory_as_of(when)
+    
+    return render_template('inventory_as_of.html',
+                         levels=levels,
+                         as_of=as_of,
+                         total_value=sum(level.get_total_value() for level in levels),
+                         total_units=sum(level.quantity for level in levels))
+
+@bp.route('/reports/export')
 @login_required
 def export_report():
-    """Export reports as CSV"""
+    """Export reports as CSV, or inventory and transactions as a compressed file (format=parquet|arrow|csv.gz)"""
     report_type = request.args.get('type', 'inventory')
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
+    export_format = request.args.get('format', 'csv')
     
     # Set default date range if not provided
     if not date_from or not date_to:
@@ -971,16 +1458,24 @@ def export_report():
         end_date = datetime.strptime(date_to, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
     except ValueError:
         flash('Invalid date format.', 'error')
-        return redirect(url_for('reports'))
+        return redirect(url_for('main.reports'))
     
-    from flask import Response
+    if export_format != 'csv':
+        # Written to a file first so the download can be resumed with range requests
+        try:
+            name = write_export(report_type, resolve_format(export_format), date_from, date_to,
+                                start_date, end_date)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('main.reports'))
+        return redirect(url_for('main.download_export', filename=name))
     
     if report_type == 'inventory':
         # Export current inventory
         products = Product.query.filter_by(is_active=True).order_by(Product.name).all()
         
         output = StringIO()
-        writer = csv.writer(output)
+        writer = ExportWriter(output, report_type)
         
         # Write header
         writer.writerow(['Product Name', 'SKU', 'Category', 'Supplier', 'Price', 'Current Stock', 'Min Stock Level', 'Stock Status', 'Total Value'])
@@ -1007,37 +1502,105 @@ def export_report():
         )
     
     elif report_type == 'transactions':
-        # Export transactions in date range
-        transactions = Transaction.query.filter(
-            Transaction.created_at >= start_date,
-            Transaction.created_at <= end_date
-        ).order_by(Transaction.created_at.desc()).all()
+        # Export transactions in date range, streamed so large ranges never sit in memory
+        def write_rows(writer, transactions):
+            for transaction in transactions:
+                writer.writerow([
+                    transaction.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                    transaction.product.name,
+                    transaction.product.sku or '',
+                    'Stock In' if transaction.transaction_type == 'add' else 'Stock Out',
+                    transaction.quantity,
+                    transaction.old_quantity,
+                    transaction.new_quantity,
+                    transaction.user.username,
+                    transaction.notes or ''
+                ])
+        
+        def generate():
+            output = StringIO()
+            writer = ExportWriter(output, report_type)
+            
+            # Write header
+            writer.writerow(['Date', 'Product', 'SKU', 'Type', 'Quantity', 'Old Stock', 'New Stock', 'User', 'Notes'])
+            
+            # Hot rows first (newest), then archived rows, in chunks
+            chunk_size = current_app.config['EXPORT_CHUNK_SIZE']
+            hot_rows = db.session.execute(
+                select(Transaction).options(
+                    joinedload(Transaction.product), joinedload(Transaction.user), joinedload(Transaction.note)
+                ).filter(
+                    Transaction.created_at >= start_date,
+                    Transaction.created_at <= end_date
+                ).order_by(Transaction.created_at.desc()),
+                execution_options={'yield_per': chunk_size}
+            ).scalars()
+            
+            chunks = iter_chunks(hot_rows, chunk_size)
+            archived = None
+            if range_reaches_archive(start_date):
+                archived = iter_archived_transactions(start_date=start_date, end_date=end_date, newest_first=True)
+                chunks = itertools.chain(chunks, (
+                    attach_relations(chunk) for chunk in iter_chunks(archived, chunk_size)
+                ))
+            
+            try:
+                for chunk in chunks:
+                    write_rows(writer, chunk)
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate()
+                    restart_deadline()  # The budget is per chunk; a slow client is not a slow query
+                yield output.getvalue()
+            except GeneratorExit:
+                # The server closes the response when the client has gone: stop reading rows
+                cancel_deadline()
+                raise
+            finally:
+                hot_rows.close()
+                if archived is not None:
+                    archived.close()
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=transactions_report_{date_from}_to_{date_to}.csv'}
+        )
+    
+    elif report_type == 'inventory_as_of':
+        # Export inventory levels reconstructed for a past date
+        from snapshots import inventory_as_of
+        
+        as_of = request.args.get('date', '') or datetime.utcnow().strftime('%Y-%m-%d')
+        try:
+            when = parse_as_of_date(as_of)
+        except ValueError:
+            flash('Invalid date format.', 'error')
+            return redirect(url_for('main.reports'))
         
         output = StringIO()
-        writer = csv.writer(output)
+        writer = ExportWriter(output, report_type)
         
         # Write header
-        writer.writerow(['Date', 'Product', 'SKU', 'Type', 'Quantity', 'Old Stock', 'New Stock', 'User', 'Notes'])
+        writer.writerow(['Product Name', 'SKU', 'Category', 'Supplier', 'Price', 'Stock', 'Total Value'])
         
         # Write data
-        for transaction in transactions:
+        for level in inventory_as_of(when):
             writer.writerow([
-                transaction.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                transaction.product.name,
-                transaction.product.sku or '',
-                'Stock In' if transaction.transaction_type == 'add' else 'Stock Out',
-                transaction.quantity,
-                transaction.old_quantity,
-                transaction.new_quantity,
-                transaction.user.username,
-                transaction.notes or ''
+                level.product.name,
+                level.product.sku or '',
+                level.product.category,
+                level.product.supplier.name,
+                level.unit_price,
+                level.quantity,
+                level.get_total_value()
             ])
         
         output.seek(0)
         return Response(
             output.getvalue(),
             mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename=transactions_report_{date_from}_to_{date_to}.csv'}
+            headers={'Content-Disposition': f'attachment; filename=inventory_as_of_{as_of}.csv'}
         )
     
     elif report_type == 'low_stock':
@@ -1047,7 +1610,7 @@ def export_report():
         out_of_stock = get_out_of_stock_products()
         
         output = StringIO()
-        writer = csv.writer(output)
+        writer = ExportWriter(output, report_type)
         
         # Write header
         writer.writerow(['Product Name', 'SKU', 'Category', 'Supplier', 'Current Stock', 'Min Stock Level', 'Status'])
@@ -1084,30 +1647,164 @@ def export_report():
             headers={'Content-Disposition': f'attachment; filename=low_stock_report_{datetime.now().strftime("%Y%m%d")}.csv'}
         )
     
+    elif report_type == 'valuation':
+        # Export per-product FIFO and weighted-average valuation
+        from valuation import valuation_by_product
+        catch_up_valuation()
+        
+        output = StringIO()
+        writer = ExportWriter(output, report_type)
+        
+        writer.writerow(['Product Name', 'SKU', 'Category', 'Supplier', 'Quantity', 'FIFO Value',
+                         'Average Unit Cost', 'Weighted Average Value', 'List Price', 'List Value'])
+        
+        for row in valuation_by_product():
+            product = row['product']
+            writer.writerow([
+                product.name,
+                product.sku or '',
+                product.category,
+                product.supplier.name,
+                row['quantity'],
+                f"{row['fifo_value']:.2f}",
+                f"{row['average_cost']:.4f}",
+                f"{row['average_value']:.2f}",
+                product.price,
+                f"{row['list_value']:.2f}"
+            ])
+        
+        output.seek(0)
+        return Response(
+            output.getvalue(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=inventory_valuation_{datetime.now().strftime("%Y%m%d")}.csv'}
+        )
+    
+    elif report_type == 'cogs':
+        # Export monthly cost of goods sold for the selected range
+        from valuation import cogs_by_period
+        catch_up_valuation()
+        
+        output = StringIO()
+        writer = ExportWriter(output, report_type)
+        
+        writer.writerow(['Period', 'Units In', 'Cost In', 'Units Out', 'FIFO COGS', 'Weighted Average COGS'])
+        
+        for row in cogs_by_period(start_date.strftime('%Y-%m'), end_date.strftime('%Y-%m')):
+            writer.writerow([
+                row.period,
+                row.quantity_in,
+                f'{row.cost_in:.2f}',
+                row.quantity_out,
+                f'{row.fifo_cogs:.2f}',
+                f'{row.average_cogs:.2f}'
+            ])
+        
+        output.seek(0)
+        return Response(
+            output.getvalue(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=cogs_{date_from}_to_{date_to}.csv'}
+        )
+    
+    elif report_type == 'reorder':
+        # Export reorder suggestions grouped by supplier
+        from forecast import reorder_suggestions
+        suggestions = reorder_suggestions()
+        
+        output = StringIO()
+        writer = ExportWriter(output, report_type)
+        
+        writer.writerow(['Supplier', 'Product Name', 'SKU', 'Current Stock', 'Min Stock Level',
+                         'Daily Velocity', 'Daily Std Dev', 'Days of Cover', 'Reorder Point', 'Suggested Order Qty'])
+        
+        for row in suggestions:
+            writer.writerow([
+                row['supplier'],
+                row['name'],
+                row['sku'] or '',
+                row['quantity'],
+                row['min_stock_level'],
+                f"{row['velocity']:.2f}",
+                f"{row['variability']:.2f}",
+                f"{row['days_of_cover']:.1f}",
+                row['reorder_point'],
+                row['order_quantity']
+            ])
+        
+        output.seek(0)
+        return Response(
+            output.getvalue(),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename=reorder_suggestions_{datetime.now().strftime("%Y%m%d")}.csv'}
+        )
+    
     else:
         flash('Invalid report type.', 'error')
-        return redirect(url_for('reports'))
+        return redirect(url_for('main.reports'))
 
-@app.route('/about')
+@bp.route('/reports/exports/<filename>')
+@login_required
+def download_export(filename):
+    """Serve a finished export file; supports Range and If-Range so broken downloads resume"""
+    names = split_name(filename)
+    if names is None:
+        abort(404)
+    download_name, mimetype = names
+    response = send_from_directory(export_dir(), filename, mimetype=mimetype,
+                                   as_attachment=True, download_name=download_name)
+    # Werkzeug only sends this on range requests; download managers look for it on the first response
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@bp.route('/alerts')
+@login_required
+def alerts():
+    """Inbox of delivered low-stock alerts"""
+    results = run_parallel({
+        'unread': lambda: AlertNotice.query.options(joinedload(AlertNotice.product))
+            .filter(AlertNotice.read_at.is_(None)).order_by(AlertNotice.id.desc()).limit(200).all(),
+        'read': lambda: AlertNotice.query.options(joinedload(AlertNotice.product))
+            .filter(AlertNotice.read_at.isnot(None)).order_by(AlertNotice.id.desc()).limit(20).all(),
+        'outbox': lambda: dict(db.session.query(StockAlert.status, func.count())
+            .filter(StockAlert.status.in_(('pending', 'claimed', 'failed'))).group_by(StockAlert.status).all())
+    })
+    return render_template('alerts.html', **results)
+
+@bp.route('/alerts/read', methods=['POST'])
+@login_required
+def mark_alerts_read():
+    """Mark one notice (notice_id) or every unread notice as read"""
+    query = AlertNotice.query.filter(AlertNotice.read_at.is_(None))
+    notice_id = request.form.get('notice_id', type=int)
+    if notice_id:
+        query = query.filter(AlertNotice.id == notice_id)
+    count = query.update({AlertNotice.read_at: datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    if not notice_id:
+        flash(f'{count} alert(s) marked as read.', 'success')
+    return redirect(url_for('main.alerts'))
+
+@bp.route('/about')
 def about():
     return render_template('about.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle user logout"""
     username = session.get('username', 'User')
     session.clear()
     flash(f'Goodbye, {username}! You have been logged out successfully.', 'success')
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/profile')
+@bp.route('/profile')
 @login_required
 def profile():
     """User profile page"""
     user = get_current_user()
     return render_template('profile.html', user=user)
 
-@app.route('/change-password', methods=['POST'])
+@bp.route('/change-password', methods=['POST'])
 @login_required
 def change_password():
     """Handle password change"""
@@ -1119,18 +1816,18 @@ def change_password():
     # Validate current password
     if not user.check_password(current_password):
         flash('Current password is incorrect.', 'error')
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
     
     # Validate new password
     is_valid, message = validate_password(new_password)
     if not is_valid:
         flash(message, 'error')
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
     
     # Check password confirmation
     if new_password != confirm_password:
         flash('New passwords do not match.', 'error')
-        return redirect(url_for('profile'))
+        return redirect(url_for('main.profile'))
     
     # Update password
     try:
@@ -1141,25 +1838,83 @@ def change_password():
         db.session.rollback()
         flash('Failed to change password. Please try again.', 'error')
     
-    return redirect(url_for('profile'))
+    return redirect(url_for('main.profile'))
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('errors/500.html'), 500
 
-@app.errorhandler(403)
+@bp.app_errorhandler(403)
 def forbidden_error(error):
     return render_template('errors/403.html'), 403
 
-@app.context_processor
+@bp.route('/admin/profiles')
+@admin_required
+def profiles():
+    """Captured request profiles"""
+    from profiling import list_profiles
+    return render_template('profiles.html',
+                         profiles=list_profiles(),
+                         sample_rate=current_app.config['PROFILE_SAMPLE_RATE'])
+
+@bp.route('/admin/profiles/<profile_id>')
+@admin_required
+def view_profile(profile_id):
+    """Slowest functions and top allocation sites of one capture"""
+    from profiling import load_profile
+    profile = load_profile(profile_id)
+    if profile is None:
+        flash('Profile not found.', 'error')
+        return redirect(url_for('main.profiles'))
+    return render_template('view_profile.html', profile=profile)
+
+@bp.route('/admin/profiles/<profile_id>/download')
+@admin_required
+def download_profile(profile_id):
+    """Raw pstats file, for snakeviz or a flame graph tool"""
+    from profiling import profile_dir
+    return send_from_directory(profile_dir(), f'{profile_id}.prof', as_attachment=True)
+
+@bp.route('/assets/<path:filename>')
+def asset(filename):
+    """Fingerprinted static files from `flask build-assets`"""
+    return send_asset(filename)
+
+@bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint, merged across all worker processes"""
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    flush_metrics(force=True)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@bp.after_app_request
+def add_server_timing(response):
+    """Expose per-task query timings recorded by run_parallel, plus template render time"""
+    timings = dict(g.get('query_timings') or {})
+    if 'render_seconds' in g:
+        timings['render'] = g.render_seconds
+    if timings:
+        response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
+@bp.app_context_processor
 def inject_user():
     """Make current user available in all templates"""
     return dict(current_user=get_current_user())
 
 if __name__ == '__main__':
+    app = create_app()
+    
+    # Convenience for local development - production runs `flask init-db` once
+    with app.app_context():
+        db.create_all()
+        create_default_admin()
+    
     app.run(debug=True)
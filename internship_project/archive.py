@@ -0,0 +1,365 @@
+"""
+Ledger archival tier
+Transactions older than ARCHIVE_HORIZON_DAYS are moved out of the hot
+transactions table into gzip-compressed JSON-lines segments, one directory
+per month, tracked by the archive_partitions manifest. The ledger list,
+reports and exports read the archive transparently whenever the requested
+date range reaches back past the archive boundary.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from itertools import islice
+
+from flask import current_app
+from flask_sqlalchemy.pagination import QueryPagination
+from sqlalchemy.orm import selectinload
+
+from ledger_encoding import needs_autoincrement
+from models import db, Product, User, Location, Transaction, TransactionNote, ArchivePartition, StockAlert
+
+
+class ArchivedTransaction:
+    """Read-only ledger row loaded from an archive segment"""
+
+    archived = True
+
+    def __init__(self, record):
+        self.id = record['id']
+        self.product_id = record['product_id']
+        self.user_id = record['user_id']
+        self.location_id = record.get('location_id')  # Absent in segments written before locations
+        self.transaction_type = record['transaction_type']
+        self.quantity = record['quantity']
+        self.old_quantity = record['old_quantity']
+        self.new_quantity = record['new_quantity']
+        self.unit_price = record['unit_price']
+        self.notes = record['notes']
+        self.created_at = datetime.fromisoformat(record['created_at'])
+        self.product = None
+        self.user = None
+        self.location = None
+
+    def get_total_value(self):
+        """Get total value of transaction"""
+        if self.unit_price:
+            return self.quantity * self.unit_price
+        return 0
+
+    def to_dict(self):
+        """Serialize in the same shape as Transaction.to_dict()"""
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'user_id': self.user_id,
+            'location_id': self.location_id,
+            'transaction_type': self.transaction_type,
+            'quantity': self.quantity,
+            'old_quantity': self.old_quantity,
+            'new_quantity': self.new_quantity,
+            'unit_price': self.unit_price,
+            'notes': self.notes,
+            'created_at': self.created_at.isoformat()
+        }
+
+
+def archive_dir():
+    """Directory holding archive segments"""
+    return current_app.config['ARCHIVE_DIR'] or os.path.join(current_app.instance_path, 'archive')
+
+
+def archived_through():
+    """Timestamp of the newest archived transaction, or None if nothing is archived"""
+    return db.session.query(db.func.max(ArchivePartition.last_at)).scalar()
+
+
+def range_reaches_archive(start_date):
+    """Whether a query starting at start_date needs archived rows"""
+    boundary = archived_through()
+    return boundary is not None and (start_date is None or start_date <= boundary)
+
+
+def _segment_path(partition):
+    return os.path.join(archive_dir(), partition.path)
+
+
+def _file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_segment(partition):
+    with gzip.open(_segment_path(partition), 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield ArchivedTransaction(json.loads(line))
+
+
+def _partitions(start_date=None, end_date=None, newest_first=False):
+    partitions = ArchivePartition.query
+    if start_date is not None:
+        partitions = partitions.filter(ArchivePartition.last_at >= start_date)
+    if end_date is not None:
+        partitions = partitions.filter(ArchivePartition.first_at <= end_date)
+    order = ArchivePartition.max_id.desc() if newest_first else ArchivePartition.min_id
+    return partitions.order_by(order).all()
+
+
+def _whole_partition(partition, start_date, end_date, filters):
+    """Whether every row of the segment matches, so the manifest row_count can stand in for it"""
+    if any(value is not None for value in filters.values()):
+        return False
+    return (start_date is None or partition.first_at >= start_date) and \
+        (end_date is None or partition.last_at <= end_date)
+
+
+def _matching(rows, start_date=None, end_date=None, product_id=None, user_id=None,
+              transaction_type=None, product_ids=None, notes_search=None):
+    for row in rows:
+        if start_date is not None and row.created_at < start_date:
+            continue
+        if end_date is not None and row.created_at > end_date:
+            continue
+        if product_id and row.product_id != product_id:
+            continue
+        if user_id and row.user_id != user_id:
+            continue
+        if transaction_type and row.transaction_type != transaction_type:
+            continue
+        if product_ids is not None or notes_search:
+            in_products = product_ids is not None and row.product_id in product_ids
+            in_notes = bool(notes_search) and notes_search in (row.notes or '')
+            if not (in_products or in_notes):
+                continue
+        yield row
+
+
+def iter_archived_transactions(start_date=None, end_date=None, newest_first=False, offset=0, **filters):
+    """Yield archived transactions matching the filters.
+
+    Only segments whose time span overlaps the range are opened. Rows come
+    out in ledger order, or newest first when requested. The filters are
+    product_id, user_id, transaction_type, and product_ids and notes_search
+    mirroring the ledger search box: a row matches if its product is in
+    product_ids or its notes contain notes_search. The first `offset`
+    matching rows are skipped, whole segments at a time where the manifest
+    row count allows it.
+    """
+    for partition in _partitions(start_date, end_date, newest_first):
+        if offset >= partition.row_count and _whole_partition(partition, start_date, end_date, filters):
+            offset -= partition.row_count
+            continue
+        rows = _read_segment(partition)
+        if newest_first:
+            rows = reversed(list(rows))
+        for row in _matching(rows, start_date, end_date, **filters):
+            if offset:
+                offset -= 1
+                continue
+            yield row
+
+
+def count_archived_transactions(start_date=None, end_date=None, **filters):
+    """Number of archived transactions matching the filters of iter_archived_transactions.
+
+    Segments wholly inside the range are counted from the manifest when no
+    other filter applies; only the rest are read.
+    """
+    total = 0
+    for partition in _partitions(start_date, end_date):
+        if _whole_partition(partition, start_date, end_date, filters):
+            total += partition.row_count
+        else:
+            total += sum(1 for _ in _matching(_read_segment(partition), start_date, end_date, **filters))
+    return total
+
+
+def archived_after(cursor, limit):
+    """Up to `limit` archived transactions with an id above `cursor`, in id order.
+
+    Segments are read in min_id order and only while one could still hold
+    an id lower than the highest row kept so far.
+    """
+    partitions = ArchivePartition.query.filter(ArchivePartition.max_id > cursor)\
+        .order_by(ArchivePartition.min_id).all()
+    rows = []
+    for partition in partitions:
+        if len(rows) >= limit and partition.min_id > rows[-1].id:
+            break
+        rows.extend(row for row in _read_segment(partition) if row.id > cursor)
+        rows.sort(key=lambda row: row.id)
+        del rows[limit:]
+    return rows
+
+
+def iter_ledger(start_date=None, end_date=None, chunk_size=1000):
+    """Yield the whole ledger in a date range, archived rows first, oldest first"""
+    if range_reaches_archive(start_date):
+        yield from iter_archived_transactions(start_date=start_date, end_date=end_date)
+
+    query = Transaction.query
+    if start_date is not None:
+        query = query.filter(Transaction.created_at >= start_date)
+    if end_date is not None:
+        query = query.filter(Transaction.created_at <= end_date)
+    yield from query.order_by(Transaction.created_at, Transaction.id).yield_per(chunk_size)
+
+
+def attach_relations(rows):
+    """Resolve product, user and location for archived rows with one query each"""
+    product_ids = {row.product_id for row in rows}
+    user_ids = {row.user_id for row in rows}
+    location_ids = {row.location_id for row in rows if row.location_id}
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))} if product_ids else {}
+    users = {u.id: u for u in User.query.filter(User.id.in_(user_ids))} if user_ids else {}
+    locations = {l.id: l for l in Location.query.filter(Location.id.in_(location_ids))} if location_ids else {}
+    for row in rows:
+        row.product = products.get(row.product_id)
+        row.user = users.get(row.user_id)
+        row.location = locations.get(row.location_id)
+    return rows
+
+
+class LedgerPagination(QueryPagination):
+    """Paginates the hot ledger query followed by matching archived rows.
+
+    Archived rows are always older than hot rows, so for a newest-first
+    listing the archive simply continues where the hot table ends. Only the
+    archived rows of the requested page are kept in memory.
+    """
+
+    def _hot_count(self):
+        if not hasattr(self, '_hot_total'):
+            self._hot_total = self._query_args['query'].order_by(None).count()
+        return self._hot_total
+
+    def _query_items(self):
+        offset = self._query_offset
+        hot_total = self._hot_count()
+        items = []
+        if offset < hot_total:
+            items = self._query_args['query'].limit(self.per_page).offset(offset).all()
+        remaining = self.per_page - len(items)
+        if remaining > 0:
+            rows = iter_archived_transactions(newest_first=True, offset=max(offset - hot_total, 0),
+                                              **self._query_args['archive_filters'])
+            items += attach_relations(list(islice(rows, remaining)))
+        return items
+
+    def _query_count(self):
+        return self._hot_count() + count_archived_transactions(**self._query_args['archive_filters'])
+
+
+def archive_transactions(horizon_days=None, batch_size=5000, now=None, log=None):
+    """Move transactions older than the horizon into archive segments.
+
+    Works in batches: each batch is written to per-month segment files,
+    recorded in the manifest and deleted from the hot table in a single
+    commit, so the job can be interrupted and rerun safely.
+    """
+    if needs_autoincrement():
+        # Emptying the hot table would let new movements take archived ids again
+        raise RuntimeError('The transactions table can reuse ids; run migrate-ledger before archiving.')
+    if horizon_days is None:
+        horizon_days = current_app.config['ARCHIVE_HORIZON_DAYS']
+    cutoff = (now or datetime.utcnow()) - timedelta(days=horizon_days)
+    archived = 0
+
+    while True:
+        batch = Transaction.query.options(selectinload(Transaction.note))\
+            .filter(Transaction.created_at < cutoff).order_by(Transaction.id).limit(batch_size).all()
+        if not batch:
+            break
+
+        by_period = {}
+        for transaction in batch:
+            by_period.setdefault(transaction.created_at.strftime('%Y-%m'), []).append(transaction)
+
+        for period, rows in by_period.items():
+            partition = _write_segment(period, rows)
+            db.session.add(partition)
+            if log:
+                log(f'{partition.path}: {partition.row_count} rows')
+
+        ids = [t.id for t in batch]
+        for transaction in batch:
+            db.session.expunge(transaction)
+        TransactionNote.query.filter(TransactionNote.transaction_id.in_(ids)).delete(synchronize_session=False)
+        # Alerts outlive the movement that raised them; the archived row keeps its id
+        StockAlert.query.filter(StockAlert.transaction_id.in_(ids))\
+            .update({StockAlert.transaction_id: None}, synchronize_session=False)
+        Transaction.query.filter(Transaction.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(ids)
+
+    return archived
+
+
+def _write_segment(period, rows):
+    """Write rows to a new compressed segment and return its manifest entry"""
+    relative_path = os.path.join(period, f'{rows[0].id:012d}-{rows[-1].id:012d}.jsonl.gz')
+    path = os.path.join(archive_dir(), relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if os.path.exists(path):
+        if ArchivePartition.query.filter_by(path=relative_path).first() is not None:
+            raise RuntimeError(f'{relative_path} is already an archive segment; refusing to overwrite it')
+        # Otherwise left behind by an interrupted run that never reached the manifest: rewritten below
+
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=9) as f:
+        for row in rows:
+            f.write(json.dumps(row.to_dict(), separators=(',', ':')) + '\n')
+    os.replace(tmp_path, path)
+
+    return ArchivePartition(
+        period=period,
+        path=relative_path,
+        row_count=len(rows),
+        min_id=rows[0].id,
+        max_id=rows[-1].id,
+        first_at=min(r.created_at for r in rows),
+        last_at=max(r.created_at for r in rows),
+        checksum=_file_checksum(path)
+    )
+
+
+def verify_archive():
+    """Check every manifest entry against its file and the hot table.
+
+    Returns a list of problem descriptions, empty when the archive is sound.
+    """
+    problems = []
+    for partition in ArchivePartition.query.order_by(ArchivePartition.min_id):
+        path = _segment_path(partition)
+        if not os.path.exists(path):
+            problems.append(f'{partition.path}: segment file missing')
+            continue
+        if _file_checksum(path) != partition.checksum:
+            problems.append(f'{partition.path}: checksum mismatch')
+            continue
+
+        ids = [row.id for row in _read_segment(partition)]
+        if len(ids) != partition.row_count:
+            problems.append(f'{partition.path}: {len(ids)} rows, manifest says {partition.row_count}')
+        if ids and (min(ids) != partition.min_id or max(ids) != partition.max_id):
+            problems.append(f'{partition.path}: row ids do not match the manifest id range')
+
+        duplicated = Transaction.query.filter(Transaction.id.in_(ids)).count() if ids else 0
+        if duplicated:
+            problems.append(f'{partition.path}: {duplicated} rows still present in the hot table')
+
+    # Segments written by an interrupted run that never reached the manifest
+    known = {partition.path for partition in ArchivePartition.query}
+    for root, _, files in os.walk(archive_dir()):
+        for name in files:
+            relative_path = os.path.relpath(os.path.join(root, name), archive_dir())
+            if relative_path not in known:
+                problems.append(f'{relative_path}: file is not in the manifest')
+
+    return problems
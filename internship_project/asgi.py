@@ -0,0 +1,305 @@
+"""
+ASGI entry point with an async JSON API tier
+High-fanout search and list endpoints (product/supplier search, product
+list) are served on the event loop with async database sessions. They go
+through the same api lane, query deadline and metrics as the Flask routes
+they mirror. The dashboard's event stream is served on the event loop too,
+so an open dashboard holds no thread. Everything else, including the
+catalog-backed product info and SKU lookups, is passed through to the
+Flask app, each request on a thread of its own.
+
+    uvicorn asgi:application --workers 4
+"""
+
+import asyncio
+import json
+import re
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select, func, or_
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from app import create_app
+from deadlines import timeout_message
+from events import broker, replay_events, start_event_poller, stream_events_async
+from lanes import acquire_async, busy_message, classify, lanes_dir
+from metrics import flush, inc, observe, start_flusher
+from models import db, Product, Supplier
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql'
+}
+
+
+def async_database_url(url):
+    """Swap the sync driver of a database URL for its asyncio counterpart"""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f'No async driver configured for {backend} databases')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def product_summary(product):
+    """Fields returned by product search and list endpoints"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'sku': product.sku,
+        'price': product.price,
+        'quantity': product.quantity,
+        'category': product.category
+    }
+
+
+class AsyncAPI:
+    """ASGI application serving the async API routes in front of Flask"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self.session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self.engine = None
+        self.sessions = None
+        # Endpoint names of the Flask routes these mirror, for lanes and metrics
+        self.routes = [
+            (re.compile(r'/api/products/search'), 'main.api_product_search', self.product_search),
+            (re.compile(r'/api/products'), 'main.api_product_list', self.product_list),
+            (re.compile(r'/api/suppliers/search'), 'main.api_supplier_search', self.supplier_search)
+        ]
+
+    def _ensure_engine(self):
+        """Create the async engine lazily so each worker opens its own pool"""
+        if self.engine is None:
+            with self.flask_app.app_context():
+                url = async_database_url(db.engine.url)
+            options = {}
+            if url.get_backend_name() != 'sqlite':
+                options.update(
+                    pool_size=self.flask_app.config['ASYNC_POOL_SIZE'],
+                    max_overflow=self.flask_app.config['ASYNC_POOL_MAX_OVERFLOW'],
+                    pool_pre_ping=True
+                )
+            self.engine = create_async_engine(url, **options)
+            self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+
+        if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+            if scope['path'] == '/dashboard/stream':
+                await self.dashboard_stream(scope, receive, send)
+                return
+            for pattern, endpoint, handler in self.routes:
+                match = pattern.fullmatch(scope['path'])
+                if match:
+                    await self._dispatch(endpoint, handler, match.groupdict(), scope, send)
+                    return
+
+        # WsgiToAsgi runs every request on one shared thread unless each gets its own context
+        async with ThreadSensitiveContext():
+            await self.wsgi_app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _dispatch(self, endpoint, handler, params, scope, send):
+        started = time.perf_counter()
+        status, payload, headers = await self._respond(endpoint, handler, params, scope)
+        size = await self._send_json(send, payload, status=status, headers=headers)
+        self._record(endpoint, scope['method'], status, started, size)
+
+    async def _respond(self, endpoint, handler, params, scope):
+        if not self._is_logged_in(scope):
+            return 401, {'error': 'Authentication required'}, []
+
+        config = self.flask_app.config
+        lane = classify(endpoint, scope['path'])
+        slot = None
+        if config['LANES_ENABLED']:
+            slot = await acquire_async(lane, config, lanes_dir(self.flask_app))
+            if slot is None:
+                inc('lane_requests_total', lane=lane, result='rejected')
+                retry_after = config['LANE_RETRY_AFTER']
+                return 429, {'error': busy_message(lane, retry_after)}, [(b'retry-after', str(retry_after).encode())]
+            inc('lane_requests_total', lane=lane, result='admitted')
+
+        seconds = config['QUERY_DEADLINES'].get(lane) or None
+        try:
+            self._ensure_engine()
+            query = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+            async with self.sessions() as session:
+                status, payload = await asyncio.wait_for(handler(session, query, **params), seconds)
+            return status, payload, []
+        except asyncio.TimeoutError:
+            inc('query_cancellations_total', endpoint=endpoint, reason='deadline')
+            return 503, {'error': timeout_message(seconds)}, []
+        finally:
+            if slot is not None:
+                slot.release()
+
+    def _record(self, endpoint, method, status, started, size=None):
+        """The request metrics the Flask app records for its own routes"""
+        if not self.flask_app.config['METRICS_ENABLED']:
+            return
+        start_flusher(self.flask_app)
+        inc('http_requests_total', endpoint=endpoint, method=method, status=str(status))
+        if status >= 500:
+            inc('http_request_errors_total', endpoint=endpoint)
+        if size is not None:
+            observe('http_response_size_bytes', size, endpoint=endpoint)
+        observe('http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+        with self.flask_app.app_context():
+            flush()
+
+    async def dashboard_stream(self, scope, receive, send):
+        """The dashboard's Server-Sent Events stream, waiting on the event loop instead of a thread"""
+        started = time.perf_counter()
+        if not self._is_logged_in(scope):
+            size = await self._send_json(send, {'error': 'Authentication required'}, status=401)
+            self._record('main.dashboard_stream', scope['method'], 401, started, size)
+            return
+
+        last_event_id = None
+        for name, value in scope.get('headers', []):
+            if name == b'last-event-id' and value.isdigit():
+                last_event_id = int(value)
+        subscriber, replay = await sync_to_async(self._subscribe, thread_sensitive=False)(
+            last_event_id, asyncio.get_running_loop())
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            subscriber.close()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')
+                ]
+            })
+            async for message in stream_events_async(subscriber, replay):
+                await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+            if not watcher.done():
+                # Dropped as a slow consumer: end the response so the browser reconnects
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            watcher.cancel()
+            broker.unsubscribe(subscriber)
+            self._record('main.dashboard_stream', scope['method'], 200, started)
+
+    def _subscribe(self, last_event_id, loop):
+        with self.flask_app.app_context():
+            try:
+                start_event_poller(self.flask_app)
+                subscriber = broker.subscribe(loop)
+                return subscriber, replay_events(last_event_id, subscriber.start_id, broker.max_queue)
+            finally:
+                db.session.remove()
+
+    def _is_logged_in(self, scope):
+        """Validate the Flask session cookie without entering Flask"""
+        cookie_name = self.flask_app.config['SESSION_COOKIE_NAME']
+        for name, value in scope.get('headers', []):
+            if name != b'cookie':
+                continue
+            for part in value.decode('latin-1').split(';'):
+                key, _, cookie = part.strip().partition('=')
+                if key == cookie_name:
+                    try:
+                        max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+                        data = self.session_serializer.loads(cookie, max_age=max_age)
+                    except Exception:
+                        return False
+                    return 'user_id' in data
+        return False
+
+    async def _send_json(self, send, payload, status=200, headers=()):
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                *headers
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+        return len(body)
+
+    async def product_search(self, session, query):
+        term = query.get('q', '')
+        if len(term) < 2:
+            return 200, []
+
+        result = await session.execute(
+            select(Product).where(
+                Product.is_active == True,
+                or_(Product.name.contains(term), Product.sku.contains(term))
+            ).limit(10)
+        )
+        return 200, [product_summary(p) for p in result.scalars()]
+
+    async def product_list(self, session, query):
+        try:
+            page = max(int(query.get('page', 1)), 1)
+            per_page = min(max(int(query.get('per_page', 50)), 1), 200)
+        except ValueError:
+            return 400, {'error': 'page and per_page must be integers'}
+
+        statement = select(Product).where(Product.is_active == True)
+        if query.get('category'):
+            statement = statement.where(Product.category == query['category'])
+
+        result = await session.execute(
+            statement.order_by(Product.name).offset((page - 1) * per_page).limit(per_page)
+        )
+        return 200, {
+            'page': page,
+            'per_page': per_page,
+            'items': [product_summary(p) for p in result.scalars()]
+        }
+
+    async def supplier_search(self, session, query):
+        term = query.get('q', '')
+        if len(term) < 2:
+            return 200, []
+
+        product_count = select(func.count(Product.id))\
+            .where(Product.supplier_id == Supplier.id).scalar_subquery()
+        result = await session.execute(
+            select(Supplier, product_count).where(
+                Supplier.is_active == True,
+                or_(Supplier.name.contains(term), Supplier.email.contains(term))
+            ).limit(10)
+        )
+        return 200, [{
+            'id': supplier.id,
+            'name': supplier.name,
+            'email': supplier.email,
+            'contact': supplier.contact,
+            'total_products': total_products
+        } for supplier, total_products in result]
+
+
+application = AsyncAPI(create_app())
@@ -0,0 +1,128 @@
+"""
+Static asset pipeline
+`flask build-assets` copies every file under static/ into static/dist/
+with a content hash in its name (css/style.css -> css/style.3f2a9c1b0e.css),
+writes gzip and, when the brotli package is installed, brotli versions
+next to it, and records the mapping in static/dist/manifest.json.
+
+Templates call asset_url('css/style.css'). With a manifest it points at
+the fingerprinted file, served from /assets/ with a one-year immutable
+Cache-Control and the best precompressed variant the client accepts.
+Without a build it falls back to the plain /static/ URL.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import current_app, send_from_directory, url_for, abort
+
+from compression import accepted_encodings
+
+try:
+    import brotli
+except ImportError:  # Brotli variants are optional
+    brotli = None
+
+DIST_DIRNAME = 'dist'
+MANIFEST_NAME = 'manifest.json'
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+IMMUTABLE_MAX_AGE = 31536000
+
+_manifest = None
+
+
+def dist_dir(app=None):
+    app = app or current_app
+    return os.path.join(app.static_folder, DIST_DIRNAME)
+
+
+def build_assets(app, log=None):
+    """Fingerprint and precompress static files; returns the manifest"""
+    source = app.static_folder
+    target = dist_dir(app)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+
+    manifest = {}
+    for root, dirs, files in os.walk(source):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != target]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, source).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                content = f.read()
+
+            stem, extension = os.path.splitext(relative)
+            hashed = f'{stem}.{hashlib.sha256(content).hexdigest()[:10]}{extension}'
+            output = os.path.join(target, hashed)
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'wb') as f:
+                f.write(content)
+
+            if extension in PRECOMPRESS_EXTENSIONS:
+                with open(output + '.gz', 'wb') as f:
+                    f.write(gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(output + '.br', 'wb') as f:
+                        f.write(brotli.compress(content, quality=11))
+
+            manifest[relative] = hashed
+            if log:
+                log(f'{relative} -> {hashed}')
+
+    with open(os.path.join(target, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest():
+    """Manifest of the last build, read once per process"""
+    global _manifest
+    if _manifest is None:
+        path = os.path.join(dist_dir(), MANIFEST_NAME)
+        try:
+            with open(path) as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def asset_url(filename):
+    """URL of a static file, fingerprinted when a build exists"""
+    hashed = load_manifest().get(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('main.asset', filename=hashed)
+
+
+def send_asset(filename):
+    """Serve a fingerprinted file, precompressed when possible, cached forever"""
+    directory = dist_dir()
+    if not os.path.isfile(os.path.join(directory, filename)):
+        abort(404)
+
+    accepted = accepted_encodings()
+    variant = next((
+        (coding, suffix) for coding, suffix in (('br', '.br'), ('gzip', '.gz'))
+        if coding in accepted and os.path.isfile(os.path.join(directory, filename + suffix))
+    ), None)
+
+    if variant:
+        coding, suffix = variant
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(directory, filename + suffix, mimetype=mimetype,
+                                       max_age=IMMUTABLE_MAX_AGE)
+        response.headers['Content-Encoding'] = coding
+    else:
+        response = send_from_directory(directory, filename, max_age=IMMUTABLE_MAX_AGE)
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
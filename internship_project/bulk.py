@@ -0,0 +1,100 @@
+"""
+Bulk product operations
+Price changes, recategorization, supplier reassignment and soft
+delete/restore for every product matching a filter or an id list. Each
+action is a single UPDATE ... RETURNING committed as one transaction.
+Core updates bypass the flush listener in changefeed.py, so the returned
+rows are written to change_log here in one multi-row INSERT. That moves
+catalog_version(), and with it cached fragments and the product catalog,
+once per batch. Rows the action would leave as they are are excluded, so
+they get neither an updated_at bump nor a change entry.
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import case, func, update
+
+from metrics import inc as inc_metric
+from models import db, Product, Supplier, ChangeLog
+
+# action -> label for the bulk form
+ACTIONS = {
+    'price_percent': 'Change price by %',
+    'price_amount': 'Change price by amount',
+    'category': 'Set category',
+    'supplier': 'Reassign supplier',
+    'deactivate': 'Delete',
+    'restore': 'Restore',
+}
+
+_PAYLOAD_COLUMNS = ('id', 'name', 'sku', 'category', 'price', 'quantity', 'min_stock_level',
+                    'supplier_id', 'is_active', 'updated_at')
+
+
+def _price(expression):
+    """New price rounded to cents, never below zero"""
+    rounded = func.round(expression, 2)
+    return case((rounded < 0, 0.0), else_=rounded)
+
+
+def _changes(action, value):
+    """(column values, condition selecting rows that would change) for an action"""
+    products = Product.__table__.c
+    if action in ('price_percent', 'price_amount'):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError('Enter a number for the price change.')
+        if action == 'price_percent' and value <= -100:
+            raise ValueError('A price cannot be reduced by 100% or more.')
+        price = _price(products.price * (1 + value / 100) if action == 'price_percent' else products.price + value)
+        return {'price': price}, price != products.price
+    if action == 'category':
+        category = (value or '').strip()
+        if not category or len(category) > 50:
+            raise ValueError('Enter a category of at most 50 characters.')
+        return {'category': category}, products.category != category
+    if action == 'supplier':
+        supplier = db.session.get(Supplier, value) if value else None
+        if supplier is None or not supplier.is_active:
+            raise ValueError('Choose an active supplier.')
+        return {'supplier_id': supplier.id}, products.supplier_id != supplier.id
+    if action == 'deactivate':
+        return {'is_active': False}, products.is_active == True
+    if action == 'restore':
+        return {'is_active': True}, products.is_active == False
+    raise ValueError(f'Unknown bulk action: {action}')
+
+
+def bulk_update_products(conditions, action, value=None):
+    """Apply one action to every product matching conditions; returns the number changed.
+
+    Raises ValueError for an unknown action or an invalid value.
+    """
+    values, changes_row = _changes(action, value)
+    now = datetime.utcnow()
+    table = Product.__table__
+    statement = (
+        update(table)
+        .where(*conditions, changes_row)
+        .values(updated_at=now, **values)
+        .returning(*(table.c[name] for name in _PAYLOAD_COLUMNS))
+    )
+    try:
+        rows = db.session.execute(statement).all()
+        if rows:
+            # Transient products serialize exactly like single-row edits
+            db.session.execute(ChangeLog.__table__.insert(), [{
+                'entity': 'product',
+                'entity_id': row.id,
+                'operation': 'update',
+                'payload': json.dumps(Product(**row._asdict()).to_dict()),
+                'created_at': now
+            } for row in rows])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    inc_metric('inventory_bulk_product_updates_total', len(rows), action=action)
+    return len(rows)
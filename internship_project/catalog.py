@@ -0,0 +1,435 @@
+"""
+Memory-mapped product catalog
+Product-info and SKU lookups are answered from a compact binary snapshot of
+the catalog (id, SKU, name, category, price, quantity, thresholds, supplier
+name and stock by location) instead of the database. The snapshot is one
+file, CATALOG_PATH, mapped read-only by every worker: records are fixed-width
+numpy arrays viewed straight out of the mapping, so lookups copy nothing and
+the pages are shared through the OS page cache instead of multiplied per
+worker.
+
+Layout: a header, the product records sorted by id (binary search by id),
+a permutation of them sorted by a 64-bit SKU hash (binary search by SKU),
+the supplier records, the per-location stock rows and two string heaps.
+
+The file records the change_log id it is current to. At most once per
+CATALOG_REFRESH_INTERVAL a worker compares that with the database. When it
+is behind, the worker applies only the newer change_log entries (plus the
+stock rows of the products they touch) and atomically replaces the file;
+an flock keeps workers from doing the same refresh twice. Other workers
+notice the new file and remap it. Strings and stock rows of changed products
+are appended, and the file is rebuilt from scratch once they are mostly
+garbage.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from changefeed import settled_through
+from metrics import inc as inc_metric
+from models import db, Product, Supplier, StockLevel, ChangeLog
+
+try:
+    import fcntl
+except ImportError:  # No flock on Windows: refreshes still replace the file atomically
+    fcntl = None
+
+MAGIC = b'ICAT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sIQQQQQQ')  # magic, format, version, products, suppliers, levels, heap, supplier heap
+ALIGN = 8
+MAX_INCREMENTAL_CHANGES = 50000  # Beyond this a full rebuild is cheaper
+IN_CHUNK = 500
+
+# numpy and the record types are loaded on first catalog use, not at app import
+np = None
+PRODUCT = SUPPLIER = LEVEL = SKU_INDEX = None
+
+
+def _load_numpy():
+    global np, PRODUCT, SUPPLIER, LEVEL, SKU_INDEX
+    if np is not None:
+        return
+    import numpy
+    PRODUCT = numpy.dtype([
+        ('id', '<i8'), ('price', '<f8'), ('quantity', '<i8'), ('min_stock_level', '<i8'),
+        ('supplier_id', '<i8'), ('sku_hash', '<u8'),
+        ('name_off', '<u8'), ('sku_off', '<u8'), ('category_off', '<u8'), ('levels_off', '<u8'),
+        ('name_len', '<u4'), ('sku_len', '<u4'), ('category_len', '<u4'), ('levels_len', '<u4'),
+        ('is_active', '<u1'), ('has_sku', '<u1'), ('_pad', '<u2'),
+    ])
+    SUPPLIER = numpy.dtype([('id', '<i8'), ('name_off', '<u8'), ('name_len', '<u4'), ('_pad', '<u4')])
+    LEVEL = numpy.dtype([('location_id', '<i8'), ('quantity', '<i8')])
+    SKU_INDEX = numpy.dtype('<u4')
+    np = numpy  # Last, so other threads never see np without the record types
+
+_lock = threading.Lock()
+_reader = None
+_checked_at = 0.0
+
+
+def catalog_path(app=None):
+    app = app or current_app
+    return app.config['CATALOG_PATH'] or os.path.join(app.instance_path, 'catalog.bin')
+
+
+def sku_hash(sku):
+    return int.from_bytes(hashlib.blake2b(sku.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _padded(size):
+    return -size % ALIGN
+
+
+class CatalogReader:
+    """Zero-copy view of one catalog file"""
+
+    def __init__(self, path):
+        _load_numpy()
+        with open(path, 'rb') as f:
+            self.identity = os.fstat(f.fileno()).st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, file_format, self.version, product_count, supplier_count,
+         level_count, heap_size, supplier_heap_size) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or file_format != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a catalog file of format {FORMAT_VERSION}')
+
+        offset = HEADER.size + _padded(HEADER.size)
+        self.products, offset = self._section(offset, PRODUCT, product_count)
+        self.sku_index, offset = self._section(offset, SKU_INDEX, product_count)
+        self.suppliers, offset = self._section(offset, SUPPLIER, supplier_count)
+        self.levels, offset = self._section(offset, LEVEL, level_count)
+        self.heap = memoryview(self.map)[offset:offset + heap_size]
+        offset += heap_size + _padded(heap_size)
+        self.supplier_heap = memoryview(self.map)[offset:offset + supplier_heap_size]
+
+    def _section(self, offset, dtype, count):
+        array = np.frombuffer(self.map, dtype=dtype, count=count, offset=offset)
+        size = dtype.itemsize * count
+        return array, offset + size + _padded(size)
+
+    def _string(self, heap, offset, length):
+        return bytes(heap[offset:offset + length]).decode('utf-8')
+
+    def _position(self, product_id):
+        ids = self.products['id']
+        i = int(np.searchsorted(ids, product_id))
+        return i if i < len(ids) and ids[i] == product_id else None
+
+    def _sku_position(self, sku):
+        hashes = self.products['sku_hash'][self.sku_index]
+        wanted = sku_hash(sku)
+        i = int(np.searchsorted(hashes, wanted))
+        while i < len(hashes) and hashes[i] == wanted:
+            position = int(self.sku_index[i])
+            record = self.products[position]
+            if record['has_sku'] and self._string(self.heap, record['sku_off'], record['sku_len']) == sku:
+                return position
+            i += 1
+        return None
+
+    def supplier_name(self, supplier_id):
+        ids = self.suppliers['id']
+        i = int(np.searchsorted(ids, supplier_id))
+        if i < len(ids) and ids[i] == supplier_id:
+            record = self.suppliers[i]
+            return self._string(self.supplier_heap, record['name_off'], record['name_len'])
+        return None
+
+    def _record(self, position):
+        record = self.products[position]
+        levels = self.levels[record['levels_off']:record['levels_off'] + record['levels_len']]
+        quantity = int(record['quantity'])
+        min_stock_level = int(record['min_stock_level'])
+        return {
+            'id': int(record['id']),
+            'name': self._string(self.heap, record['name_off'], record['name_len']),
+            'sku': self._string(self.heap, record['sku_off'], record['sku_len']) if record['has_sku'] else None,
+            'category': self._string(self.heap, record['category_off'], record['category_len']),
+            'price': float(record['price']),
+            'quantity': quantity,
+            'min_stock_level': min_stock_level,
+            'supplier_id': int(record['supplier_id']),
+            'supplier': self.supplier_name(int(record['supplier_id'])),
+            'is_active': bool(record['is_active']),
+            'is_low_stock': quantity <= min_stock_level,
+            'is_out_of_stock': quantity <= 0,
+            'stock_by_location': {int(level['location_id']): int(level['quantity']) for level in levels},
+        }
+
+    def get(self, product_id):
+        position = self._position(product_id)
+        return None if position is None else self._record(position)
+
+    def get_by_sku(self, sku):
+        position = self._sku_position(sku)
+        return None if position is None else self._record(position)
+
+
+class _Builder:
+    """Accumulates records and strings for a new catalog file"""
+
+    def __init__(self, heap=b'', levels=None):
+        self.heap = bytearray(heap)
+        self.levels = [] if levels is None else [levels]
+        self.level_count = 0 if levels is None else len(levels)
+        self.records = []
+
+    def _string(self, value):
+        data = (value or '').encode('utf-8')
+        offset = len(self.heap)
+        self.heap += data
+        return offset, len(data)
+
+    def add(self, product, levels):
+        name_off, name_len = self._string(product['name'])
+        sku_off, sku_len = self._string(product['sku'])
+        category_off, category_len = self._string(product['category'])
+        self.records.append((
+            product['id'], product['price'] or 0.0, product['quantity'] or 0, product['min_stock_level'] or 0,
+            product['supplier_id'] or 0, sku_hash(product['sku']) if product['sku'] else 0,
+            name_off, sku_off, category_off, self.level_count,
+            name_len, sku_len, category_len, len(levels),
+            1 if product['is_active'] else 0, 1 if product['sku'] else 0, 0
+        ))
+        if levels:
+            self.levels.append(np.array(levels, dtype=LEVEL))
+            self.level_count += len(levels)
+
+    def product_array(self):
+        return np.array(self.records, dtype=PRODUCT)
+
+    def level_array(self):
+        return np.concatenate(self.levels) if self.levels else np.zeros(0, dtype=LEVEL)
+
+
+def _supplier_sections(names):
+    heap = bytearray()
+    records = []
+    for supplier_id in sorted(names):
+        data = (names[supplier_id] or '').encode('utf-8')
+        records.append((supplier_id, len(heap), len(data), 0))
+        heap += data
+    return np.array(records, dtype=SUPPLIER), bytes(heap)
+
+
+def _levels_for(product_ids):
+    """{product_id: [(location_id, quantity), ...]} for the given products"""
+    levels = {}
+    product_ids = list(product_ids)
+    for i in range(0, len(product_ids), IN_CHUNK):
+        rows = db.session.execute(
+            select(StockLevel.product_id, StockLevel.location_id, StockLevel.quantity)
+            .where(StockLevel.product_id.in_(product_ids[i:i + IN_CHUNK]))
+            .order_by(StockLevel.product_id, StockLevel.location_id)
+        )
+        for product_id, location_id, quantity in rows:
+            levels.setdefault(product_id, []).append((location_id, quantity))
+    return levels
+
+
+def _write(path, version, products, levels, heap, supplier_names):
+    products = products[np.argsort(products['id'], kind='stable')]
+    sku_index = np.argsort(products['sku_hash'], kind='stable').astype(SKU_INDEX)
+    suppliers, supplier_heap = _supplier_sections(supplier_names)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, version, len(products), len(suppliers),
+                         len(levels), len(heap), len(supplier_heap))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        for chunk in (header, products.tobytes(), sku_index.tobytes(), suppliers.tobytes(),
+                      levels.tobytes(), bytes(heap), supplier_heap):
+            f.write(chunk)
+            f.write(b'\0' * _padded(len(chunk)))
+    os.replace(temporary, path)
+
+
+def _current_version(since=0):
+    # The newest change_log id with no younger gap below it: a lower id may still commit
+    version = settled_through(ChangeLog, since)
+    if version is None:
+        version = db.session.query(func.max(ChangeLog.id)).scalar() or 0
+    return max(version, since)
+
+
+def build_catalog(path=None):
+    """Write a fresh catalog from the database; returns the number of products"""
+    _load_numpy()
+    path = path or catalog_path()
+    version = _current_version()  # Read first: later changes are re-applied on the next refresh
+    levels = {}
+    for product_id, location_id, quantity in db.session.execute(
+        select(StockLevel.product_id, StockLevel.location_id, StockLevel.quantity)
+        .order_by(StockLevel.product_id, StockLevel.location_id)
+    ):
+        levels.setdefault(product_id, []).append((location_id, quantity))
+
+    builder = _Builder()
+    columns = (Product.id, Product.name, Product.sku, Product.category, Product.price, Product.quantity,
+               Product.min_stock_level, Product.supplier_id, Product.is_active)
+    for row in db.session.execute(select(*columns).execution_options(yield_per=10000)):
+        builder.add(row._mapping, levels.get(row.id, ()))
+
+    supplier_names = dict(db.session.execute(select(Supplier.id, Supplier.name)).all())
+    _write(path, version, builder.product_array(), builder.level_array(), builder.heap, supplier_names)
+    inc_metric('catalog_refreshes_total', mode='full')
+    return len(builder.records)
+
+
+def refresh_catalog(reader, path=None):
+    """Apply change_log entries newer than the reader's file.
+
+    Returns the number of changes applied, or None when a full rebuild ran.
+    """
+    path = path or catalog_path()
+    version = _current_version(reader.version)
+    if version <= reader.version:
+        return 0
+    pending = db.session.query(func.count(ChangeLog.id))\
+        .filter(ChangeLog.id > reader.version, ChangeLog.id <= version).scalar()
+    if pending > MAX_INCREMENTAL_CHANGES:
+        build_catalog(path)
+        return None
+
+    latest = {}  # (entity, id) -> newest payload
+    for entity, entity_id, payload in db.session.execute(
+        select(ChangeLog.entity, ChangeLog.entity_id, ChangeLog.payload)
+        .where(ChangeLog.id > reader.version, ChangeLog.id <= version)
+        .order_by(ChangeLog.id)
+    ):
+        latest[entity, entity_id] = payload
+
+    changed = {entity_id: json.loads(payload) for (entity, entity_id), payload in latest.items()
+               if entity == 'product'}
+    supplier_names = {int(s['id']): reader.supplier_name(int(s['id'])) for s in reader.suppliers}
+    for (entity, entity_id), payload in latest.items():
+        if entity == 'supplier':
+            supplier_names[entity_id] = json.loads(payload)['name']
+
+    products = reader.products
+    live_heap = int(products['name_len'].sum() + products['sku_len'].sum() + products['category_len'].sum())
+    if len(reader.heap) > 2 * live_heap + (1 << 20) or len(reader.levels) > 2 * int(products['levels_len'].sum()) + 1024:
+        build_catalog(path)  # Mostly garbage: compact
+        return None
+
+    builder = _Builder(reader.heap, np.array(reader.levels))
+    levels = _levels_for(changed)
+    for product_id, product in changed.items():
+        builder.add(product, levels.get(product_id, ()))
+
+    kept = products[~np.isin(products['id'], np.fromiter(changed, dtype='<i8', count=len(changed)))]
+    merged = np.concatenate([kept, builder.product_array()]) if changed else np.array(products)
+    _write(path, version, merged, builder.level_array(), builder.heap, supplier_names)
+    inc_metric('catalog_refreshes_total', mode='incremental')
+    return len(latest)
+
+
+def _refresh_locked(path):
+    """Refresh unless another process is already doing it"""
+    lock_file = open(f'{path}.lock', 'a')
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        # Start from the file on disk: another worker may have refreshed it already
+        current = _open(path)
+        if current is None:
+            build_catalog(path)
+        else:
+            refresh_catalog(current, path)
+        return True
+    finally:
+        lock_file.close()
+
+
+def _open(path):
+    try:
+        return CatalogReader(path)
+    except (OSError, ValueError):
+        return None
+
+
+def product_catalog():
+    """This process's view of the catalog, brought up to date at most once per interval.
+
+    Returns None when no catalog could be built; callers then use the database.
+    """
+    global _reader, _checked_at
+    if not current_app.config['CATALOG_ENABLED']:
+        return None
+    now = time.monotonic()
+    if _reader is not None and now - _checked_at < current_app.config['CATALOG_REFRESH_INTERVAL']:
+        return _reader
+
+    with _lock:
+        if _reader is not None and now - _checked_at < current_app.config['CATALOG_REFRESH_INTERVAL']:
+            return _reader
+        path = catalog_path()
+        try:
+            if _reader is None or os.stat(path).st_ino != _reader.identity:
+                _reader = _open(path)
+            if _reader is None or _reader.version < _current_version(_reader.version):
+                if _refresh_locked(path):
+                    _reader = _open(path)
+        except Exception:
+            current_app.logger.exception('Product catalog refresh failed')
+        _checked_at = now
+        return _reader
+
+
+def product_record(product):
+    """The catalog record shape for a Product loaded from the database"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'sku': product.sku,
+        'category': product.category,
+        'price': product.price,
+        'quantity': product.quantity,
+        'min_stock_level': product.min_stock_level,
+        'supplier_id': product.supplier_id,
+        'supplier': product.supplier.name,
+        'is_active': product.is_active,
+        'is_low_stock': product.is_low_stock(),
+        'is_out_of_stock': product.is_out_of_stock(),
+        'stock_by_location': {level.location_id: level.quantity for level in product.stock_levels},
+    }
+
+
+def lookup_product(product_id):
+    """Catalog record for a product id, or None if it is not in the catalog"""
+    catalog = product_catalog()
+    record = catalog.get(product_id) if catalog is not None else None
+    inc_metric('catalog_lookups_total', key='id', result='hit' if record else 'miss')
+    return record
+
+
+def lookup_sku(sku):
+    """Catalog record for a SKU, or None if it is not in the catalog"""
+    catalog = product_catalog()
+    record = catalog.get_by_sku(sku) if catalog is not None else None
+    inc_metric('catalog_lookups_total', key='sku', result='hit' if record else 'miss')
+    return record
+
+
+def _reset_after_fork():
+    """Forked workers map the file themselves"""
+    global _lock, _reader, _checked_at
+    _lock = threading.Lock()
+    _reader = None
+    _checked_at = 0.0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
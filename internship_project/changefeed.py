@@ -0,0 +1,125 @@
+"""
+Incremental change feed for downstream sync (ERP, BI)
+Transactions are append-only, so their own id is the cursor. A cursor from
+before the archive boundary continues through the archived segments. Product
+and supplier changes are captured into the change_log outbox on every flush.
+
+On PostgreSQL and MySQL an id is taken when a row is inserted, not when its
+transaction commits, so a row can become visible after rows with higher ids.
+A cursor therefore never moves past a gap in ids younger than
+CHANGE_FEED_SETTLE_SECONDS: the missing row may still commit. Older gaps are
+inserts that were rolled back.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, selectinload
+
+from archive import archived_after
+from models import db, Product, Supplier, Transaction, ChangeLog, ArchivePartition
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+_TRACKED_ENTITIES = {
+    Product: 'product',
+    Supplier: 'supplier'
+}
+
+
+def _capture_changes(session, flush_context):
+    """Write change_log rows for products and suppliers touched by a flush"""
+    rows = []
+    now = datetime.utcnow()
+    for operation, objects in (('insert', session.new), ('update', session.dirty)):
+        for obj in objects:
+            entity = _TRACKED_ENTITIES.get(type(obj))
+            if entity is None:
+                continue
+            if operation == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            rows.append({
+                'entity': entity,
+                'entity_id': obj.id,
+                'operation': operation,
+                'payload': json.dumps(obj.to_dict()),
+                'created_at': now
+            })
+    if rows:
+        session.connection().execute(ChangeLog.__table__.insert(), rows)
+
+
+def register_change_capture():
+    """Install the flush listener that feeds the change_log outbox"""
+    if not event.contains(Session, 'after_flush', _capture_changes):
+        event.listen(Session, 'after_flush', _capture_changes)
+
+
+def parse_page_args(args):
+    """Read cursor and limit query parameters"""
+    cursor = max(args.get('cursor', 0, type=int) or 0, 0)
+    limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int) or DEFAULT_PAGE_SIZE
+    return cursor, min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def settled_through(model, cursor):
+    """Highest id a consumer past `cursor` may advance to, or None when nothing is held back.
+
+    Works on any table with an integer id and a created_at insert time
+    (transactions, change_log): only rows from the oldest one in the settle
+    window on are read.
+    """
+    since = datetime.utcnow() - timedelta(seconds=current_app.config['CHANGE_FEED_SETTLE_SECONDS'])
+    first_recent = db.session.query(db.func.min(model.id))\
+        .filter(model.id > cursor, model.created_at >= since).scalar()
+    if first_recent is None:
+        return None
+    expected = (db.session.query(db.func.max(model.id))
+                .filter(model.id > cursor, model.id < first_recent).scalar() or cursor) + 1
+    for row_id, created_at in db.session.query(model.id, model.created_at)\
+            .filter(model.id >= first_recent).order_by(model.id):
+        if row_id != expected and created_at >= since:
+            return expected - 1
+        expected = row_id + 1
+    return None
+
+
+def read_transaction_changes(cursor, limit):
+    """Ledger movements recorded after the cursor, oldest first"""
+    query = Transaction.query.options(selectinload(Transaction.note)).filter(Transaction.id > cursor)
+    ceiling = settled_through(Transaction, cursor)
+    if ceiling is not None:
+        query = query.filter(Transaction.id <= ceiling)
+    rows = query.order_by(Transaction.id).limit(limit).all()
+    archived_max = db.session.query(db.func.max(ArchivePartition.max_id)).scalar()
+    if archived_max is not None and cursor < archived_max:
+        rows = sorted(rows + archived_after(cursor, limit), key=lambda row: row.id)[:limit]
+    records = [{'cursor': t.id, 'entity': 'transaction', 'data': t.to_dict()} for t in rows]
+    return records, (rows[-1].id if rows else cursor)
+
+
+def read_catalog_changes(cursor, limit, entity=None):
+    """Product/supplier changes recorded after the cursor, oldest first"""
+    query = ChangeLog.query.filter(ChangeLog.id > cursor)
+    ceiling = settled_through(ChangeLog, cursor)
+    if ceiling is not None:
+        query = query.filter(ChangeLog.id <= ceiling)
+    if entity:
+        query = query.filter(ChangeLog.entity == entity)
+    rows = query.order_by(ChangeLog.id).limit(limit).all()
+    records = [{
+        'cursor': c.id,
+        'entity': c.entity,
+        'operation': c.operation,
+        'changed_at': c.created_at.isoformat() if c.created_at else None,
+        'data': json.loads(c.payload)
+    } for c in rows]
+    return records, (rows[-1].id if rows else cursor)
+
+
+def to_ndjson(records):
+    """Encode records as newline-delimited JSON"""
+    return ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records)
@@ -0,0 +1,389 @@
+"""
+Flask CLI commands
+Schema setup and bootstrap are explicit steps instead of import side effects:
+
+    flask --app app init-db
+    flask --app app seed-data
+
+Maintenance jobs (archival, verification, reconciliation) live here as well.
+"""
+
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+
+from models import db, User, Location, create_default_admin, backfill_stock_levels
+
+
+@click.command('init-db')
+def init_db_command():
+    """Create database tables and the default admin user"""
+    if db.engine.dialect.name == 'sqlite':
+        # Only takes effect on a new, empty file; lets vacuum-db free pages incrementally
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+    db.create_all()
+    backfill_stock_levels()
+    click.echo('Database tables created.')
+
+    if create_default_admin():
+        click.echo('Default admin user created (admin / admin123).')
+
+
+@click.command('create-admin')
+def create_admin_command():
+    """Create the default admin user if none exists"""
+    if create_default_admin():
+        click.echo('Default admin user created (admin / admin123).')
+    else:
+        click.echo('An admin user already exists.')
+
+
+@click.command('seed-data')
+def seed_data_command():
+    """Load sample suppliers, products and transactions"""
+    from database_init import create_sample_data
+    create_sample_data()
+
+
+_STARTUP_PROBE = (
+    'import time; started = time.perf_counter(); '
+    'from app import create_app; imported = time.perf_counter(); '
+    'app = create_app(); '
+    'print(f"{imported - started:.4f} {time.perf_counter() - imported:.4f}")'
+)
+
+
+@click.command('startup-time')
+@click.option('--top', default=10, show_default=True, help='Number of slowest imports to list')
+def startup_time_command(top):
+    """Measure cold import and app factory time in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _STARTUP_PROBE],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise click.ClickException(result.stderr.strip().splitlines()[-1])
+
+    import_seconds, factory_seconds = (float(v) for v in result.stdout.split())
+    click.echo(f'Import app module: {import_seconds * 1000:.1f} ms')
+    click.echo(f'create_app():      {factory_seconds * 1000:.1f} ms')
+
+    # Modules imported directly by the entry point or by app.py itself
+    # (importtime indents nested imports by two spaces per level)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            imports.append((int(cumulative), name.strip()))
+
+    click.echo('Slowest direct imports:')
+    for cumulative, name in sorted(imports, reverse=True)[:top]:
+        click.echo(f'  {cumulative / 1000:8.1f} ms  {name}')
+
+
+@click.command('precompile-templates')
+def precompile_templates_command():
+    """Fill the Jinja bytecode cache so workers skip compiling on a cold start"""
+    from template_cache import precompile_templates, jinja_cache_dir
+    app = current_app._get_current_object()
+    if not app.config['JINJA_BYTECODE_CACHE']:
+        raise click.ClickException('JINJA_BYTECODE_CACHE is disabled.')
+    started = time.perf_counter()
+    compiled = precompile_templates(app)
+    click.echo(f'Compiled {compiled} templates into {jinja_cache_dir(app)} in {time.perf_counter() - started:.2f}s.')
+
+
+@click.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/dist"""
+    from assets import build_assets, brotli
+    manifest = build_assets(current_app._get_current_object(), log=click.echo)
+    variants = 'gzip and brotli' if brotli is not None else 'gzip (install brotli for .br files)'
+    click.echo(f'Built {len(manifest)} assets with {variants} variants.')
+
+
+@click.command('archive-transactions')
+@click.option('--horizon-days', type=int, help='Archive transactions older than this (default: ARCHIVE_HORIZON_DAYS)')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows moved per commit')
+def archive_transactions_command(horizon_days, batch_size):
+    """Move old transactions into compressed archive segments"""
+    from archive import archive_transactions
+    started = time.perf_counter()
+    try:
+        archived = archive_transactions(horizon_days=horizon_days, batch_size=batch_size, log=click.echo)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Archived {archived} transactions in {time.perf_counter() - started:.1f}s.')
+
+
+@click.command('verify-archive')
+def verify_archive_command():
+    """Check archive segments against the manifest and the hot table"""
+    from archive import verify_archive
+    problems = verify_archive()
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise click.ClickException(f'{len(problems)} problem(s) found in the archive.')
+    click.echo('Archive OK.')
+
+
+@click.command('snapshot-stock')
+@click.option('--date', 'as_of', help='Reconstruct and store the snapshot for the end of this day (YYYY-MM-DD)')
+def snapshot_stock_command(as_of):
+    """Record a stock level snapshot (run daily from cron)"""
+    from snapshots import take_snapshot
+    taken_at = None
+    if as_of:
+        taken_at = datetime.strptime(as_of, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+    taken_at, count = take_snapshot(taken_at)
+    click.echo(f'Snapshot of {count} products taken at {taken_at:%Y-%m-%d %H:%M:%S}.')
+
+
+@click.command('value-inventory')
+@click.option('--rebuild', is_flag=True, help='Discard saved state and revalue the whole ledger')
+@click.option('--batch-size', default=5000, show_default=True, help='Movements processed per commit')
+def value_inventory_command(rebuild, batch_size):
+    """Update FIFO and weighted-average valuation from new ledger movements"""
+    from valuation import run_valuation
+    started = time.perf_counter()
+    processed = run_valuation(rebuild=rebuild, batch_size=batch_size, log=click.echo)
+    click.echo(f'Valued {processed} movements in {time.perf_counter() - started:.1f}s.')
+
+
+@click.command('reconcile-ledger')
+@click.option('--workers', type=int, help='Worker processes (default: CPU count)')
+@click.option('--chunk-size', default=1000, show_default=True, help='Products per work unit')
+@click.option('--fix', is_flag=True, help='Write adjustment entries so each ledger ends at current stock')
+@click.option('--user', 'username', help='User recorded on adjustment entries (default: first admin)')
+@click.option('--limit', default=50, show_default=True, help='Maximum issues to print')
+def reconcile_ledger_command(workers, chunk_size, fix, username, limit):
+    """Check ledger chains and product quantities against each other"""
+    from reconcile import reconcile, write_adjustments
+    started = time.perf_counter()
+    checked, issues, adjustments = reconcile(workers=workers, chunk_size=chunk_size)
+    
+    for issue in issues[:limit]:
+        click.echo(issue.describe())
+    if len(issues) > limit:
+        click.echo(f'... and {len(issues) - limit} more')
+    click.echo(f'Checked {checked} movements in {time.perf_counter() - started:.1f}s: '
+               f'{len(issues)} issue(s), {len(adjustments)} product(s) out of balance.')
+    
+    if fix and adjustments:
+        if username:
+            user = User.query.filter_by(username=username).first()
+        else:
+            user = User.query.filter_by(role='admin').order_by(User.id).first()
+        if not user:
+            raise click.ClickException('No user to record adjustments under.')
+        try:
+            written = write_adjustments(adjustments, user.id)
+        except ValueError as e:
+            raise click.ClickException(f'Could not write adjustments: {e}')
+        click.echo(f'Wrote {written} adjustment entries as {user.username}.')
+    elif adjustments:
+        raise click.ClickException('Ledger is out of balance (rerun with --fix to write adjustments).')
+    if len(issues) > len(adjustments):
+        raise click.ClickException('Ledger history has gaps or location totals '
+                                   'that need manual review.')
+
+
+@click.command('migrate-locations')
+def migrate_locations_command():
+    """Add stock locations to an existing database and move current stock to the default location"""
+    db.create_all()  # locations and stock_levels
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('transactions')}
+    if 'location_id' not in columns:
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'ALTER TABLE transactions ADD COLUMN location_id INTEGER REFERENCES locations (id)'
+            )
+        click.echo('Added transactions.location_id.')
+    backfilled = backfill_stock_levels()
+    click.echo(f'Placed the stock of {backfilled} product(s) at {current_app.config["DEFAULT_LOCATION_CODE"]}.')
+
+
+@click.command('migrate-ledger')
+@click.option('--batch-size', default=20000, show_default=True, help='Rows copied per transaction')
+def migrate_ledger_command(batch_size):
+    """Rewrite the transactions table into the compact encoding with never-reused ids (stop the app first)"""
+    from ledger_encoding import ledger_sizes, migrate_ledger, needs_autoincrement, needs_migration, time_ledger_scans
+    db.create_all()  # transaction_notes
+    if not needs_migration() and not needs_autoincrement():
+        click.echo('The ledger already uses the compact encoding and never reuses ids.')
+        return
+    sizes_before, timings_before = ledger_sizes(), time_ledger_scans()
+    try:
+        copied = migrate_ledger(batch_size=batch_size, log=click.echo)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    sizes_after, timings_after = ledger_sizes(), time_ledger_scans()
+
+    click.echo(f'Migrated {copied} transaction(s).')
+    if sizes_before:
+        for name in sorted(set(sizes_before) | set(sizes_after)):
+            click.echo(f'  {name:36} {sizes_before.get(name, 0) / 1e6:9.2f} MB -> {sizes_after.get(name, 0) / 1e6:9.2f} MB')
+        click.echo(f'  {"total":36} {sum(sizes_before.values()) / 1e6:9.2f} MB -> '
+                   f'{sum(sizes_after.values()) / 1e6:9.2f} MB')
+    for name in timings_before:
+        click.echo(f'  {name:36} {timings_before[name]:9.3f} s  -> {timings_after[name]:9.3f} s')
+    click.echo('Run vacuum-db to return the freed pages to the file system.')
+
+
+@click.command('add-location')
+@click.argument('code')
+@click.argument('name')
+def add_location_command(code, name):
+    """Add a stock location (warehouse, store, dock)"""
+    code = code.strip().upper()
+    if Location.query.filter_by(code=code).first():
+        raise click.ClickException(f'Location {code} already exists.')
+    db.session.add(Location(code=code, name=name.strip()))
+    db.session.commit()
+    click.echo(f'Location {code} added.')
+
+
+@click.command('build-catalog')
+@click.option('--full', is_flag=True, help='Rebuild from scratch instead of applying recent changes')
+def build_catalog_command(full):
+    """Write or refresh the memory-mapped product catalog"""
+    from catalog import CatalogReader, build_catalog, catalog_path, refresh_catalog
+    path = catalog_path()
+    if not full:
+        try:
+            reader = CatalogReader(path)
+        except (OSError, ValueError):
+            reader = None  # Missing or from an older format: build it
+        if reader is not None:
+            applied = refresh_catalog(reader, path)
+            click.echo(f'Rebuilt {path}.' if applied is None else f'Applied {applied} change(s) to {path}.')
+            return
+    click.echo(f'Built {path} with {build_catalog(path)} product(s).')
+
+
+def _maintenance_summary(report):
+    sizes = ''
+    if report.get('size_before') is not None:
+        sizes = f', database {report["size_before"] / 1e6:.1f} MB -> {report["size_after"] / 1e6:.1f} MB'
+    return f'{report["seconds"]:.2f}s{sizes}'
+
+
+def _run_maintenance(task, *args, **kwargs):
+    import maintenance
+    try:
+        return getattr(maintenance, task)(*args, **kwargs)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        raise click.ClickException(str(e))
+
+
+@click.command('analyze-db')
+def analyze_db_command():
+    """Refresh query planner statistics (ANALYZE / PRAGMA optimize)"""
+    report = _run_maintenance('analyze')
+    click.echo(f'Analyzed in {_maintenance_summary(report)}.')
+
+
+@click.command('vacuum-db')
+@click.option('--max-pages', type=int, help='Free at most this many pages (SQLite incremental vacuum)')
+@click.option('--full', is_flag=True, help='Rewrite the whole database; blocks writers while it runs')
+def vacuum_db_command(max_pages, full):
+    """Return free space from deleted and archived rows to the file system"""
+    report = _run_maintenance('vacuum', max_pages=max_pages, full=full)
+    pages = ''
+    if 'free_pages_before' in report:
+        pages = f' Free pages: {report["free_pages_before"]} -> {report["free_pages_after"]}.'
+    click.echo(f'Vacuumed in {_maintenance_summary(report)}.{pages}')
+
+
+@click.command('backup-db')
+@click.option('--dir', 'directory', type=click.Path(file_okay=False), help='Target directory (default: BACKUP_DIR)')
+@click.option('--pages', type=int, help='Pages copied per step (default: BACKUP_STEP_PAGES)')
+@click.option('--sleep', type=float, help='Seconds to pause between steps so writers can commit')
+def backup_db_command(directory, pages, sleep):
+    """Take a hot backup without stopping the app"""
+    report = _run_maintenance('backup', directory, pages, sleep)
+    restarts = f' The copy restarted {report["restarts"]} time(s) after concurrent writes.' if report.get('restarts') else ''
+    click.echo(f'Backed up to {report["path"]} ({report["backup_size"] / 1e6:.1f} MB) '
+               f'in {report["seconds"]:.2f}s.{restarts}')
+
+
+@click.command('maintenance-status')
+def maintenance_status_command():
+    """Show the last run of each maintenance task and what the scheduler would run next"""
+    from maintenance import TASKS, due_tasks, read_state
+    state = read_state()
+    for task in TASKS:
+        report = state.get(task)
+        if not report:
+            click.echo(f'{task:8} never run')
+        elif report['ok']:
+            click.echo(f'{task:8} {report["started_at"][:19]}  ok     {_maintenance_summary(report)}')
+        else:
+            click.echo(f'{task:8} {report["started_at"][:19]}  FAILED {report["error"]}')
+    due = due_tasks(state)
+    click.echo(f'Due now: {", ".join(due) if due else "nothing"}')
+
+
+@click.command('dispatch-alerts')
+def dispatch_alerts_command():
+    """Deliver pending stock alerts now (the in-app dispatcher does this on its own)"""
+    from alerts import dispatch_all
+    counts = dispatch_all()
+    click.echo(f'{counts["claimed"]} alert(s): {counts["sent"]} sent, {counts["suppressed"]} suppressed, '
+               f'{counts["retry"]} to retry, {counts["failed"]} failed.')
+
+
+@click.command('create-indexes')
+def create_indexes_command():
+    """Add indexes declared on the models to existing tables"""
+    from query_plans import create_missing_indexes
+    created = create_missing_indexes(log=click.echo)
+    click.echo(f'Created {len(created)} index(es).' if created else 'All indexes present.')
+
+
+@click.command('check-query-plans')
+@click.argument('names', nargs=-1)
+@click.option('--verbose', '-v', is_flag=True, help='Print every plan, not only failing ones')
+def check_query_plans_command(names, verbose):
+    """EXPLAIN the hot queries and fail on full scans or temporary sorts"""
+    from query_plans import check_query_plans
+    try:
+        results = check_query_plans(names)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    
+    failed = 0
+    for name, plan, problems in results:
+        if problems:
+            failed += 1
+            click.echo(f'FAIL {name}: {"; ".join(problems)}')
+        elif verbose:
+            click.echo(f'ok   {name}')
+        if problems or verbose:
+            for detail in plan:
+                click.echo(f'       {detail}')
+    if failed:
+        raise click.ClickException(f'{failed} of {len(results)} queries lost their index '
+                                   '(run create-indexes if the database predates them).')
+    click.echo(f'All {len(results)} query plans use indexes.')
+
+
+def register_commands(app):
+    """Attach CLI commands to the app"""
+    for command in (init_db_command, create_admin_command, seed_data_command, startup_time_command,
+                    archive_transactions_command, verify_archive_command, snapshot_stock_command,
+                    value_inventory_command, reconcile_ledger_command, precompile_templates_command,
+                    build_assets_command, create_indexes_command, check_query_plans_command,
+                    migrate_locations_command, add_location_command, build_catalog_command,
+                    analyze_db_command, vacuum_db_command, backup_db_command, maintenance_status_command,
+                    dispatch_alerts_command, migrate_ledger_command):
+        app.cli.add_command(command)
@@ -0,0 +1,99 @@
+"""
+Negotiated response compression
+HTML, JSON, NDJSON and CSV responses are gzip-compressed when the client
+accepts it. Buffered responses are compressed only above
+COMPRESS_MIN_SIZE. Streamed responses (the ledger CSV export) are
+compressed chunk by chunk, with a sync flush after each chunk, so the
+client keeps receiving data while the export is generated. Server-sent
+events and files that are already encoded pass through untouched.
+"""
+
+import gzip
+import zlib
+
+from flask import current_app, request
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/csv', 'text/plain', 'text/css', 'text/javascript',
+    'application/json', 'application/x-ndjson', 'application/javascript',
+}
+
+
+def accepted_encodings():
+    """Content codings the client accepts (q > 0)"""
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def _should_compress(response):
+    if request.method == 'HEAD' or response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return False  # Also keeps text/event-stream uncompressed
+    accepted = accepted_encodings()
+    return 'gzip' in accepted or '*' in accepted
+
+
+def _compress_stream(chunks, level):
+    """gzip-frame an iterable of chunks, flushing after each one"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response):
+    """after_request hook applying gzip when it pays off"""
+    config = current_app.config
+    if not _should_compress(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    level = config['COMPRESS_LEVEL']
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=level))
+
+    response.headers['Content-Encoding'] = 'gzip'
+    if response.headers.get('ETag'):
+        # Same resource, different bytes: a strong validator no longer holds
+        etag, weak = response.get_etag()
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """Install the compression hook"""
+    if app.config['COMPRESS_ENABLED']:
+        app.after_request(compress_response)
@@ -0,0 +1,92 @@
+"""
+Concurrent execution of independent read queries
+Views that issue several unrelated queries (dashboard, reports, supplier
+details) run them on a bounded thread pool, each task in its own app
+context and therefore its own database session.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, has_request_context
+
+from models import db
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Shared bounded pool, created on first use so it is never inherited across a fork"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=current_app.config['QUERY_POOL_WORKERS'],
+                    thread_name_prefix='query'
+                )
+    return _executor
+
+
+def _can_run_in_parallel():
+    """In-memory SQLite databases are per-connection, so they must run inline.
+
+    So do the queries of a profiled request: cProfile only sees the request's
+    own thread, and the capture would otherwise miss the work it is meant to show.
+    """
+    if not current_app.config['PARALLEL_QUERIES'] or g.get('request_profile') is not None:
+        return False
+    url = db.engine.url
+    return not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'))
+
+
+def _run_task(app, func, request_stats=None, query_deadline=None):
+    started = time.perf_counter()
+    with app.app_context():
+        # Queries run here still count towards the request's metrics and its deadline
+        g.request_stats = request_stats
+        g.query_deadline = query_deadline
+        result = func()
+    return result, time.perf_counter() - started
+
+
+def run_parallel(tasks):
+    """Run named query callables concurrently and return {name: result}.
+
+    Results are detached from their session once the task finishes, so
+    tasks must eager-load any relationship the caller will touch.
+    Per-task timings are collected on g.query_timings.
+    """
+    timings = {}
+    results = {}
+
+    if _can_run_in_parallel():
+        app = current_app._get_current_object()
+        request_stats = g.get('request_stats')
+        query_deadline = g.get('query_deadline')
+        futures = {
+            name: get_executor().submit(_run_task, app, func, request_stats, query_deadline)
+            for name, func in tasks.items()
+        }
+        timeout = current_app.config['PARALLEL_QUERY_TIMEOUT']
+        for name, future in futures.items():
+            results[name], timings[name] = future.result(timeout=timeout)
+    else:
+        for name, func in tasks.items():
+            started = time.perf_counter()
+            results[name] = func()
+            timings[name] = time.perf_counter() - started
+
+    if has_request_context():
+        g.setdefault('query_timings', {}).update(timings)
+    current_app.logger.debug('Parallel query timings: %s', {
+        name: f'{seconds * 1000:.1f}ms' for name, seconds in timings.items()
+    })
+    return results
+
+
+def server_timing_header(timings):
+    """Format task timings for the Server-Timing response header"""
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items())
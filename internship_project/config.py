@@ -0,0 +1,123 @@
+"""
+Application configuration
+Values can be overridden with environment variables or by passing a
+config object/mapping to create_app()
+"""
+
+import os
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///inventory.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool for the async API tier (asgi.py)
+    ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', 10))
+    ASYNC_POOL_MAX_OVERFLOW = int(os.environ.get('ASYNC_POOL_MAX_OVERFLOW', 20))
+
+    # Independent read queries in dashboard/reports run on a bounded pool
+    PARALLEL_QUERIES = os.environ.get('PARALLEL_QUERIES', '1') == '1'
+    QUERY_POOL_WORKERS = int(os.environ.get('QUERY_POOL_WORKERS', 8))
+    PARALLEL_QUERY_TIMEOUT = 30
+
+    # Stock locations: movements that name no location go to the default one
+    DEFAULT_LOCATION_CODE = os.environ.get('DEFAULT_LOCATION_CODE', 'MAIN')
+    DEFAULT_LOCATION_NAME = os.environ.get('DEFAULT_LOCATION_NAME', 'Main warehouse')
+
+    # Change feed: ids are taken at insert, not commit, so cursors stop before a gap younger than this
+    CHANGE_FEED_SETTLE_SECONDS = int(os.environ.get('CHANGE_FEED_SETTLE_SECONDS', 60))
+
+    # Product catalog snapshot: memory-mapped file serving product-info and SKU lookups
+    CATALOG_ENABLED = os.environ.get('CATALOG_ENABLED', '1') == '1'
+    CATALOG_PATH = os.environ.get('CATALOG_PATH')  # Defaults to <instance>/catalog.bin
+    CATALOG_REFRESH_INTERVAL = float(os.environ.get('CATALOG_REFRESH_INTERVAL', 2.0))  # Seconds between version checks
+
+    # Live dashboard: each worker polls the transactions table for movements recorded by any worker
+    STOCK_EVENT_POLL_INTERVAL = 1.0  # Seconds; a movement in the same worker wakes its poller at once
+    STOCK_EVENT_BATCH_SIZE = 500
+
+    # Low-stock alerts: an outbox row per threshold crossing, delivered in batches by a dispatcher thread
+    ALERTS_ENABLED = os.environ.get('ALERTS_ENABLED', '1') == '1'
+    ALERT_SINKS = os.environ.get('ALERT_SINKS', 'inbox,email')  # Comma separated; 'webhook' needs ALERT_WEBHOOK_URL
+    ALERT_WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL')
+    ALERT_WEBHOOK_TIMEOUT = 5
+    ALERT_EMAIL_TO = os.environ.get('ALERT_EMAIL_TO', 'inventory@localhost')
+    ALERT_EMAIL_LOG = os.environ.get('ALERT_EMAIL_LOG')  # Defaults to <instance>/alert_emails.log
+    ALERT_BATCH_SIZE = 200
+    ALERT_BATCH_DELAY = 1.0  # Seconds to let a burst of movements collect into one batch
+    ALERT_DISPATCH_INTERVAL = 30  # Seconds between polls when no threshold event woke the dispatcher
+    ALERT_CLAIM_TIMEOUT = 300  # Claimed alerts not finished by then (crash, failed sink) are retried
+    ALERT_MAX_ATTEMPTS = 5
+
+    # Database maintenance: CLI commands, optionally run by an in-app scheduler (0 hours disables a task)
+    MAINTENANCE_SCHEDULE = os.environ.get('MAINTENANCE_SCHEDULE', '0') == '1'
+    MAINTENANCE_CHECK_INTERVAL = 300  # Seconds between scheduler checks
+    MAINTENANCE_ANALYZE_HOURS = float(os.environ.get('MAINTENANCE_ANALYZE_HOURS', 24))
+    MAINTENANCE_VACUUM_HOURS = float(os.environ.get('MAINTENANCE_VACUUM_HOURS', 24))
+    MAINTENANCE_BACKUP_HOURS = float(os.environ.get('MAINTENANCE_BACKUP_HOURS', 24))
+    MAINTENANCE_ANALYSIS_LIMIT = 1000  # SQLite ANALYZE rows sampled per index (0 reads everything)
+    MAINTENANCE_VACUUM_STEP_PAGES = 256  # Pages freed per incremental vacuum transaction
+    MAINTENANCE_STEP_SLEEP = 0.05  # Pause between vacuum/backup steps so writers get in
+    BACKUP_DIR = os.environ.get('BACKUP_DIR')  # Defaults to <instance>/backups
+    BACKUP_STEP_PAGES = 256
+    BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))  # Oldest backups beyond this are deleted
+
+    # Ledger archival: transactions older than the horizon move to compressed segments
+    ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS', 90))
+    ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')  # Defaults to <instance>/archive
+
+    # Workload lanes: concurrent requests per lane across all workers, and how long/how many may queue
+    LANES_ENABLED = os.environ.get('LANES_ENABLED', '1') == '1'
+    LANE_LIMITS = {
+        'interactive': int(os.environ.get('LANE_INTERACTIVE_LIMIT', 16)),
+        'heavy': int(os.environ.get('LANE_HEAVY_LIMIT', 2)),  # Report pages and exports
+        'api': int(os.environ.get('LANE_API_LIMIT', 8)),
+    }
+    LANE_MAX_WAIT = {'interactive': 30.0, 'heavy': 5.0, 'api': 2.0}  # Seconds queued before a 429
+    LANE_MAX_QUEUE = {'interactive': 64, 'heavy': 4, 'api': 32}  # Waiting requests per worker before a 429
+    LANE_RETRY_AFTER = 10  # Seconds, sent with 429 responses
+
+    # Query deadlines: seconds of database work per request by lane (per chunk for exports); 0 disables
+    QUERY_DEADLINES = {
+        'interactive': float(os.environ.get('QUERY_DEADLINE_INTERACTIVE', 10)),
+        'heavy': float(os.environ.get('QUERY_DEADLINE_HEAVY', 20)),
+        'api': float(os.environ.get('QUERY_DEADLINE_API', 5)),
+    }
+    QUERY_DEADLINE_CHECK_STEPS = 1000  # SQLite virtual machine steps between clock checks
+
+    # Report exports: chunked reads; inventory/ledger files (Parquet or Arrow with pyarrow, else gzip CSV)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))  # Rows per cursor fetch and row group
+    EXPORT_DIR = os.environ.get('EXPORT_DIR')  # Defaults to <instance>/exports
+    EXPORT_KEEP_HOURS = float(os.environ.get('EXPORT_KEEP_HOURS', 24))  # Unused files older than this are deleted
+    EXPORT_COMPRESSION = os.environ.get('EXPORT_COMPRESSION', 'zstd')  # Parquet/Arrow codec
+    EXPORT_GZIP_LEVEL = 6
+
+    # Prometheus-style metrics, one file per worker process merged on scrape
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_DIR = os.environ.get('METRICS_DIR')  # Defaults to <instance>/metrics
+    METRICS_FLUSH_INTERVAL = 1.0  # Seconds between writes of a process's metrics file
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # Bearer token required by /metrics when set
+
+    # Request profiling: admins add ?_profile=1; a fraction of all requests can be sampled
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')  # Defaults to <instance>/profiles
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+    PROFILE_KEEP = 200  # Oldest captures beyond this are deleted
+    PROFILE_TRACEMALLOC_FRAMES = 1
+
+    # Template caching: compiled bytecode on disk (shared by workers), rendered fragments in memory
+    JINJA_BYTECODE_CACHE = os.environ.get('JINJA_BYTECODE_CACHE', '1') == '1'
+    JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR')  # Defaults to <instance>/jinja_cache
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 5000))  # 0 disables fragment caching
+    FRAGMENT_CACHE_TIMEOUT = 300
+
+    # Response compression for HTML, JSON and CSV (streamed responses are compressed per chunk)
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+    COMPRESS_MIN_SIZE = 1024  # Bytes; smaller buffered responses are sent as is
+    COMPRESS_LEVEL = 6
+
+    # Demand forecasting: history window, supplier lead time, review period, service level z-score
+    FORECAST_WINDOW_DAYS = int(os.environ.get('FORECAST_WINDOW_DAYS', 90))
+    FORECAST_LEAD_TIME_DAYS = int(os.environ.get('FORECAST_LEAD_TIME_DAYS', 7))
+    FORECAST_REVIEW_DAYS = int(os.environ.get('FORECAST_REVIEW_DAYS', 14))
+    FORECAST_SERVICE_Z = float(os.environ.get('FORECAST_SERVICE_Z', 1.65))  # ~95% service level
@@ -3,13 +3,15 @@ Database initialization script
 Run this script to set up the database with sample data
 """
 
-from app import app, db
-from models import User, Product, Supplier, Transaction, create_default_admin
+from flask import current_app
+from app import create_app
+from models import db, User, Product, Supplier, Transaction, create_default_admin, backfill_stock_levels
 from datetime import datetime, timedelta
 import random
 
-def create_sample_data():
+def create_sample_data(app=None):
     """Create sample data for testing"""
+    app = app or current_app._get_current_object()
     
     with app.app_context():
         # Create sample suppliers
@@ -45,6 +47,7 @@ def create_sample_data():
             db.session.add(product)
         
         db.session.commit()
+        backfill_stock_levels()
         
         # Create sample staff user
         staff_user = User(
@@ -75,7 +78,6 @@ def create_sample_data():
                 user_id=user.id,
                 transaction_type=transaction_type,
                 quantity=quantity,
-                old_quantity=product.quantity,
                 new_quantity=product.quantity + (quantity if transaction_type == 'add' else -quantity),
                 unit_price=product.price,
                 notes=f'Sample {transaction_type} transaction',
@@ -88,4 +90,8 @@ def create_sample_data():
         print("Sample data created successfully!")
 
 if __name__ == '__main__':
-    create_sample_data()
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        create_default_admin()
+    create_sample_data(app)
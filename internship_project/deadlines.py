@@ -0,0 +1,219 @@
+"""
+Query deadlines
+Every request gets a time budget for its database work, chosen by its
+workload lane (QUERY_DEADLINES). It starts once the request has been
+admitted to its lane. A statement still running when the budget is spent
+is cancelled by the database: SQLite through a progress handler that
+checks the clock every QUERY_DEADLINE_CHECK_STEPS virtual machine steps,
+PostgreSQL through statement_timeout and MySQL/MariaDB through their
+execution time limits, both set before each statement to what is left.
+
+A cancelled statement raises QueryTimeout. Views that can do without a
+section catch it and render the rest (the reports page then asks for a
+narrower range); anywhere else it becomes a 503. Streamed exports restart
+the budget for each chunk, and a deadline can be cancelled outright, as a
+streamed export does when its client goes away.
+"""
+
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, jsonify, request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from lanes import classify
+from metrics import inc as inc_metric
+from models import db
+
+# Error codes the server databases use for a statement stopped by its time limit
+POSTGRES_QUERY_CANCELED = '57014'
+MYSQL_TIME_LIMIT_ERRORS = {3024, 1969}  # MySQL max_execution_time, MariaDB max_statement_time
+
+
+class QueryTimeout(Exception):
+    """A statement was cancelled because the request's deadline passed"""
+
+    def __init__(self, deadline):
+        self.seconds = deadline.seconds
+        self.reason = 'disconnect' if deadline.cancelled else 'deadline'
+        super().__init__(f'Database work was stopped after {deadline.seconds:g} seconds ({self.reason}).')
+
+
+class Deadline:
+    """A time budget shared by the request and its run_parallel tasks"""
+
+    def __init__(self, seconds, endpoint=None):
+        self.seconds = seconds
+        self.endpoint = endpoint
+        self.cancelled = False
+        self.restart()
+
+    def restart(self):
+        self.expires_at = time.monotonic() + self.seconds
+
+    def cancel(self):
+        self.cancelled = True
+
+    def remaining(self):
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        # Also the SQLite progress handler: a true result interrupts the statement
+        return self.cancelled or time.monotonic() >= self.expires_at
+
+
+def current_deadline():
+    if has_app_context():
+        return g.get('query_deadline')
+    return None
+
+
+def check_deadline():
+    """Raise QueryTimeout if the budget is spent; for long loops outside the database"""
+    deadline = current_deadline()
+    if deadline is not None and deadline.expired():
+        error = QueryTimeout(deadline)
+        inc_metric('query_cancellations_total', endpoint=deadline.endpoint, reason=error.reason)
+        raise error
+
+
+def restart_deadline():
+    """Give the next piece of work a full budget again (one per export chunk)"""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.restart()
+
+
+def cancel_deadline():
+    """Stop the request's remaining database work, e.g. when its client has disconnected"""
+    deadline = current_deadline()
+    if deadline is not None and not deadline.cancelled:
+        deadline.cancel()
+        inc_metric('query_cancellations_total', endpoint=deadline.endpoint, reason='disconnect')
+
+
+def lift_deadline():
+    """Drop the budget for the rest of the request, e.g. to render a partial page"""
+    if has_app_context():
+        g.pop('query_deadline', None)
+
+
+def skip_on_timeout(func):
+    """Wrap a run_parallel task for a section the page can do without: None when it times out"""
+    def run():
+        try:
+            return func()
+        except QueryTimeout:
+            return None
+    return run
+
+
+@contextmanager
+def no_deadline():
+    """Run work that must finish (writes, catch-up jobs) without the request's budget"""
+    deadline = g.pop('query_deadline', None) if has_app_context() else None
+    try:
+        yield
+    finally:
+        if deadline is not None:
+            g.query_deadline = deadline
+
+
+def _set_session(conn, statement):
+    # On a cursor of its own: the statement's cursor may be a server-side one
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(statement)
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    deadline = current_deadline()
+    if deadline is None and conn.info.get('query_deadline') is None:
+        return  # Nothing to set or to clear
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        if conn.info.get('query_deadline') is not deadline:
+            if deadline is None:
+                conn.connection.driver_connection.set_progress_handler(None, 0)
+            else:
+                steps = current_app.config['QUERY_DEADLINE_CHECK_STEPS']
+                conn.connection.driver_connection.set_progress_handler(deadline.expired, steps)
+    elif dialect == 'postgresql':
+        milliseconds = max(int(deadline.remaining() * 1000), 1) if deadline is not None else 0
+        _set_session(conn, f'SET statement_timeout = {milliseconds}')
+    elif dialect in ('mysql', 'mariadb'):
+        if conn.dialect.is_mariadb:
+            seconds = max(deadline.remaining(), 0.001) if deadline is not None else 0
+            _set_session(conn, f'SET SESSION max_statement_time = {seconds:.3f}')
+        else:
+            milliseconds = max(int(deadline.remaining() * 1000), 1) if deadline is not None else 0
+            _set_session(conn, f'SET SESSION max_execution_time = {milliseconds}')
+    conn.info['query_deadline'] = deadline
+
+
+def _reset(dbapi_connection, connection_record, reset_state):
+    # A pooled SQLite connection must not carry a finished request's handler into its rollback
+    if connection_record.info.pop('query_deadline', None) is not None and \
+            isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+def _is_cancellation(error):
+    if isinstance(error, sqlite3.OperationalError):
+        return str(error) == 'interrupted'
+    if (getattr(error, 'pgcode', None) or getattr(error, 'sqlstate', None)) == POSTGRES_QUERY_CANCELED:
+        return True
+    args = getattr(error, 'args', ())
+    return bool(args) and args[0] in MYSQL_TIME_LIMIT_ERRORS
+
+
+def _handle_error(context):
+    deadline = current_deadline()
+    if deadline is None or not _is_cancellation(context.original_exception):
+        return
+    error = QueryTimeout(deadline)
+    inc_metric('query_cancellations_total', endpoint=deadline.endpoint, reason=error.reason)
+    raise error from context.original_exception
+
+
+def timeout_message(seconds):
+    return (f'This request needed more than {seconds:g} seconds of database time and was stopped. '
+            f'Narrow the date range or filters and try again.')
+
+
+def _timeout_response(error):
+    db.session.rollback()
+    message = timeout_message(error.seconds)
+    if request.path.startswith('/api/') or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'error': message})
+    else:
+        response = Response(message, mimetype='text/plain')
+    response.status_code = 503
+    return response
+
+
+_registered = False
+
+
+def init_deadlines(app):
+    """Start each request's budget after lane admission; cancel statements that outlive it"""
+    global _registered
+    if not _registered:
+        _registered = True
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        event.listen(Pool, 'reset', _reset)
+
+    @app.before_request
+    def start_deadline():
+        lane = classify(request.endpoint, request.path)
+        seconds = app.config['QUERY_DEADLINES'].get(lane) if lane else None
+        if seconds:
+            g.query_deadline = Deadline(seconds, endpoint=request.endpoint)
+
+    app.register_error_handler(QueryTimeout, _timeout_response)
@@ -0,0 +1,303 @@
+"""
+Live stock events for the dashboard
+Every worker runs a poller thread that reads newly committed movements from
+the shared transactions table and fans them out to its own Server-Sent
+Events subscribers, so a dashboard sees movements recorded by any worker.
+Event ids are transaction ids: a reconnecting EventSource resumes from
+Last-Event-ID on whichever worker it reaches. Product.update_stock wakes the
+poller of its own worker so local movements show up at once.
+"""
+
+import asyncio
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+
+
+# Set when a committed movement crossed a stock threshold; the alert dispatcher waits on it
+alert_pending = threading.Event()
+# Set after every committed movement; the stock event poller waits on it
+movement_recorded = threading.Event()
+
+_poller_pid = None
+_poller_lock = threading.Lock()
+
+
+class Subscription:
+    """A single SSE client listening for stock events"""
+
+    def __init__(self, max_queue, start_id):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.closed = False
+        self.start_id = start_id  # Newest event published before the client subscribed
+
+    def put_nowait(self, event):
+        self.queue.put_nowait(event)
+
+    def close(self):
+        self.closed = True
+
+    def get(self, timeout):
+        """Wait for the next event, returns None on timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """An SSE client served on an asyncio event loop (asgi.py); waiting holds no thread"""
+
+    def __init__(self, max_queue, start_id, loop):
+        super().__init__(max_queue, start_id)
+        self.loop = loop
+        self.ready = asyncio.Event()
+
+    def put_nowait(self, event):
+        self.queue.put_nowait(event)
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    def close(self):
+        self.closed = True
+        self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def get_async(self, timeout):
+        """Wait for the next event, returns None on timeout or when closed"""
+        while not self.closed:
+            try:
+                return self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.ready.clear()
+            if not self.queue.empty() or self.closed:
+                continue
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return None
+
+
+class StockEventBroker:
+    """Per-process publish/subscribe hub for stock movement events.
+
+    Publishing never blocks: every subscriber has a bounded queue and a
+    client that falls too far behind is dropped, the browser's EventSource
+    then reconnects and catches up from the database using Last-Event-ID.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.last_id = None  # Newest transaction id handed to subscribers; None until the poller starts
+
+    def publish(self, event):
+        """Publish an event to every connected subscriber"""
+        with self._lock:
+            self.last_id = event['id']
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Slow consumer - disconnect it and let it resume from the database
+                subscriber.close()
+                self.unsubscribe(subscriber)
+        return event
+
+    def skip_to(self, last_id):
+        """Move past events nobody is listening for; False if a subscriber arrived meanwhile"""
+        with self._lock:
+            if self._subscribers:
+                return False
+            self.last_id = last_id
+            return True
+
+    def subscribe(self, loop=None):
+        """Register a new subscriber; it receives events newer than its start_id.
+
+        Pass the event loop for a subscriber served by asgi.py.
+        """
+        with self._lock:
+            if loop is None:
+                subscriber = Subscription(self.max_queue, self.last_id)
+            else:
+                subscriber = AsyncSubscription(self.max_queue, self.last_id, loop)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber"""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        """Number of currently connected subscribers"""
+        with self._lock:
+            return len(self._subscribers)
+
+
+broker = StockEventBroker()
+
+
+def movement_events(after_id, until_id=None, limit=None):
+    """Stock events for committed movements after a transaction id, oldest first"""
+    from sqlalchemy.orm import joinedload
+    from changefeed import settled_through
+    from models import Transaction
+
+    ceiling = settled_through(Transaction, after_id)
+    if until_id is not None:
+        ceiling = until_id if ceiling is None else min(ceiling, until_id)
+    query = Transaction.query.options(joinedload(Transaction.product), joinedload(Transaction.user))\
+        .filter(Transaction.id > after_id)
+    if ceiling is not None:
+        query = query.filter(Transaction.id <= ceiling)
+    query = query.order_by(Transaction.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [_movement_event(transaction) for transaction in query]
+
+
+def _movement_event(transaction):
+    product = transaction.product
+    signed_quantity = transaction.quantity if transaction.transaction_type == 'add' else -transaction.quantity
+    old_status = product.get_stock_status(transaction.old_quantity)
+    new_status = product.get_stock_status(transaction.new_quantity)
+    data = {
+        'transaction_id': transaction.id,
+        'product_id': product.id,
+        'product_name': product.name,
+        'category': product.category,
+        'transaction_type': transaction.transaction_type,
+        'quantity': transaction.quantity,
+        'old_quantity': transaction.old_quantity,
+        'new_quantity': transaction.new_quantity,
+        'min_stock_level': product.min_stock_level,
+        'value_delta': signed_quantity * product.price,
+        'user': transaction.user.username if transaction.user else None,
+        'created_at': (transaction.created_at or datetime.utcnow()).strftime('%Y-%m-%d %H:%M'),
+        'old_status': old_status,
+        'new_status': new_status
+    }
+    return {'id': transaction.id, 'data': data, 'threshold': old_status != new_status}
+
+
+def _latest_settled_id():
+    from changefeed import settled_through
+    from models import db, Transaction
+
+    latest = db.session.query(db.func.max(Transaction.id)).scalar() or 0
+    ceiling = settled_through(Transaction, 0)
+    return latest if ceiling is None else ceiling
+
+
+def _poll_loop(app):
+    from models import db
+
+    while True:
+        movement_recorded.wait(app.config['STOCK_EVENT_POLL_INTERVAL'])
+        movement_recorded.clear()
+        with app.app_context():
+            try:
+                if not broker.subscriber_count():
+                    broker.skip_to(_latest_settled_id())
+                    continue
+                for event in movement_events(broker.last_id, limit=app.config['STOCK_EVENT_BATCH_SIZE']):
+                    broker.publish(event)
+            except Exception:
+                app.logger.exception('Stock event polling failed')
+            finally:
+                db.session.remove()
+
+
+def start_event_poller(app):
+    """Start this worker's poller thread, reading from the newest committed movement"""
+    global _poller_pid
+    with _poller_lock:
+        if _poller_pid == os.getpid():
+            return
+        broker.skip_to(_latest_settled_id())
+        _poller_pid = os.getpid()
+        threading.Thread(target=_poll_loop, args=(app,), name='stock-events', daemon=True).start()
+
+
+def format_sse(event):
+    """Format an event dict as Server-Sent Events messages: the movement, then any threshold crossing"""
+    if event.get('reset'):
+        return f"id: {event['id']}\nevent: reset\ndata: {{}}\n\n"
+    data = json.dumps(event['data'])
+    message = f"id: {event['id']}\nevent: stock\ndata: {data}\n\n"
+    if event['threshold']:
+        message += f"id: {event['id']}\nevent: threshold\ndata: {data}\n\n"
+    return message
+
+
+def replay_events(last_event_id, start_id, limit):
+    """Events a reconnecting client missed before it subscribed, possibly recorded by another worker.
+
+    A client that missed more than limit events gets a single reset event
+    instead, telling it to reload its totals rather than apply a partial history.
+    """
+    if last_event_id is None or start_id is None or last_event_id >= start_id:
+        return []
+    events = movement_events(last_event_id, until_id=start_id, limit=limit + 1)
+    if len(events) > limit:
+        return [{'id': start_id, 'reset': True}]
+    return events
+
+
+def stream_events(subscriber, replay=(), heartbeat=15):
+    """Yield SSE messages for a subscriber until the client goes away.
+
+    replay holds the events the client missed before it subscribed. Under a
+    cooperative worker (gunicorn -k gevent) the queue wait yields to other
+    clients, so hundreds of dashboards share a single worker process.
+    """
+    try:
+        yield 'retry: 3000\n\n'
+        last_id = subscriber.start_id or 0
+        for event in replay:
+            yield format_sse(event)
+        while not subscriber.closed:
+            event = subscriber.get(timeout=heartbeat)
+            if event is None:
+                # Comment line keeps proxies from closing idle connections
+                yield ': keep-alive\n\n'
+                continue
+            if event['id'] > last_id:
+                last_id = event['id']
+                yield format_sse(event)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+async def stream_events_async(subscriber, replay=(), heartbeat=15):
+    """stream_events for an AsyncSubscription"""
+    try:
+        yield 'retry: 3000\n\n'
+        last_id = subscriber.start_id or 0
+        for event in replay:
+            yield format_sse(event)
+        while not subscriber.closed:
+            event = await subscriber.get_async(timeout=heartbeat)
+            if event is None:
+                if not subscriber.closed:
+                    yield ': keep-alive\n\n'
+                continue
+            if event['id'] > last_id:
+                last_id = event['id']
+                yield format_sse(event)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+def notify_stock_movement(crossed_threshold):
+    """Wake this worker's event poller (and the alert dispatcher) after a committed movement"""
+    movement_recorded.set()
+    if crossed_threshold:
+        alert_pending.set()
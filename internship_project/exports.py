@@ -0,0 +1,264 @@
+"""
+Report export files
+Inventory and ledger exports for BI jobs, written to <instance>/exports as
+Parquet or Arrow IPC when pyarrow is installed and as gzip-compressed CSV
+otherwise. Rows are fetched from the database cursor EXPORT_CHUNK_SIZE at
+a time and each chunk becomes one row group (Parquet), record batch
+(Arrow) or gzip member (CSV), so no export is ever held in memory whole.
+
+A file's name includes a digest of its parameters and of the data version
+(latest change log and transaction ids), so repeating an export while
+nothing has changed reuses the file. Finished files are immutable and are
+served with HTTP range support, so an interrupted download can resume.
+The request's query deadline applies to each chunk rather than the whole
+file.
+"""
+
+import csv
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+
+from flask import current_app
+from sqlalchemy import select
+
+from archive import attach_relations, iter_archived_transactions, range_reaches_archive
+from deadlines import restart_deadline
+from metrics import inc as inc_metric
+from models import db, Product, Supplier, Transaction, TransactionNote, User, Location
+from template_cache import catalog_version
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# format -> (file extension, mimetype)
+FORMATS = {
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+}
+
+# report -> [(column, type)]
+COLUMNS = {
+    'inventory': [
+        ('product_id', 'int'), ('name', 'str'), ('sku', 'str'), ('category', 'str'), ('supplier', 'str'),
+        ('price', 'float'), ('quantity', 'int'), ('min_stock_level', 'int'), ('stock_status', 'str'),
+        ('total_value', 'float'),
+    ],
+    'transactions': [
+        ('id', 'int'), ('created_at', 'timestamp'), ('product_id', 'int'), ('product', 'str'), ('sku', 'str'),
+        ('type', 'str'), ('quantity', 'int'), ('old_quantity', 'int'), ('new_quantity', 'int'),
+        ('unit_price', 'float'), ('user', 'str'), ('location', 'str'), ('notes', 'str'),
+    ],
+}
+
+
+def export_dir():
+    return current_app.config['EXPORT_DIR'] or os.path.join(current_app.instance_path, 'exports')
+
+
+def resolve_format(name):
+    """The format actually written for a requested one (columnar needs pyarrow)"""
+    if name not in FORMATS:
+        raise ValueError(f'Unknown export format: {name}')
+    if name in ('parquet', 'arrow') and pa is None:
+        return 'csv.gz'
+    return name
+
+
+def split_name(filename):
+    """(download name, mimetype) for an export file name, or None if it is not one"""
+    stem, dot, extension = filename.partition('.')
+    mimetypes = {ext: mimetype for ext, mimetype in FORMATS.values()}
+    base, dash, digest = stem.rpartition('-')
+    if not dash or f'.{extension}' not in mimetypes:
+        return None
+    return f'{base}.{extension}', mimetypes[f'.{extension}']
+
+
+# Row sources: lists of tuples in COLUMNS order, one list per cursor chunk
+
+def _inventory_chunks(chunk_size):
+    statement = (
+        select(Product.id, Product.name, Product.sku, Product.category, Supplier.name,
+               Product.price, Product.quantity, Product.min_stock_level)
+        .join(Supplier, Product.supplier_id == Supplier.id)
+        .where(Product.is_active == True)
+        .order_by(Product.name)
+    )
+    result = db.session.execute(statement, execution_options={'yield_per': chunk_size})
+    for rows in result.partitions():
+        chunk = []
+        for id, name, sku, category, supplier, price, quantity, minimum in rows:
+            if quantity <= 0:
+                status = 'out_of_stock'
+            elif quantity <= minimum:
+                status = 'low_stock'
+            else:
+                status = 'in_stock'
+            chunk.append((id, name, sku, category, supplier, price, quantity, minimum, status, quantity * price))
+        yield chunk
+
+
+def _transaction_chunks(chunk_size, start_date, end_date):
+    # Hot rows first (newest), then archived rows, like the CSV export
+    statement = (
+        select(Transaction.id, Transaction.created_at, Transaction.product_id, Product.name, Product.sku,
+               Transaction.transaction_type, Transaction.quantity, Transaction.old_quantity,
+               Transaction.new_quantity, Transaction.unit_price, User.username, Location.code,
+               TransactionNote.text)
+        .join(Product, Transaction.product_id == Product.id)
+        .join(User, Transaction.user_id == User.id)
+        .outerjoin(Location, Transaction.location_id == Location.id)
+        .outerjoin(TransactionNote, TransactionNote.transaction_id == Transaction.id)
+        .where(Transaction.created_at >= start_date, Transaction.created_at <= end_date)
+        .order_by(Transaction.created_at.desc())
+    )
+    result = db.session.execute(statement, execution_options={'yield_per': chunk_size})
+    for rows in result.partitions():
+        yield [tuple(row) for row in rows]
+
+    if range_reaches_archive(start_date):
+        chunk = []
+        for row in iter_archived_transactions(start_date=start_date, end_date=end_date, newest_first=True):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield _archived_tuples(chunk)
+                chunk = []
+        if chunk:
+            yield _archived_tuples(chunk)
+
+
+def _archived_tuples(rows):
+    return [(row.id, row.created_at, row.product_id, row.product.name, row.product.sku,
+             row.transaction_type, row.quantity, row.old_quantity, row.new_quantity, row.unit_price,
+             row.user.username, row.location.code if row.location else None, row.notes)
+            for row in attach_relations(rows)]
+
+
+# Writers
+
+class CsvGzipWriter:
+    """CSV with one gzip member per chunk; concatenated members are a valid gzip file"""
+
+    def __init__(self, f, columns):
+        self.f = f
+        self.header = [name for name, _ in columns]
+        self.level = current_app.config['EXPORT_GZIP_LEVEL']
+
+    def write(self, rows):
+        output = StringIO()
+        writer = csv.writer(output)
+        if self.header:
+            writer.writerow(self.header)
+            self.header = None
+        for row in rows:
+            writer.writerow(['' if value is None else
+                             value.strftime('%Y-%m-%d %H:%M:%S') if hasattr(value, 'strftime') else value
+                             for value in row])
+        self.f.write(gzip.compress(output.getvalue().encode('utf-8'), compresslevel=self.level, mtime=0))
+
+    def close(self):
+        if self.header:  # No rows at all: still write the header
+            self.write([])
+
+
+class ArrowWriter:
+    """Parquet row groups or Arrow IPC record batches, one per chunk"""
+
+    TYPES = {'int': 'int64', 'float': 'float64', 'str': 'string'}
+
+    def __init__(self, f, columns, fmt):
+        compression = current_app.config['EXPORT_COMPRESSION']
+        self.schema = pa.schema([
+            (name, pa.timestamp('us') if kind == 'timestamp' else pa.type_for_alias(self.TYPES[kind]))
+            for name, kind in columns
+        ])
+        if fmt == 'parquet':
+            self.writer = pq.ParquetWriter(f, self.schema, compression=compression)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=compression)
+            self.writer = pa.ipc.new_file(f, self.schema, options=options)
+
+    def write(self, rows):
+        arrays = [pa.array(list(values), type=field.type)
+                  for values, field in zip(zip(*rows), self.schema)] if rows else \
+                 [pa.array([], type=field.type) for field in self.schema]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _data_version():
+    latest_transaction = db.session.query(db.func.max(Transaction.id)).scalar() or 0
+    return f'{catalog_version()}.{latest_transaction}'
+
+
+def _prune(directory):
+    cutoff = time.time() - current_app.config['EXPORT_KEEP_HOURS'] * 3600
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass  # Removed by another worker meanwhile
+
+
+def write_export(report, fmt, date_from, date_to, start_date=None, end_date=None):
+    """Write (or reuse) an export file; returns its name inside export_dir().
+
+    fmt must already be resolved with resolve_format().
+    """
+    directory = export_dir()
+    os.makedirs(directory, exist_ok=True)
+    key = json.dumps([report, fmt, date_from, date_to, _data_version()])
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    name = f'{report}_{date_from}_to_{date_to}-{digest}{FORMATS[fmt][0]}'
+    path = os.path.join(directory, name)
+    if os.path.exists(path):
+        os.utime(path)  # Keep it around while it is being asked for
+        inc_metric('inventory_export_files_total', report=report, format=fmt, result='reused')
+        return name
+
+    chunk_size = current_app.config['EXPORT_CHUNK_SIZE']
+    if report == 'inventory':
+        chunks = _inventory_chunks(chunk_size)
+    elif report == 'transactions':
+        chunks = _transaction_chunks(chunk_size, start_date, end_date)
+    else:
+        raise ValueError(f'No file export for {report} reports')
+
+    _prune(directory)
+    # A part file of its own: another thread may be writing the same export right now
+    fd, part = tempfile.mkstemp(prefix=f'{name}.', suffix='.part', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            os.fchmod(fd, 0o644)  # mkstemp files are private; exports are read like any other file
+            columns = COLUMNS[report]
+            writer = CsvGzipWriter(f, columns) if fmt == 'csv.gz' else ArrowWriter(f, columns, fmt)
+            for chunk in chunks:
+                writer.write(chunk)
+                inc_metric('inventory_export_rows_total', len(chunk), report=report)
+                restart_deadline()  # Long exports are fine as long as every chunk comes in time
+            writer.close()
+        if os.path.exists(path):
+            # Someone else finished the same export first: theirs is just as good
+            os.remove(part)
+            inc_metric('inventory_export_files_total', report=report, format=fmt, result='reused')
+            return name
+        os.replace(part, path)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    inc_metric('inventory_export_files_total', report=report, format=fmt, result='written')
+    return name
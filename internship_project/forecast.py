@@ -0,0 +1,179 @@
+"""
+Demand forecasting and reorder-point suggestions
+Stock-out movements are read as columnar NumPy arrays and aggregated per
+SKU and day without Python-level loops, so a full catalog over a long
+history is processed in seconds.
+
+For each product:
+    velocity      mean units removed per day over the window
+    variability   standard deviation of daily demand
+    days of cover current stock / velocity
+    reorder point velocity * lead time + z * std * sqrt(lead time)
+    order qty     order-up-to (reorder point + velocity * review period) - stock
+"""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, func, Float
+
+from archive import iter_archived_transactions, range_reaches_archive
+from models import db, Product, Supplier, Transaction, MOVEMENT_TYPES
+
+READ_CHUNK_SIZE = 100000
+DAILY_BUCKETS_PER_BLOCK = 8000000
+
+
+def _day_offset(column, start):
+    """SQL expression for fractional days between start and a timestamp"""
+    if db.engine.dialect.name == 'sqlite':
+        return func.julianday(column) - func.julianday(start)
+    return func.cast(func.extract('epoch', column - start), Float) / 86400.0
+
+
+def load_demand(start, end):
+    """Return (product_ids, day_index, quantity) arrays for stock-out movements"""
+    import numpy as np
+
+    statement = select(
+        Transaction.product_id,
+        _day_offset(Transaction.created_at, start),
+        Transaction.quantity
+    ).where(
+        Transaction.movement == MOVEMENT_TYPES['remove'],
+        Transaction.created_at >= start,
+        Transaction.created_at <= end
+    )
+
+    ids, days, quantities = [], [], []
+    result = db.session.execute(statement.execution_options(yield_per=READ_CHUNK_SIZE))
+    for chunk in result.partitions():
+        columns = np.array(chunk, dtype=np.float64).reshape(-1, 3)
+        ids.append(columns[:, 0].astype(np.int64))
+        days.append(np.floor(columns[:, 1]).astype(np.int64))
+        quantities.append(columns[:, 2])
+
+    if range_reaches_archive(start):
+        archived = [(row.product_id, (row.created_at - start).days, row.quantity)
+                    for row in iter_archived_transactions(start_date=start, end_date=end,
+                                                          transaction_type='remove')]
+        if archived:
+            columns = np.array(archived, dtype=np.float64)
+            ids.append(columns[:, 0].astype(np.int64))
+            days.append(columns[:, 1].astype(np.int64))
+            quantities.append(columns[:, 2])
+
+    if not ids:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float64)
+    return np.concatenate(ids), np.concatenate(days), np.concatenate(quantities)
+
+
+def demand_statistics(product_ids, days, quantities, window_days):
+    """Per-SKU mean and standard deviation of daily demand.
+
+    Returns (skus, mean, std) with skus sorted ascending. Days without any
+    movement count as zero demand.
+    """
+    import numpy as np
+
+    if not len(product_ids):
+        return np.empty(0, np.int64), np.empty(0), np.empty(0)
+
+    # Dense SKU index through a lookup table instead of sorting the movements
+    present = np.zeros(int(product_ids.max()) + 1, dtype=bool)
+    present[product_ids] = True
+    skus = np.flatnonzero(present)
+    lookup = np.cumsum(present) - 1
+    sku_index = lookup[product_ids]
+    days = np.clip(days, 0, window_days - 1)
+
+    # Daily demand per (sku, day) via bincount, a block of SKUs at a time to bound memory
+    total = np.zeros(len(skus))
+    total_sq = np.zeros(len(skus))
+    block = max(1, DAILY_BUCKETS_PER_BLOCK // window_days)
+    for first in range(0, len(skus), block):
+        last = min(first + block, len(skus))
+        if first == 0 and last == len(skus):
+            selected = slice(None)
+        else:
+            selected = (sku_index >= first) & (sku_index < last)
+        keys = (sku_index[selected] - first) * window_days + days[selected]
+        daily = np.bincount(keys, weights=quantities[selected],
+                            minlength=(last - first) * window_days).reshape(-1, window_days)
+        total[first:last] = daily.sum(axis=1)
+        total_sq[first:last] = np.square(daily).sum(axis=1)
+
+    mean = total / window_days
+    variance = np.maximum(total_sq / window_days - mean ** 2, 0.0)
+    return skus, mean, np.sqrt(variance)
+
+
+def reorder_suggestions(window_days=None, lead_time_days=None, review_days=None,
+                        service_z=None, now=None, only_needed=True):
+    """Compute velocity, days of cover and reorder quantities for active products.
+
+    Rows are grouped by supplier (ordered by supplier name, most urgent
+    first within each supplier).
+    """
+    import numpy as np
+
+    config = current_app.config
+    window_days = window_days or config['FORECAST_WINDOW_DAYS']
+    lead_time_days = lead_time_days or config['FORECAST_LEAD_TIME_DAYS']
+    review_days = review_days or config['FORECAST_REVIEW_DAYS']
+    service_z = service_z if service_z is not None else config['FORECAST_SERVICE_Z']
+
+    end = now or datetime.utcnow()
+    start = end - timedelta(days=window_days)
+
+    skus, mean, std = demand_statistics(*load_demand(start, end), window_days)
+
+    products = db.session.execute(
+        select(Product.id, Product.name, Product.sku, Product.quantity, Product.min_stock_level,
+               Supplier.id, Supplier.name)
+        .join(Supplier, Product.supplier_id == Supplier.id)
+        .where(Product.is_active == True)
+    ).all()
+    if not products:
+        return []
+
+    product_ids = np.fromiter((p[0] for p in products), dtype=np.int64, count=len(products))
+    on_hand = np.fromiter((p[3] for p in products), dtype=np.float64, count=len(products))
+
+    # Align demand statistics with the product list (no demand -> zero)
+    velocity = np.zeros(len(products))
+    variability = np.zeros(len(products))
+    if len(skus):
+        position = np.minimum(np.searchsorted(skus, product_ids), len(skus) - 1)
+        found = skus[position] == product_ids
+        velocity[found] = mean[position[found]]
+        variability[found] = std[position[found]]
+
+    safety_stock = service_z * variability * np.sqrt(lead_time_days)
+    reorder_point = np.ceil(velocity * lead_time_days + safety_stock)
+    order_up_to = reorder_point + velocity * review_days
+    days_of_cover = np.divide(on_hand, velocity, out=np.full(len(products), np.inf), where=velocity > 0)
+    needs_reorder = (velocity > 0) & (on_hand <= reorder_point)
+    order_quantity = np.where(needs_reorder, np.ceil(np.maximum(order_up_to - on_hand, 0)), 0)
+
+    selected = np.flatnonzero(needs_reorder) if only_needed else np.arange(len(products))
+    rows = []
+    for i in selected:
+        product_id, name, sku, quantity, min_stock_level, supplier_id, supplier_name = products[i]
+        rows.append({
+            'product_id': product_id,
+            'name': name,
+            'sku': sku,
+            'supplier_id': supplier_id,
+            'supplier': supplier_name,
+            'quantity': quantity,
+            'min_stock_level': min_stock_level,
+            'velocity': float(velocity[i]),
+            'variability': float(variability[i]),
+            'days_of_cover': float(days_of_cover[i]),
+            'reorder_point': int(reorder_point[i]),
+            'order_quantity': int(order_quantity[i])
+        })
+
+    rows.sort(key=lambda r: (r['supplier'], r['days_of_cover']))
+    return rows
@@ -0,0 +1,191 @@
+"""
+Workload lanes
+Admission control that keeps heavy reads from starving everyone else.
+Each request is put in a lane by endpoint: heavy (report pages, exports,
+export downloads), api (/api/...) or interactive (everything else). Each
+lane has its own limit on concurrent requests across all workers.
+
+A slot is one of LANE_LIMITS[lane] lock files under <instance>/lanes,
+held with flock for as long as the response is being sent (streamed
+exports included). Workers therefore share the limit without talking to
+each other, and a crashed worker's slots are freed by the kernel. A
+request that finds no free slot waits in its lane for up to
+LANE_MAX_WAIT[lane] seconds. After that, or when LANE_MAX_QUEUE requests
+are already waiting in this worker, it gets 429 with Retry-After.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from flask import g, jsonify, request, Response
+
+from metrics import inc as inc_metric, observe
+
+try:
+    import fcntl
+except ImportError:  # No flock on Windows: limits are then per worker
+    fcntl = None
+
+# Endpoints that read a lot of data and may run for a long time
+HEAVY_ENDPOINTS = {
+    'main.reports', 'main.export_report', 'main.download_export', 'main.inventory_as_of_report',
+}
+
+# Never queued: long-lived streams, static files and the metrics scrape
+EXEMPT_ENDPOINTS = {'main.dashboard_stream', 'main.asset', 'main.metrics', 'static'}
+
+_lock = threading.Lock()
+_waiting = {}  # lane -> requests waiting in this worker
+_semaphores = {}  # lane -> semaphore when flock is unavailable
+
+
+def classify(endpoint, path):
+    """Lane for a request, or None if it is not subject to admission control"""
+    if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+        return None
+    if endpoint in HEAVY_ENDPOINTS:
+        return 'heavy'
+    if path.startswith('/api/'):
+        return 'api'
+    return 'interactive'
+
+
+class Slot:
+    """A held place in a lane; release() may be called more than once"""
+
+    def __init__(self, lane, lock_file=None, semaphore=None):
+        self.lane = lane
+        self.lock_file = lock_file
+        self.semaphore = semaphore
+
+    def release(self):
+        if self.lock_file is not None:
+            self.lock_file.close()  # Closing drops the flock
+            self.lock_file = None
+        elif self.semaphore is not None:
+            self.semaphore.release()
+            self.semaphore = None
+
+
+def _try_acquire(lane, directory, limit):
+    if fcntl is None:
+        with _lock:
+            semaphore = _semaphores.setdefault(lane, threading.BoundedSemaphore(limit))
+        return Slot(lane, semaphore=semaphore) if semaphore.acquire(blocking=False) else None
+    for index in range(limit):
+        lock_file = open(os.path.join(directory, f'{lane}.{index}.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        return Slot(lane, lock_file=lock_file)
+    return None
+
+
+def _admission(lane, config, directory):
+    """Steps of admission shared by acquire and acquire_async: yields the delays to sleep, returns the slot"""
+    limit = config['LANE_LIMITS'][lane]
+    slot = _try_acquire(lane, directory, limit)
+    if slot is not None:
+        observe('lane_queue_depth', 0, lane=lane)
+        observe('lane_wait_seconds', 0.0, lane=lane)
+        return slot
+
+    with _lock:
+        depth = _waiting.get(lane, 0)
+        if depth >= config['LANE_MAX_QUEUE'][lane]:
+            observe('lane_queue_depth', depth, lane=lane)
+            return None
+        _waiting[lane] = depth + 1
+    observe('lane_queue_depth', depth + 1, lane=lane)
+
+    started = time.perf_counter()
+    deadline = started + config['LANE_MAX_WAIT'][lane]
+    delay = 0.01
+    try:
+        while slot is None and time.perf_counter() < deadline:
+            yield min(delay, max(deadline - time.perf_counter(), 0))
+            delay = min(delay * 2, 0.1)
+            slot = _try_acquire(lane, directory, limit)
+    finally:
+        with _lock:
+            _waiting[lane] -= 1
+    observe('lane_wait_seconds', time.perf_counter() - started, lane=lane)
+    return slot
+
+
+def acquire(lane, config, directory):
+    """Wait for a slot in the lane; returns a Slot, or None if the request should be turned away"""
+    steps = _admission(lane, config, directory)
+    try:
+        while True:
+            time.sleep(next(steps))
+    except StopIteration as done:
+        return done.value
+
+
+async def acquire_async(lane, config, directory):
+    """acquire for requests served on an event loop (asgi.py): waits without blocking the loop"""
+    steps = _admission(lane, config, directory)
+    try:
+        while True:
+            await asyncio.sleep(next(steps))
+    except StopIteration as done:
+        return done.value
+
+
+def lanes_dir(app):
+    return os.path.join(app.instance_path, 'lanes')
+
+
+def busy_message(lane, retry_after):
+    return f'The server is busy with other {lane} requests. Try again in {retry_after} seconds.'
+
+
+def _busy_response(lane, retry_after):
+    message = busy_message(lane, retry_after)
+    if lane == 'api' or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'error': message})
+    else:
+        response = Response(message, mimetype='text/plain')
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def init_lanes(app):
+    """Admit each request into its lane before it runs; hold the slot until the response is sent"""
+    if not app.config['LANES_ENABLED']:
+        return
+    directory = lanes_dir(app)
+    os.makedirs(directory, exist_ok=True)
+
+    @app.before_request
+    def admit():
+        lane = classify(request.endpoint, request.path)
+        if lane is None:
+            return None
+        slot = acquire(lane, app.config, directory)
+        if slot is None:
+            inc_metric('lane_requests_total', lane=lane, result='rejected')
+            return _busy_response(lane, app.config['LANE_RETRY_AFTER'])
+        inc_metric('lane_requests_total', lane=lane, result='admitted')
+        g.lane_slot = slot
+        return None
+
+    @app.after_request
+    def hand_over(response):
+        slot = g.pop('lane_slot', None)
+        if slot is not None:
+            # Streamed responses keep running after the view returns
+            response.call_on_close(slot.release)
+        return response
+
+    @app.teardown_request
+    def release_on_error(exception=None):
+        slot = g.pop('lane_slot', None)  # Still here only if no response was produced
+        if slot is not None:
+            slot.release()
@@ -0,0 +1,184 @@
+"""
+Compact ledger encoding migration
+Rewrites a transactions table from the original encoding (type as text,
+float prices, old_quantity, inline notes) into the compact one declared on
+Transaction: a small-integer movement, prices in cents, no old_quantity
+and notes in transaction_notes.
+
+Rows are copied in id order, batch_size at a time, into a new table that
+has no indexes yet, each batch in its own short transaction. An
+interrupted run resumes after the last copied id. Once everything is
+copied, one transaction drops the old table, renames the new one and
+builds its indexes. SQLite only. Run it with the app stopped, because the
+new code cannot write to the old table.
+
+The same rebuild gives a compact table created before ids were declared
+AUTOINCREMENT its never-reused ids, continuing above the highest id held
+in the hot table or the archive.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models import db, Transaction, TransactionNote, MOVEMENT_TYPES, PRICE_SCALE
+
+COMPACT_TABLE = 'transactions_compact'
+
+_COPY = f"""
+INSERT INTO {COMPACT_TABLE} (id, product_id, user_id, location_id, movement, quantity, new_quantity,
+                             unit_price_cents, created_at)
+SELECT id, product_id, user_id, location_id,
+       CASE transaction_type WHEN 'add' THEN {MOVEMENT_TYPES['add']} ELSE {MOVEMENT_TYPES['remove']} END,
+       quantity, new_quantity, CAST(ROUND(unit_price * {PRICE_SCALE}) AS INTEGER), created_at
+FROM transactions WHERE id > :after AND id <= :until
+"""
+
+# A compact table without AUTOINCREMENT: the columns copy as they are
+_COPY_COMPACT = f"""
+INSERT INTO {COMPACT_TABLE} (id, product_id, user_id, location_id, movement, quantity, new_quantity,
+                             unit_price_cents, created_at)
+SELECT id, product_id, user_id, location_id, movement, quantity, new_quantity, unit_price_cents, created_at
+FROM transactions WHERE id > :after AND id <= :until
+"""
+
+_COPY_NOTES = """
+INSERT INTO transaction_notes (transaction_id, text)
+SELECT id, notes FROM transactions
+WHERE id > :after AND id <= :until AND notes IS NOT NULL AND notes <> ''
+"""
+
+
+def _table_names():
+    return db.inspect(db.engine).get_table_names()
+
+
+def needs_migration():
+    """Whether the transactions table still uses the original encoding"""
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('transactions')}
+    return 'transaction_type' in columns
+
+
+def needs_autoincrement():
+    """Whether the SQLite transactions table can still hand out an id again (no AUTOINCREMENT)"""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    with db.engine.connect() as connection:
+        ddl = connection.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transactions'"
+        )).scalar()
+    return ddl is not None and 'AUTOINCREMENT' not in ddl.upper()
+
+
+def ledger_sizes():
+    """{table or index name: bytes} for the ledger tables and their indexes (needs SQLite's dbstat)"""
+    with db.engine.connect() as connection:
+        try:
+            rows = connection.execute(text(
+                "SELECT name, SUM(pgsize) FROM dbstat WHERE name IN ("
+                "  SELECT name FROM sqlite_master WHERE tbl_name IN ('transactions', 'transaction_notes')"
+                ") GROUP BY name"
+            )).all()
+        except Exception:
+            return {}  # dbstat is not compiled in
+    return dict(rows)
+
+
+def time_ledger_scans(days=30):
+    """Seconds for a full ledger read (as exports do) and for report totals over the last days"""
+    type_column = 'transaction_type' if needs_migration() else 'movement'
+    since = datetime.utcnow() - timedelta(days=days)
+    timings = {}
+    with db.engine.connect() as connection:
+        started = time.perf_counter()
+        result = connection.execution_options(yield_per=10000).execute(text('SELECT * FROM transactions'))
+        for _ in result.partitions():
+            pass
+        timings['full_scan'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        connection.execute(text(
+            f'SELECT {type_column}, COUNT(*), SUM(quantity) FROM transactions '
+            f'WHERE created_at >= :since GROUP BY {type_column}'
+        ), {'since': since}).all()
+        timings['report_totals'] = time.perf_counter() - started
+    return timings
+
+
+def _batch_end(connection, after, batch_size):
+    until = connection.execute(text(
+        'SELECT id FROM transactions WHERE id > :after ORDER BY id LIMIT 1 OFFSET :skip'
+    ), {'after': after, 'skip': batch_size - 1}).scalar()
+    if until is None:
+        until = connection.execute(text('SELECT MAX(id) FROM transactions')).scalar()
+    return until
+
+
+def _copy_batch(connection, after, batch_size, encode):
+    """Copy rows after the given id; returns (last id copied, rows copied), or None when done"""
+    until = _batch_end(connection, after, batch_size)
+    if until is None or until <= after:
+        return None
+    rows = connection.execute(text(_COPY if encode else _COPY_COMPACT), {'after': after, 'until': until}).rowcount
+    if encode:
+        connection.execute(text(_COPY_NOTES), {'after': after, 'until': until})
+    return until, rows
+
+
+def _highest_id_used(connection):
+    # Archived ids count too: the hot table may be empty after archival
+    highest = connection.execute(text('SELECT COALESCE(MAX(id), 0) FROM transactions')).scalar()
+    if 'archive_partitions' in _table_names():
+        archived = connection.execute(text('SELECT COALESCE(MAX(max_id), 0) FROM archive_partitions')).scalar()
+        highest = max(highest, archived)
+    return highest
+
+
+def migrate_ledger(batch_size=20000, log=None):
+    """Rewrite the ledger into the compact encoding with AUTOINCREMENT ids; returns the number of rows copied"""
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('The ledger migration supports SQLite only.')
+    encode = needs_migration()
+    if not encode and not needs_autoincrement():
+        return 0
+
+    TransactionNote.__table__.create(db.engine, checkfirst=True)
+    if COMPACT_TABLE not in _table_names():
+        ddl = str(CreateTable(Transaction.__table__).compile(db.engine))
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(ddl.replace('CREATE TABLE transactions ', f'CREATE TABLE {COMPACT_TABLE} ', 1))
+
+    with db.engine.connect() as connection:
+        after = connection.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM {COMPACT_TABLE}')).scalar()
+    if after and log:
+        log(f'Resuming after transaction {after}.')
+
+    copied = 0
+    while True:
+        with db.engine.begin() as connection:
+            batch = _copy_batch(connection, after, batch_size, encode)
+        if batch is None:
+            break
+        after, rows = batch
+        copied += rows
+        if log:
+            log(f'Copied through transaction {after} ({copied} rows).')
+
+    with db.engine.connect() as connection:
+        highest = _highest_id_used(connection)
+    statements = ['DROP TABLE transactions', f'ALTER TABLE {COMPACT_TABLE} RENAME TO transactions']
+    statements += [str(CreateIndex(index).compile(db.engine)) for index in Transaction.__table__.indexes]
+    # The renamed table keeps its sqlite_sequence row; start it above every id ever used
+    statements += ["DELETE FROM sqlite_sequence WHERE name = 'transactions'",
+                   f"INSERT INTO sqlite_sequence (name, seq) VALUES ('transactions', {int(highest)})"]
+    raw = db.engine.raw_connection()
+    try:
+        # The sqlite3 module commits DDL as it goes; an explicit script keeps the swap atomic
+        raw.driver_connection.executescript('BEGIN;\n' + ';\n'.join(statements) + ';\nCOMMIT;')
+    finally:
+        raw.close()
+    if log:
+        log('Swapped in the compact table and built its indexes.')
+    return copied
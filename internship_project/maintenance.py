@@ -0,0 +1,322 @@
+"""
+Database maintenance
+Planner statistics, space reclamation and hot backups, run from the CLI
+(`flask analyze-db`, `vacuum-db`, `backup-db`) or by the optional in-app
+scheduler (MAINTENANCE_SCHEDULE=1).
+
+SQLite gets ANALYZE plus PRAGMA optimize, PRAGMA incremental_vacuum and
+the online backup API. The backup copies a few pages per step and sleeps
+between steps so writers are never blocked for long. PostgreSQL gets
+ANALYZE, VACUUM and pg_dump; MySQL gets ANALYZE TABLE and OPTIMIZE TABLE.
+
+Every run is timed, reported to the metrics and recorded with its result
+and database sizes in <instance>/maintenance.json. The scheduler runs in
+each worker but takes a file lock and re-reads that file before running a
+task, so each task runs once per interval whichever worker gets there first.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+from metrics import inc as inc_metric, observe
+from models import db
+
+try:
+    import fcntl
+except ImportError:  # No flock on Windows: the scheduler is then not started
+    fcntl = None
+
+TASKS = ('analyze', 'vacuum', 'backup')
+
+_scheduler_pid = None
+
+
+def state_path():
+    return os.path.join(current_app.instance_path, 'maintenance.json')
+
+
+def backup_dir():
+    return current_app.config['BACKUP_DIR'] or os.path.join(current_app.instance_path, 'backups')
+
+
+def read_state():
+    """{task: last run report}"""
+    try:
+        with open(state_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _record(task, report):
+    state = read_state()
+    state[task] = report
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    path = state_path()
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _sqlite_file():
+    database = db.engine.url.database
+    return None if not database or database == ':memory:' else database
+
+
+def _table_names():
+    return db.inspect(db.engine).get_table_names()
+
+
+def _autocommit():
+    """Connection outside a transaction block (VACUUM cannot run inside one)"""
+    return db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+
+def database_size():
+    """Size of the database in bytes, or None if the backend cannot tell"""
+    dialect = _dialect()
+    with db.engine.connect() as connection:
+        if dialect == 'sqlite':
+            page_count = connection.exec_driver_sql('PRAGMA page_count').scalar()
+            page_size = connection.exec_driver_sql('PRAGMA page_size').scalar()
+            return page_count * page_size
+        if dialect == 'postgresql':
+            return connection.exec_driver_sql('SELECT pg_database_size(current_database())').scalar()
+        if dialect in ('mysql', 'mariadb'):
+            return connection.exec_driver_sql(
+                'SELECT SUM(data_length + index_length) FROM information_schema.tables '
+                'WHERE table_schema = DATABASE()'
+            ).scalar()
+    return None
+
+
+def _run(task, work):
+    """Time one task, record it and report it to the metrics; returns the report"""
+    started = time.perf_counter()
+    report = {'started_at': datetime.utcnow().isoformat(), 'size_before': database_size()}
+    try:
+        report.update(work() or {})
+    except Exception as e:
+        report.update(ok=False, error=str(e), seconds=round(time.perf_counter() - started, 3))
+        _record(task, report)
+        inc_metric('db_maintenance_runs_total', task=task, result='error')
+        raise
+    report.update(ok=True, seconds=round(time.perf_counter() - started, 3), size_after=database_size())
+    _record(task, report)
+    inc_metric('db_maintenance_runs_total', task=task, result='ok')
+    observe('db_maintenance_duration_seconds', report['seconds'], task=task)
+    if report['size_before'] and report['size_after'] is not None:
+        inc_metric('db_maintenance_reclaimed_bytes_total',
+                   max(report['size_before'] - report['size_after'], 0), task=task)
+    return report
+
+
+def analyze():
+    """Refresh the query planner's statistics"""
+    def work():
+        dialect = _dialect()
+        with _autocommit() as connection:
+            if dialect == 'sqlite':
+                # Sample at most this many rows per index instead of reading every table in full
+                limit = current_app.config['MAINTENANCE_ANALYSIS_LIMIT']
+                connection.exec_driver_sql(f'PRAGMA analysis_limit = {int(limit)}')
+                connection.exec_driver_sql('ANALYZE')
+                connection.exec_driver_sql('PRAGMA optimize')
+            elif dialect == 'postgresql':
+                connection.exec_driver_sql('ANALYZE')
+            elif dialect in ('mysql', 'mariadb'):
+                connection.exec_driver_sql(f'ANALYZE TABLE {", ".join(_table_names())}')
+            else:
+                raise RuntimeError(f'No ANALYZE support for {dialect}.')
+        return {'dialect': dialect}
+    return _run('analyze', work)
+
+
+def _sqlite_incremental_vacuum(connection, max_pages, step):
+    """Free up to max_pages pages, step pages per transaction; returns pages freed"""
+    freed = 0
+    while max_pages is None or freed < max_pages:
+        free = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+        pages = min(step, free, (max_pages - freed) if max_pages is not None else step)
+        if pages <= 0:
+            break
+        # Each step is its own short write transaction. The pragma frees one page per
+        # sqlite3_step and the DB-API steps it once, so run it as a script
+        connection.connection.driver_connection.executescript(f'PRAGMA incremental_vacuum({pages})')
+        freed += free - connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+        time.sleep(current_app.config['MAINTENANCE_STEP_SLEEP'])
+    return freed
+
+
+def vacuum(max_pages=None, full=False):
+    """Return free pages to the file system (full: rewrite the whole database, blocking writers).
+
+    SQLite can only vacuum incrementally when auto_vacuum is INCREMENTAL;
+    a full vacuum switches an existing database to that mode.
+    """
+    def work():
+        dialect = _dialect()
+        with _autocommit() as connection:
+            if dialect == 'sqlite':
+                mode = connection.exec_driver_sql('PRAGMA auto_vacuum').scalar()
+                free_before = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+                if full:
+                    connection.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+                    connection.exec_driver_sql('VACUUM')
+                elif mode != 2:
+                    raise RuntimeError('auto_vacuum is not INCREMENTAL on this database; '
+                                       'run a full vacuum once (vacuum-db --full) to enable it.')
+                else:
+                    _sqlite_incremental_vacuum(connection, max_pages,
+                                               current_app.config['MAINTENANCE_VACUUM_STEP_PAGES'])
+                free_after = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+                return {'dialect': dialect, 'full': full,
+                        'free_pages_before': free_before, 'free_pages_after': free_after}
+            if dialect == 'postgresql':
+                connection.exec_driver_sql('VACUUM FULL' if full else 'VACUUM')
+            elif dialect in ('mysql', 'mariadb'):
+                connection.exec_driver_sql(f'OPTIMIZE TABLE {", ".join(_table_names())}')
+            else:
+                raise RuntimeError(f'No VACUUM support for {dialect}.')
+            return {'dialect': dialect, 'full': full}
+    return _run('vacuum', work)
+
+
+def _prune_backups(directory, suffix, keep):
+    backups = sorted(name for name in os.listdir(directory)
+                     if name.startswith('inventory-') and name.endswith(suffix))
+    for name in backups[:-keep] if keep else ():
+        os.remove(os.path.join(directory, name))
+
+
+def _sqlite_backup(destination, pages, sleep):
+    """Online backup through the SQLite backup API, a few pages per step"""
+    restarts = [0]
+    last_remaining = [None]
+
+    def progress(status, remaining, total):
+        # Commits by other connections between steps restart the copy
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            restarts[0] += 1
+        last_remaining[0] = remaining
+
+    raw = db.engine.raw_connection()
+    try:
+        target = sqlite3.connect(destination)
+        try:
+            raw.driver_connection.backup(target, pages=pages, progress=progress, sleep=sleep)
+            if target.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                raise RuntimeError(f'Backup {destination} failed its integrity check.')
+        finally:
+            target.close()
+    finally:
+        raw.close()
+    return restarts[0]
+
+
+def backup(directory=None, pages=None, sleep=None):
+    """Hot backup into directory (default BACKUP_DIR); returns the run report"""
+    directory = directory or backup_dir()
+    pages = pages or current_app.config['BACKUP_STEP_PAGES']
+    sleep = current_app.config['MAINTENANCE_STEP_SLEEP'] if sleep is None else sleep
+
+    def work():
+        dialect = _dialect()
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        if dialect == 'sqlite':
+            if _sqlite_file() is None:
+                raise RuntimeError('In-memory databases cannot be backed up.')
+            suffix = '.db'
+            path = os.path.join(directory, f'inventory-{stamp}{suffix}')
+            restarts = _sqlite_backup(path + '.part', pages, sleep)
+            extra = {'restarts': restarts}
+        elif dialect == 'postgresql':
+            if not shutil.which('pg_dump'):
+                raise RuntimeError('pg_dump is not installed.')
+            suffix = '.dump'
+            path = os.path.join(directory, f'inventory-{stamp}{suffix}')
+            url = db.engine.url.set(drivername='postgresql')
+            subprocess.run(['pg_dump', '--format=custom', f'--file={path}.part',
+                            url.render_as_string(hide_password=False)], check=True)
+            extra = {}
+        else:
+            raise RuntimeError(f'No online backup support for {dialect}; use the server\'s own tools.')
+        os.replace(path + '.part', path)
+        _prune_backups(directory, suffix, current_app.config['BACKUP_KEEP'])
+        size = os.path.getsize(path)
+        observe('db_backup_size_bytes', size)
+        return dict(extra, dialect=dialect, path=path, backup_size=size)
+    return _run('backup', work)
+
+
+# Scheduler
+
+def due_tasks(state=None, now=None):
+    """Tasks whose interval has passed since their last successful run"""
+    state = read_state() if state is None else state
+    now = now or datetime.utcnow()
+    due = []
+    for task in TASKS:
+        hours = current_app.config[f'MAINTENANCE_{task.upper()}_HOURS']
+        if not hours:
+            continue
+        last = state.get(task)
+        last_at = last and last.get('ok') and datetime.fromisoformat(last['started_at'])
+        if not last_at or (now - last_at).total_seconds() >= hours * 3600:
+            due.append(task)
+    return due
+
+
+def run_due_tasks():
+    """Run due tasks unless another process holds the maintenance lock; returns the tasks run"""
+    with open(os.path.join(current_app.instance_path, 'maintenance.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return []
+        ran = []
+        for task in due_tasks():  # Read under the lock: another worker may have just run them
+            try:
+                {'analyze': analyze, 'vacuum': vacuum, 'backup': backup}[task]()
+                ran.append(task)
+            except Exception:
+                current_app.logger.exception('Scheduled %s failed', task)
+        return ran
+
+
+def _scheduler_loop(app):
+    while True:
+        time.sleep(app.config['MAINTENANCE_CHECK_INTERVAL'])
+        with app.app_context():
+            try:
+                run_due_tasks()
+            except Exception:
+                app.logger.exception('Maintenance scheduler failed')
+
+
+def init_maintenance(app):
+    """Start the maintenance scheduler thread in each serving process"""
+    if not app.config['MAINTENANCE_SCHEDULE'] or fcntl is None:
+        return
+
+    @app.before_request
+    def start_scheduler():
+        # Started on the first request so forked workers each get their own thread
+        global _scheduler_pid
+        if _scheduler_pid == os.getpid():
+            return
+        _scheduler_pid = os.getpid()
+        threading.Thread(target=_scheduler_loop, args=(app,), name='db-maintenance', daemon=True).start()
@@ -0,0 +1,441 @@
+"""
+Prometheus-style application metrics
+Each process keeps counters and histograms in memory and periodically
+writes them to its own file in METRICS_DIR. The /metrics endpoint merges
+the files of all processes (summing counters, histogram buckets and sums)
+so the result is correct however many workers serve the app.
+
+A file is named after its process's pid and start time, so a new worker
+that gets a dead worker's pid starts a file of its own. When /metrics is
+scraped, the files of processes that have exited are folded into one
+retired-workers file and removed, so counters never go backwards and the
+directory does not grow with every worker restart. A background thread
+writes each process's file once per flush interval even while idle.
+"""
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask import template_rendered, before_render_template, got_request_exception
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import fcntl
+except ImportError:  # No flock (nor a safe liveness check) on Windows: files are never folded
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+MAINTENANCE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+FILE_SIZE_BUCKETS = (1e6, 1e7, 1e8, 1e9, 1e10)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+# name -> (type, help text, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status', None),
+    'http_request_errors_total': ('counter', 'Requests that raised or returned a 5xx status', None),
+    'http_request_duration_seconds': ('histogram', 'Time until the response body was fully sent', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Response body size when known up front', SIZE_BUCKETS),
+    'db_queries_per_request': ('histogram', 'SQL statements executed while serving a request', QUERY_COUNT_BUCKETS),
+    'db_query_duration_seconds': ('histogram', 'Total SQL time spent serving a request', LATENCY_BUCKETS),
+    'db_query_errors_total': ('counter', 'SQL statements that failed, including deadline cancellations', None),
+    'template_render_duration_seconds': ('histogram', 'Jinja template render time', LATENCY_BUCKETS),
+    'template_fragment_cache_total': ('counter', 'Cached template fragment lookups by result', None),
+    'db_maintenance_runs_total': ('counter', 'Maintenance task runs (analyze, vacuum, backup) by result', None),
+    'db_maintenance_duration_seconds': ('histogram', 'Duration of successful maintenance tasks', MAINTENANCE_BUCKETS),
+    'db_maintenance_reclaimed_bytes_total': ('counter', 'Database size reduction from maintenance tasks', None),
+    'db_backup_size_bytes': ('histogram', 'Size of each database backup', FILE_SIZE_BUCKETS),
+    'inventory_stock_movements_total': ('counter', 'Stock movements recorded by type', None),
+    'catalog_lookups_total': ('counter', 'Product catalog lookups by key and result', None),
+    'catalog_refreshes_total': ('counter', 'Product catalog file rewrites by mode', None),
+    'inventory_bulk_product_updates_total': ('counter', 'Products changed by bulk actions', None),
+    'inventory_alerts_total': ('counter', 'Stock alerts dispatched by kind and result', None),
+    'alert_deliveries_total': ('counter', 'Alert batches handed to each sink by result', None),
+    'alert_delivery_duration_seconds': ('histogram', 'Time a sink took to accept a batch', LATENCY_BUCKETS),
+    'inventory_export_rows_total': ('counter', 'Rows written to report exports', None),
+    'inventory_export_files_total': ('counter', 'Export files written or reused, by format', None),
+    'lane_requests_total': ('counter', 'Requests admitted to or rejected from each workload lane', None),
+    'lane_queue_depth': ('histogram', 'Requests waiting in the lane (this worker) when one arrives', QUEUE_DEPTH_BUCKETS),
+    'lane_wait_seconds': ('histogram', 'Time spent queued for a lane slot', LATENCY_BUCKETS),
+    'query_cancellations_total': ('counter', 'Database work stopped by a request deadline or a client disconnect', None),
+}
+
+_lock = threading.Lock()
+_values = {}  # (name, labels) -> float for counters, [bucket counts..., sum, count] for histograms
+_last_flush = 0.0
+_changes = 0  # Bumped by every update; the flusher thread skips writes when nothing changed
+_started = time.time_ns()  # With the pid, names this process's file
+_flusher_pid = None
+_local = threading.local()
+
+RETIRED_FILE = 'retired_metrics.json'
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Increase a counter"""
+    global _changes
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+        _changes += 1
+
+
+def observe(name, value, **labels):
+    """Record one observation in a histogram"""
+    global _changes
+    buckets = METRICS[name][2]
+    key = _key(name, labels)
+    with _lock:
+        _changes += 1
+        slots = _values.get(key)
+        if slots is None:
+            slots = _values[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                slots[i] += 1
+        slots[-2] += value
+        slots[-1] += 1
+
+
+class RequestStats:
+    """Database work done while serving one request"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.query_count = 0
+        self.query_seconds = 0.0
+
+    def add_query(self, seconds):
+        with self.lock:
+            self.query_count += 1
+            self.query_seconds += seconds
+
+
+def current_request_stats():
+    """Stats object of the request being served, also visible to run_parallel tasks"""
+    if has_app_context():
+        return g.get('request_stats')
+    return None
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+# Files
+
+def metrics_dir():
+    return current_app.config['METRICS_DIR'] or os.path.join(current_app.instance_path, 'metrics')
+
+
+def _process_file(directory):
+    return os.path.join(directory, f'metrics_{os.getpid()}_{_started}.json')
+
+
+def flush(directory=None, force=False):
+    """Write this process's metrics to its file (at most once per flush interval)"""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < current_app.config['METRICS_FLUSH_INTERVAL']:
+        return
+    _last_flush = now
+    directory = directory or metrics_dir()
+    with _lock:
+        data = [[name, list(labels), value] for (name, labels), value in _values.items()]
+    os.makedirs(directory, exist_ok=True)
+    _write_json(_process_file(directory), data)
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default  # Missing, or being replaced right now; picked up on the next scrape
+
+
+def _merge(merged, data):
+    for name, labels, value in data:
+        if name not in METRICS:
+            continue
+        key = (name, tuple(tuple(pair) for pair in labels))
+        if isinstance(value, list):
+            current = merged.setdefault(key, [0] * len(value))
+            merged[key] = [a + b for a, b in zip(current, value)]
+        else:
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _file_pid(path):
+    # metrics_<pid>_<start>.json, or metrics_<pid>.json as written before files carried a start time
+    try:
+        return int(os.path.basename(path)[len('metrics_'):-len('.json')].split('_')[0])
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Someone else's process reusing the pid: keep the file until that one exits too
+    return True
+
+
+def _retire_dead_files(directory, paths):
+    """Fold the files of exited processes into the retired file; return the live files.
+
+    The retired file first records which files it now holds and only then are
+    they removed, so a file left behind by an interrupted scrape is removed
+    on the next one instead of being counted twice.
+    """
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    retired = _read_json(retired_path, {'files': [], 'values': []})
+    folded = set(retired['files'])
+    values = _merge({}, retired['values'])
+    live, dead = [], []
+    for path in paths:
+        name = os.path.basename(path)
+        pid = _file_pid(path)
+        if name in folded:
+            dead.append(path)
+            continue
+        data = None
+        if pid is not None and pid != os.getpid() and not _pid_alive(pid):
+            data = _read_json(path)
+        if data is None:
+            live.append(path)
+        else:
+            _merge(values, data)
+            folded.add(name)
+            dead.append(path)
+
+    retired['values'] = [[name, list(labels), value] for (name, labels), value in values.items()]
+    if dead:
+        retired['files'] = sorted(folded)
+        _write_json(retired_path, retired)
+        for path in dead:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    if retired['files']:
+        retired['files'] = []
+        _write_json(retired_path, retired)
+    return live, retired['values']
+
+
+def collect(directory=None):
+    """Merge every process's file into one {(name, labels): value} mapping"""
+    directory = directory or metrics_dir()
+    paths = glob.glob(os.path.join(directory, 'metrics_*.json'))
+    if fcntl is None:
+        return _merge_files(paths, [])
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'metrics.lock'), 'a') as lock_file:
+        # One scrape at a time, so a file is never seen both on its own and folded
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        live, retired = _retire_dead_files(directory, paths)
+        return _merge_files(live, retired)
+
+
+def _merge_files(paths, retired):
+    merged = _merge({}, retired)
+    for path in paths:
+        _merge(merged, _read_json(path, []))
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (f'{k}="{_escape(v)}"' for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_metrics(directory=None):
+    """Text exposition format of the merged metrics"""
+    merged = collect(directory)
+    lines = []
+    for name, (metric_type, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in merged.items() if metric == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in series:
+            if metric_type == 'histogram':
+                for bound, count in zip(buckets, value):
+                    lines.append(f'{name}_bucket{_format_labels(labels, ("le", bound))} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {value[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {value[-2]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value[-1]}')
+            else:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Instrumentation
+
+def start_flusher(app):
+    """Write this process's file every flush interval, so an idle worker's last requests show up"""
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    interval = app.config['METRICS_FLUSH_INTERVAL']
+
+    def run():
+        written = None
+        while True:
+            time.sleep(interval)
+            if _changes != written:
+                written = _changes
+                with app.app_context():
+                    flush(force=True)
+
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+
+def _before_request():
+    if _flusher_pid != os.getpid():
+        start_flusher(current_app._get_current_object())
+    g.request_started = time.perf_counter()
+    g.request_stats = RequestStats()
+
+
+def _after_request(response):
+    if 'request_started' not in g:
+        return response
+    endpoint = _endpoint()
+    method = request.method
+    started = g.request_started
+    stats = g.request_stats
+    app = current_app._get_current_object()
+
+    inc('http_requests_total', endpoint=endpoint, method=method, status=str(response.status_code))
+    if response.status_code >= 500 and not g.get('request_failed'):
+        inc('http_request_errors_total', endpoint=endpoint)
+    if response.content_length is not None:
+        observe('http_response_size_bytes', response.content_length, endpoint=endpoint)
+    observe('db_queries_per_request', stats.query_count, endpoint=endpoint)
+    observe('db_query_duration_seconds', stats.query_seconds, endpoint=endpoint)
+
+    # Measured when the body is done, so streamed responses count in full
+    def finished():
+        observe('http_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+        with app.app_context():
+            flush()
+
+    response.call_on_close(finished)
+    return response
+
+
+def _on_exception(sender, exception, **extra):
+    if has_request_context():
+        g.request_failed = True
+        inc('http_request_errors_total', endpoint=_endpoint())
+
+
+def _before_render(sender, template, context, **extra):
+    stack = getattr(_local, 'render_started', None)
+    if stack is None:
+        stack = _local.render_started = []
+    stack.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    stack = getattr(_local, 'render_started', None)
+    if stack:
+        elapsed = time.perf_counter() - stack.pop()
+        observe('template_render_duration_seconds', elapsed, template=template.name or 'string')
+        if has_request_context():
+            g.render_seconds = g.get('render_seconds', 0.0) + elapsed
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = current_request_stats()
+    if stats is not None:
+        stats.add_query(time.perf_counter() - started)
+
+
+def _handle_error(context):
+    # after_cursor_execute never runs for a failed statement
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if not started:
+        return  # Failed before the statement was sent, e.g. while connecting
+    elapsed = time.perf_counter() - started.pop()
+    inc('db_query_errors_total')
+    stats = current_request_stats()
+    if stats is not None:
+        stats.add_query(elapsed)
+
+
+def _reset_after_fork():
+    """A forked worker starts from zero with a file and flusher thread of its own"""
+    global _lock, _last_flush, _changes, _started, _flusher_pid
+    _lock = threading.Lock()
+    _values.clear()
+    _last_flush = 0.0
+    _changes = 0
+    _started = time.time_ns()
+    _flusher_pid = None
+
+
+_registered = False
+
+
+def init_metrics(app):
+    """Install request, database and template instrumentation"""
+    global _registered
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    got_request_exception.connect(_on_exception, app)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    if not _registered:
+        _registered = True
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        # First in line: the deadline listener replaces cancellations with QueryTimeout,
+        # and listeners after a raising one are skipped
+        event.listen(Engine, 'handle_error', _handle_error, insert=True)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_reset_after_fork)
+
+    def flush_at_exit():
+        with app.app_context():
+            flush(force=True)
+    atexit.register(flush_at_exit)
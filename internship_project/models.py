@@ -1,6 +1,15 @@
+import json
+
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, exists, insert, literal, select
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from events import notify_stock_movement
+from metrics import inc as inc_metric
 
 db = SQLAlchemy()
 
@@ -51,6 +60,13 @@ class Supplier(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Active-only index: the list page and every supplier dropdown read
+    # active suppliers in name order
+    __table_args__ = (
+        db.Index('ix_suppliers_active_name', 'name',
+                 sqlite_where=is_active == True, postgresql_where=is_active == True),
+    )
+    
     # Relationships
     products = db.relationship('Product', backref='supplier', lazy=True)
 
@@ -61,6 +77,18 @@ class Supplier(db.Model):
     def get_active_products(self):
         """Get active products from this supplier"""
         return [p for p in self.products if p.is_active]
+    
+    def to_dict(self):
+        """Serialize supplier for APIs and the change feed"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'contact': self.contact,
+            'email': self.email,
+            'address': self.address,
+            'is_active': self.is_active,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
 
     def __repr__(self):
         return f'<Supplier {self.name}>'
@@ -81,8 +109,21 @@ class Product(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Listings filter active products and sort by name, so the partial
+    # indexes hold active rows only, in name order within each filter
+    __table_args__ = (
+        db.Index('ix_products_active_name', 'name',
+                 sqlite_where=is_active == True, postgresql_where=is_active == True),
+        db.Index('ix_products_active_category_name', 'category', 'name',
+                 sqlite_where=is_active == True, postgresql_where=is_active == True),
+        db.Index('ix_products_active_supplier_name', 'supplier_id', 'name',
+                 sqlite_where=is_active == True, postgresql_where=is_active == True),
+        db.Index('ix_products_supplier_active', 'supplier_id', 'is_active'),  # Supplier product counts
+    )
+    
     # Relationships
     transactions = db.relationship('Transaction', backref='product', lazy=True, cascade='all, delete-orphan')
+    stock_levels = db.relationship('StockLevel', backref='product', lazy=True, cascade='all, delete-orphan')
 
     def is_low_stock(self):
         """Check if product is low on stock"""
@@ -92,11 +133,13 @@ class Product(db.Model):
         """Check if product is out of stock"""
         return self.quantity <= 0
     
-    def get_stock_status(self):
-        """Get stock status as string"""
-        if self.is_out_of_stock():
+    def get_stock_status(self, quantity=None):
+        """Get stock status as string, for the current quantity or the one given"""
+        if quantity is None:
+            quantity = self.quantity
+        if quantity <= 0:
             return 'out_of_stock'
-        elif self.is_low_stock():
+        elif quantity <= self.min_stock_level:
             return 'low_stock'
         else:
             return 'in_stock'
@@ -105,61 +148,460 @@ class Product(db.Model):
         """Get total value of current stock"""
         return self.quantity * self.price
     
-    def update_stock(self, quantity_change, transaction_type, user_id, notes=None):
-        """Update stock and create transaction record"""
-        old_quantity = self.quantity
-        
+    def quantity_at(self, location_id):
+        """Stock held at one location"""
+        level = StockLevel.query.get((self.id, location_id))
+        return level.quantity if level else 0
+    
+    def get_stock_by_location(self):
+        """(location, quantity) pairs for every location holding a stock row"""
+        rows = db.session.query(Location, StockLevel.quantity)\
+            .join(StockLevel, StockLevel.location_id == Location.id)\
+            .filter(StockLevel.product_id == self.id)\
+            .order_by(Location.code).all()
+        return [(location, quantity) for location, quantity in rows]
+    
+    def to_dict(self):
+        """Serialize product for APIs and the change feed"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'sku': self.sku,
+            'category': self.category,
+            'price': self.price,
+            'quantity': self.quantity,
+            'min_stock_level': self.min_stock_level,
+            'supplier_id': self.supplier_id,
+            'is_active': self.is_active,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def add_stock_alert(self, old_status, old_quantity, transaction=None):
+        """Queue a StockAlert if the stock status is no longer old_status; returns the new status.
+
+        Added to the session, not committed: the alert is written in the same
+        transaction as the change that caused it.
+        """
+        new_status = self.get_stock_status()
+        if new_status != old_status:
+            db.session.add(StockAlert(
+                product_id=self.id, transaction=transaction, kind=new_status,
+                old_quantity=old_quantity, new_quantity=self.quantity,
+                min_stock_level=self.min_stock_level
+            ))
+        return new_status
+    
+    def update_stock(self, quantity_change, transaction_type, user_id, notes=None, location_id=None):
+        """Record a movement at one location (default: DEFAULT_LOCATION_CODE) and update stock.
+
+        Neither quantity is read and written back in Python. The location's
+        stock row is changed with a guarded UPDATE, so a removal fails instead
+        of going negative, and movements at different locations touch
+        different rows. The product total is a maintained aggregate bumped
+        with UPDATE ... RETURNING as the last write before commit, which keeps
+        its row lock short and gives the ledger exact old/new quantities.
+        """
         if transaction_type == 'add':
-            self.quantity += quantity_change
+            delta = quantity_change
         elif transaction_type == 'remove':
-            if self.quantity >= quantity_change:
-                self.quantity -= quantity_change
-            else:
-                raise ValueError("Insufficient stock")
+            delta = -quantity_change
+        else:
+            raise ValueError("Invalid transaction type")
+        
+        db.session.flush()
+        location_id = location_id or get_default_location().id
+        now = datetime.utcnow()
+        
+        levels = StockLevel.__table__
+        moved = db.session.execute(
+            levels.update()
+            .where(levels.c.product_id == self.id, levels.c.location_id == location_id,
+                   levels.c.quantity + delta >= 0)
+            .values(quantity=levels.c.quantity + delta, updated_at=now)
+        ).rowcount
+        if not moved:
+            if delta < 0:
+                raise ValueError("Insufficient stock at this location")
+            db.session.execute(levels.insert().values(
+                product_id=self.id, location_id=location_id, quantity=delta, updated_at=now
+            ))
+        
+        products = Product.__table__
+        new_quantity = db.session.execute(
+            products.update()
+            .where(products.c.id == self.id)
+            .values(quantity=products.c.quantity + delta, updated_at=now)
+            .returning(products.c.quantity)
+        ).scalar_one()
+        set_committed_value(self, 'quantity', new_quantity)
+        set_committed_value(self, 'updated_at', now)
+        # The status before this movement, not the one this session last saw:
+        # another worker may have moved the same product in between
+        old_status = self.get_stock_status(new_quantity - delta)
         
         # Create transaction record
         transaction = Transaction(
             product_id=self.id,
             user_id=user_id,
+            location_id=location_id,
             transaction_type=transaction_type,
             quantity=quantity_change,
-            old_quantity=old_quantity,
-            new_quantity=self.quantity,
+            new_quantity=new_quantity,
             notes=notes
         )
         
         db.session.add(transaction)
+        new_status = self.add_stock_alert(old_status, new_quantity - delta, transaction)
+        # The Core UPDATE bypasses the flush listener, so log the change here
+        db.session.add(ChangeLog(
+            entity='product', entity_id=self.id, operation='update',
+            payload=json.dumps(self.to_dict()), created_at=now
+        ))
         db.session.commit()
         
+        inc_metric('inventory_stock_movements_total', type=transaction_type)
+        
+        # Notify live dashboards (and wake the alert dispatcher) once the movement is committed
+        notify_stock_movement(old_status != new_status)
+        
         return transaction
 
     def __repr__(self):
         return f'<Product {self.name}>'
 
+# Ledger movement types, stored as small integers
+MOVEMENT_TYPES = {'add': 1, 'remove': 2}
+MOVEMENT_NAMES = {code: name for name, code in MOVEMENT_TYPES.items()}
+
+PRICE_SCALE = 100  # Ledger prices are stored in cents
+
 class Transaction(db.Model):
+    """One stock movement in the ledger.
+
+    Rows are kept compact: the movement type is a small integer, the unit
+    price is in cents, the quantity before the movement is derived from the
+    one after it and notes live in transaction_notes. transaction_type,
+    unit_price, old_quantity and notes read (and, except old_quantity, set)
+    the familiar values. In SQL the first three decode per row, so filters
+    and groupings use movement and unit_price_cents directly.
+    """
     __tablename__ = 'transactions'
+    # Ledger views filter by one column and list newest first. The created_at and
+    # movement indexes carry what reports, exports and forecasts aggregate, so
+    # those scans never visit the table
+    __table_args__ = (
+        db.Index('ix_transactions_product_created', 'product_id', 'created_at'),
+        db.Index('ix_transactions_user_created', 'user_id', 'created_at'),
+        db.Index('ix_transactions_created_cover', 'created_at', 'id', 'movement', 'product_id', 'quantity'),
+        db.Index('ix_transactions_movement_created', 'movement', 'created_at', 'product_id', 'quantity'),
+        # Ids are cursors for the change feed, live events and archive segments:
+        # never hand out an id again once archival has emptied the table
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    transaction_type = db.Column(db.String(10), nullable=False, index=True)  # 'add' or 'remove'
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'))  # None before locations existed
+    movement = db.Column(db.SmallInteger, nullable=False)  # MOVEMENT_TYPES
     quantity = db.Column(db.Integer, nullable=False)
-    old_quantity = db.Column(db.Integer, nullable=False)  # Quantity before transaction
     new_quantity = db.Column(db.Integer, nullable=False)  # Quantity after transaction
-    unit_price = db.Column(db.Float)  # Price at time of transaction
-    notes = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    unit_price_cents = db.Column(db.Integer)  # Price at time of transaction
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    location = db.relationship('Location')
+    note = db.relationship('TransactionNote', uselist=False, cascade='all, delete-orphan')
+
+    @hybrid_property
+    def transaction_type(self):
+        return MOVEMENT_NAMES.get(self.movement)
+
+    @transaction_type.inplace.setter
+    def _transaction_type_setter(self, value):
+        self.movement = MOVEMENT_TYPES[value]
+
+    @transaction_type.inplace.expression
+    @classmethod
+    def _transaction_type_expression(cls):
+        return case(MOVEMENT_NAMES, value=cls.movement)
+
+    @hybrid_property
+    def signed_quantity(self):
+        return self.quantity if self.movement == MOVEMENT_TYPES['add'] else -self.quantity
+
+    @signed_quantity.inplace.expression
+    @classmethod
+    def _signed_quantity_expression(cls):
+        return case((cls.movement == MOVEMENT_TYPES['add'], cls.quantity), else_=-cls.quantity)
+
+    @hybrid_property
+    def old_quantity(self):
+        """Quantity before transaction"""
+        return self.new_quantity - self.signed_quantity
+
+    @hybrid_property
+    def unit_price(self):
+        return None if self.unit_price_cents is None else self.unit_price_cents / PRICE_SCALE
+
+    @unit_price.inplace.setter
+    def _unit_price_setter(self, value):
+        self.unit_price_cents = None if value is None else round(value * PRICE_SCALE)
+
+    @unit_price.inplace.expression
+    @classmethod
+    def _unit_price_expression(cls):
+        return cls.unit_price_cents / float(PRICE_SCALE)
+
+    @property
+    def notes(self):
+        return self.note.text if self.note is not None else None
+
+    @notes.setter
+    def notes(self, value):
+        if not value:
+            self.note = None
+        elif self.note is None:
+            self.note = TransactionNote(text=value)
+        else:
+            self.note.text = value
 
     def get_total_value(self):
         """Get total value of transaction"""
         if self.unit_price:
             return self.quantity * self.unit_price
         return 0
+    
+    def to_dict(self):
+        """Serialize transaction for APIs and the change feed"""
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'user_id': self.user_id,
+            'location_id': self.location_id,
+            'transaction_type': self.transaction_type,
+            'quantity': self.quantity,
+            'old_quantity': self.old_quantity,
+            'new_quantity': self.new_quantity,
+            'unit_price': self.unit_price,
+            'notes': self.notes,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
 
     def __repr__(self):
         return f'<Transaction {self.transaction_type} {self.quantity} of {self.product.name}>'
 
+class TransactionNote(db.Model):
+    """Free-text note of a ledger movement; most movements have none"""
+    __tablename__ = 'transaction_notes'
+    
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'), primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+
+class Location(db.Model):
+    """Warehouse, store or dock that holds stock"""
+    __tablename__ = 'locations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(20), unique=True, nullable=False)  # Short label, e.g. 'MAIN', 'DOCK-2'
+    name = db.Column(db.String(100), nullable=False)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Location {self.code}>'
+
+class StockLevel(db.Model):
+    """Quantity of one product held at one location.
+
+    Product.quantity is the maintained sum of these rows, kept in step by
+    Product.update_stock so totals never need a SUM.
+    """
+    __tablename__ = 'stock_levels'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey('locations.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    location = db.relationship('Location')
+
+    def __repr__(self):
+        return f'<StockLevel {self.product_id}@{self.location_id}: {self.quantity}>'
+
+class ChangeLog(db.Model):
+    """Outbox of product and supplier changes, read by the change feed"""
+    __tablename__ = 'change_log'
+    
+    id = db.Column(db.Integer, primary_key=True)  # Monotonic cursor for consumers
+    entity = db.Column(db.String(20), nullable=False)  # 'product' or 'supplier'
+    entity_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)  # 'insert' or 'update'
+    payload = db.Column(db.Text, nullable=False)  # JSON state after the change
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ChangeLog {self.id} {self.entity} {self.entity_id}>'
+
+class StockAlert(db.Model):
+    """Outbox of stock threshold crossings, written by update_stock and delivered by alerts.py"""
+    __tablename__ = 'stock_alerts'
+    __table_args__ = (
+        db.Index('ix_stock_alerts_status', 'status', 'id'),  # Dispatcher claims pending rows in order
+        db.Index('ix_stock_alerts_product_status', 'product_id', 'status', 'id'),  # Last sent alert per product
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'))  # None for threshold edits
+    kind = db.Column(db.String(20), nullable=False)  # New stock status: 'low_stock', 'out_of_stock' or 'in_stock'
+    old_quantity = db.Column(db.Integer, nullable=False)
+    new_quantity = db.Column(db.Integer, nullable=False)
+    min_stock_level = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, claimed, sent, suppressed, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    sinks_done = db.Column(db.String(100), nullable=False, default='')  # Sinks already delivered to, comma separated
+    claimed_at = db.Column(db.DateTime)
+    dispatched_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    product = db.relationship('Product')
+    transaction = db.relationship('Transaction')
+
+    def __repr__(self):
+        return f'<StockAlert {self.id} {self.kind} product {self.product_id}>'
+
+class AlertNotice(db.Model):
+    """In-app inbox entry; an unread notice is updated in place by newer alerts for its product"""
+    __tablename__ = 'alert_inbox'
+    __table_args__ = (
+        db.Index('ix_alert_inbox_unread', 'read_at', 'id'),
+        db.Index('ix_alert_inbox_product_unread', 'product_id', 'read_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    alert_id = db.Column(db.Integer, db.ForeignKey('stock_alerts.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    message = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    read_at = db.Column(db.DateTime)
+    
+    product = db.relationship('Product')
+
+    def __repr__(self):
+        return f'<AlertNotice {self.id} {self.kind}>'
+
+class ArchivePartition(db.Model):
+    """Manifest entry for a compressed segment of archived transactions"""
+    __tablename__ = 'archive_partitions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False, index=True)  # 'YYYY-MM'
+    path = db.Column(db.String(255), unique=True, nullable=False)  # Relative to ARCHIVE_DIR
+    row_count = db.Column(db.Integer, nullable=False)
+    min_id = db.Column(db.Integer, nullable=False)
+    max_id = db.Column(db.Integer, nullable=False)
+    first_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_at = db.Column(db.DateTime, nullable=False, index=True)
+    checksum = db.Column(db.String(64), nullable=False)  # sha256 of the segment file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivePartition {self.path}>'
+
+class StockSnapshot(db.Model):
+    """Per-product stock level captured at a point in time"""
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.UniqueConstraint('taken_at', 'product_id', name='uq_stock_snapshots_taken_product'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    taken_at = db.Column(db.DateTime, nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    unit_price = db.Column(db.Float, nullable=False)
+
+    def get_total_value(self):
+        """Get total value of the snapshotted stock"""
+        return self.quantity * self.unit_price
+
+    def __repr__(self):
+        return f'<StockSnapshot {self.product_id} @ {self.taken_at}>'
+
+class ValuationState(db.Model):
+    """Running cost layers of one product as of the valuation checkpoint"""
+    __tablename__ = 'valuation_state'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    average_cost = db.Column(db.Float, nullable=False, default=0.0)  # Moving weighted average
+    fifo_layers = db.Column(db.Text, nullable=False, default='[]')  # JSON [[quantity, unit_cost], ...] oldest first
+    
+    product = db.relationship('Product')
+
+    def __repr__(self):
+        return f'<ValuationState {self.product_id}>'
+
+class ValuationPeriod(db.Model):
+    """Cost of goods in and out of one product during one month"""
+    __tablename__ = 'valuation_periods'
+    __table_args__ = (
+        db.UniqueConstraint('period', 'product_id', name='uq_valuation_periods_period_product'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False, index=True)  # 'YYYY-MM'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity_in = db.Column(db.Integer, nullable=False, default=0)
+    cost_in = db.Column(db.Float, nullable=False, default=0.0)
+    quantity_out = db.Column(db.Integer, nullable=False, default=0)
+    fifo_cogs = db.Column(db.Float, nullable=False, default=0.0)
+    average_cogs = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<ValuationPeriod {self.period} {self.product_id}>'
+
+class ValuationCheckpoint(db.Model):
+    """Position in the ledger up to which valuation state is current"""
+    __tablename__ = 'valuation_checkpoint'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    last_created_at = db.Column(db.DateTime)
+    last_transaction_id = db.Column(db.Integer)
+    version = db.Column(db.Integer, nullable=False, default=0)  # Guards against concurrent runs
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ValuationCheckpoint {self.last_transaction_id}>'
+
 # Helper functions for database operations
+def get_default_location():
+    """Location used when a movement names none (DEFAULT_LOCATION_CODE), added on first use"""
+    code = current_app.config['DEFAULT_LOCATION_CODE']
+    location = Location.query.filter_by(code=code).first()
+    if not location:
+        location = Location(code=code, name=current_app.config['DEFAULT_LOCATION_NAME'])
+        db.session.add(location)
+        db.session.flush()
+    return location
+
+def backfill_stock_levels():
+    """Place the stock of products that have no location rows at the default location.
+
+    Returns the number of products backfilled.
+    """
+    location = get_default_location()
+    missing = select(
+        Product.id, literal(location.id), Product.quantity, literal(datetime.utcnow())
+    ).where(Product.quantity != 0, ~exists().where(StockLevel.product_id == Product.id))
+    result = db.session.execute(insert(StockLevel).from_select(
+        ['product_id', 'location_id', 'quantity', 'updated_at'], missing
+    ))
+    db.session.commit()
+    return result.rowcount
+
 def create_default_admin():
     """Create default admin user if none exists"""
     admin = User.query.filter_by(role='admin').first()
@@ -177,14 +619,14 @@ def create_default_admin():
 
 def get_low_stock_products():
     """Get all products with low stock"""
-    return Product.query.filter(
+    return Product.query.options(joinedload(Product.supplier)).filter(
         Product.quantity <= Product.min_stock_level,
         Product.is_active == True
     ).all()
 
 def get_out_of_stock_products():
     """Get all products that are out of stock"""
-    return Product.query.filter(
+    return Product.query.options(joinedload(Product.supplier)).filter(
         Product.quantity <= 0,
         Product.is_active == True
     ).all()
@@ -193,12 +635,19 @@ def get_inventory_stats():
     """Get overall inventory statistics"""
     total_products = Product.query.filter_by(is_active=True).count()
     total_suppliers = Supplier.query.filter_by(is_active=True).count()
-    low_stock_count = len(get_low_stock_products())
-    out_of_stock_count = len(get_out_of_stock_products())
+    low_stock_count = Product.query.filter(
+        Product.quantity <= Product.min_stock_level,
+        Product.is_active == True
+    ).count()
+    out_of_stock_count = Product.query.filter(
+        Product.quantity <= 0,
+        Product.is_active == True
+    ).count()
     
-    # Calculate total inventory value
-    products = Product.query.filter_by(is_active=True).all()
-    total_value = sum(p.get_total_value() for p in products)
+    # Calculate total inventory value in the database rather than loading every product
+    total_value = db.session.query(
+        db.func.sum(Product.quantity * Product.price)
+    ).filter(Product.is_active == True).scalar() or 0
     
     return {
         'total_products': total_products,
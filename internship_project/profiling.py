@@ -0,0 +1,178 @@
+"""
+On-demand request profiling
+An admin adds ?_profile=1 (or the X-Profile: 1 header) to any URL and that
+single request runs under cProfile and tracemalloc. A fraction of all
+requests can also be sampled with PROFILE_SAMPLE_RATE.
+
+Each capture is stored in PROFILE_DIR as a pstats file (open it with
+snakeviz, flameprof or gprof2dot for a flame graph) plus a JSON summary
+of the slowest functions and the top allocation sites, listed on the
+admin profiles page. Only one request is profiled at a time per process,
+since tracemalloc is process-wide. A profiled request runs its
+run_parallel() queries inline, where cProfile can see them.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from flask import current_app, g, request, session
+
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 25
+
+_busy = threading.Lock()
+
+
+def profile_dir():
+    return current_app.config['PROFILE_DIR'] or os.path.join(current_app.instance_path, 'profiles')
+
+
+def _requested():
+    return request.args.get('_profile') == '1' or request.headers.get('X-Profile') == '1'
+
+
+class RequestProfile:
+    """CPU profile and allocation snapshot of one request"""
+
+    def __init__(self, trigger):
+        self.trigger = trigger  # 'admin' or 'sample'
+        self.started_at = datetime.utcnow()
+        self.profile_id = f"{self.started_at:%Y%m%d-%H%M%S}-{os.getpid()}-{random.randrange(16 ** 4):04x}"
+        self.profiler = cProfile.Profile()
+        self.status_code = None
+
+    def start(self):
+        tracemalloc.start(current_app.config['PROFILE_TRACEMALLOC_FRAMES'])
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.duration = time.perf_counter() - self.started
+        snapshot = tracemalloc.take_snapshot()
+        self.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return snapshot
+
+    def save(self, snapshot, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.profiler.dump_stats(os.path.join(directory, f'{self.profile_id}.prof'))
+
+        stats = pstats.Stats(self.profiler)
+        functions = []
+        for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+            functions.append({
+                'function': f'{os.path.basename(filename)}:{line}({name})',
+                'calls': calls,
+                'own': own,
+                'cumulative': cumulative
+            })
+        functions.sort(key=lambda f: f['cumulative'], reverse=True)
+
+        allocations = []
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            allocations.append({'site': f'{frame.filename}:{frame.lineno}', 'size': stat.size, 'count': stat.count})
+
+        summary = {
+            'id': self.profile_id,
+            'started_at': self.started_at.isoformat(),
+            'trigger': self.trigger,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'user_id': g.get('profile_user_id'),
+            'status': self.status_code,
+            'duration': self.duration,
+            'peak_memory': self.peak_memory,
+            'functions': functions[:TOP_FUNCTIONS],
+            'allocations': allocations
+        }
+        with open(os.path.join(directory, f'{self.profile_id}.json'), 'w') as f:
+            json.dump(summary, f)
+        _prune(directory, current_app.config['PROFILE_KEEP'])
+        return summary
+
+
+def _prune(directory, keep):
+    """Delete the oldest captures beyond the retention limit"""
+    summaries = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    for name in summaries[:-keep] if keep else []:
+        for extension in ('.json', '.prof'):
+            path = os.path.join(directory, name[:-5] + extension)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def list_profiles():
+    """Summaries of stored captures, newest first"""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    summaries = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as f:
+                summaries.append(json.load(f))
+    return summaries
+
+
+def load_profile(profile_id):
+    """Summary of one capture, or None"""
+    path = os.path.join(profile_dir(), f'{os.path.basename(profile_id)}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def init_profiling(app, is_admin):
+    """Install the profiling hooks; is_admin() tells whether the current user may profile"""
+
+    @app.before_request
+    def start_profile():
+        if _requested() and is_admin():
+            trigger = 'admin'
+        elif app.config['PROFILE_SAMPLE_RATE'] and random.random() < app.config['PROFILE_SAMPLE_RATE']:
+            trigger = 'sample'
+        else:
+            return
+        if not _busy.acquire(blocking=False):
+            return
+        g.profile_user_id = session.get('user_id')
+        g.request_profile = RequestProfile(trigger)
+        g.request_profile.start()
+
+    @app.after_request
+    def tag_profile(response):
+        profile = g.get('request_profile')
+        if profile is not None:
+            profile.status_code = response.status_code
+            response.headers['X-Profile-Id'] = profile.profile_id
+        return response
+
+    # Teardown runs after a streamed body is complete, so exports are profiled in full
+    @app.teardown_request
+    def finish_profile(exception=None):
+        profile = g.pop('request_profile', None)
+        if profile is None:
+            return
+        try:
+            snapshot = profile.stop()
+            profile.save(snapshot, profile_dir())
+        except Exception:
+            app.logger.exception('Failed to save request profile %s', profile.profile_id)
+        finally:
+            _busy.release()
@@ -0,0 +1,145 @@
+"""
+Query plan checks
+The hot list and ledger queries are listed here in the shape the views
+issue them. `flask check-query-plans` runs EXPLAIN QUERY PLAN on each one
+and fails when a query reads a table without an index, walks a whole
+index where it should search one, or sorts through a temporary B-tree,
+i.e. when a schema or query change silently lost its index.
+`flask create-indexes` adds indexes declared on the models to an existing
+database (create_all only builds them with new tables).
+
+SQLite only: other backends have their own EXPLAIN formats.
+"""
+
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, or_, and_
+
+from models import (db, User, Product, Supplier, Transaction, StockLevel, ChangeLog, StockAlert, AlertNotice,
+                    MOVEMENT_TYPES)
+
+SCAN = re.compile(r'^SCAN (\w+)( USING (?:COVERING )?INDEX \w+)?$')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+
+# Unfiltered listings legitimately walk an index in order; every other
+# query must SEARCH an index
+ORDERED_SCANS = {'products.list', 'products.categories', 'suppliers.list',
+                 'transactions.recent', 'ledger.pending'}
+
+_SINCE = datetime(2024, 1, 1)
+
+# name -> statement, with representative parameter values
+HOT_QUERIES = {
+    'login': lambda: select(User).where(User.username == 'admin'),
+    'products.list': lambda: select(Product).where(Product.is_active == True)
+        .order_by(Product.name).limit(10),
+    'products.by_category': lambda: select(Product).where(Product.is_active == True, Product.category == 'Electronics')
+        .order_by(Product.name).limit(10),
+    'products.by_supplier': lambda: select(Product).where(Product.is_active == True, Product.supplier_id == 1)
+        .order_by(Product.name).limit(10),
+    'products.categories': lambda: select(Product.category).where(Product.is_active == True).distinct(),
+    'products.by_sku': lambda: select(Product).where(Product.sku == 'SKU-1', Product.is_active == True),
+    'products.stock_at_location': lambda: select(StockLevel)
+        .where(StockLevel.product_id == 1, StockLevel.location_id == 1),
+    'products.stock_by_location': lambda: select(StockLevel).where(StockLevel.product_id == 1),
+    'suppliers.list': lambda: select(Supplier).where(Supplier.is_active == True)
+        .order_by(Supplier.name).limit(10),
+    'suppliers.active_products': lambda: select(func.count()).select_from(Product)
+        .where(Product.supplier_id == 1, Product.is_active == True),
+    'suppliers.products': lambda: select(Product).where(Product.supplier_id == 1),
+    'transactions.recent': lambda: select(Transaction)
+        .order_by(Transaction.created_at.desc()).limit(15),
+    'transactions.by_product': lambda: select(Transaction).where(Transaction.product_id == 1)
+        .order_by(Transaction.created_at.desc()).limit(15),
+    'transactions.by_user': lambda: select(Transaction).where(Transaction.user_id == 1)
+        .order_by(Transaction.created_at.desc()).limit(15),
+    'transactions.by_type': lambda: select(Transaction).where(Transaction.movement == MOVEMENT_TYPES['add'])
+        .order_by(Transaction.created_at.desc()).limit(15),
+    'transactions.date_range': lambda: select(Transaction)
+        .where(Transaction.created_at.between(_SINCE, _SINCE + timedelta(days=30)))
+        .order_by(Transaction.created_at.desc()).limit(15),
+    'transactions.product_range': lambda: select(Transaction)
+        .where(Transaction.product_id == 1, Transaction.created_at >= _SINCE)
+        .order_by(Transaction.created_at.desc()).limit(15),
+    'ledger.demand': lambda: select(Transaction.product_id, Transaction.created_at, Transaction.quantity)
+        .where(Transaction.movement == MOVEMENT_TYPES['remove'],
+               Transaction.created_at.between(_SINCE, _SINCE + timedelta(days=90))),
+    'ledger.pending': lambda: select(Transaction.id, Transaction.created_at)
+        .where(or_(Transaction.created_at > _SINCE,
+                   and_(Transaction.created_at == _SINCE, Transaction.id > 0)))
+        .order_by(Transaction.created_at, Transaction.id).limit(5000),
+    'ledger.product_chains': lambda: select(Transaction.id, Transaction.product_id)
+        .where(Transaction.product_id.between(1, 1000))
+        .order_by(Transaction.product_id, Transaction.created_at, Transaction.id),
+    'changes.transactions': lambda: select(Transaction).where(Transaction.id > 0)
+        .order_by(Transaction.id).limit(100),
+    'changes.catalog': lambda: select(ChangeLog).where(ChangeLog.id > 0)
+        .order_by(ChangeLog.id).limit(100),
+    'alerts.pending': lambda: select(StockAlert.id).where(StockAlert.status == 'pending')
+        .order_by(StockAlert.id).limit(200),
+    'alerts.last_sent': lambda: select(func.max(StockAlert.id))
+        .where(StockAlert.status == 'sent', StockAlert.product_id.in_([1, 2])).group_by(StockAlert.product_id),
+    'alerts.unread': lambda: select(AlertNotice).where(AlertNotice.read_at.is_(None))
+        .order_by(AlertNotice.id.desc()).limit(200),
+    'alerts.unread_for_products': lambda: select(AlertNotice)
+        .where(AlertNotice.read_at.is_(None), AlertNotice.product_id.in_([1, 2])),
+}
+
+
+def explain(statement):
+    """EXPLAIN QUERY PLAN detail lines for a statement"""
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.construct_params()
+    parameters = tuple(
+        value.isoformat(' ') if isinstance(value, datetime) else value
+        for value in (params[name] for name in compiled.positiontup)
+    )
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', parameters)
+    return [row[-1] for row in rows]
+
+
+def plan_problems(plan, ordered_scan=False):
+    """Full scans and temporary sorts in a query plan"""
+    problems = []
+    for detail in plan:
+        scan = SCAN.match(detail)
+        if scan and not scan.group(2):
+            problems.append(f'full scan of {scan.group(1)}')
+        elif scan and not ordered_scan:
+            problems.append(f'index scan of {scan.group(1)} instead of a search')
+        elif TEMP_SORT.search(detail):
+            problems.append(detail.lower())
+    return problems
+
+
+def check_query_plans(names=None):
+    """Explain each hot query; returns [(name, plan, problems)]"""
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('Query plan checks support SQLite only.')
+    results = []
+    for name, build in HOT_QUERIES.items():
+        if names and name not in names:
+            continue
+        plan = explain(build())
+        results.append((name, plan, plan_problems(plan, ordered_scan=name in ORDERED_SCANS)))
+    return results
+
+
+def create_missing_indexes(log=None):
+    """Create model indexes missing from existing tables; returns their names"""
+    created = []
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in present:
+                continue
+            index.create(bind=db.engine)
+            created.append(index.name)
+            if log:
+                log(f'Created {index.name} on {table.name}')
+    return created
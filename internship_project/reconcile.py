@@ -0,0 +1,224 @@
+"""
+Ledger reconciliation
+Checks that every product's ledger chains correctly (each movement starts
+where the previous one ended) and that the last movement matches the
+product's current quantity. Each product's stock
+rows by location must also add up to that quantity.
+
+Products are split into id ranges and checked on a process pool, each
+worker with its own app and database engine. Archived movements are read
+once up front and handed to the workers as the starting point of each
+product's chain. Corrective entries are written by the parent process
+alone, so a single connection ever writes.
+"""
+
+import os
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import select, func
+
+from archive import archive_dir, iter_archived_transactions, range_reaches_archive
+from models import db, Product, StockLevel, Transaction, get_default_location
+
+ADJUSTMENT_NOTE = 'Reconciliation adjustment'
+
+
+class LedgerIssue:
+    """One inconsistency found in a product's ledger"""
+
+    def __init__(self, kind, product_id, expected, found, transaction_id=None):
+        self.kind = kind  # 'gap', 'drift', 'untracked' or 'locations'
+        self.product_id = product_id
+        self.expected = expected
+        self.found = found
+        self.transaction_id = transaction_id
+
+    def describe(self):
+        where = f'transaction {self.transaction_id}' if self.transaction_id else 'current stock'
+        messages = {
+            'gap': 'movement does not start where the previous one ended',
+            'drift': 'product quantity differs from the ledger',
+            'untracked': 'product has stock but no ledger movements',
+            'locations': 'stock by location does not add up to the product quantity'
+        }
+        return (f'product {self.product_id}, {where}: {messages[self.kind]} '
+                f'(expected {self.expected}, found {self.found})')
+
+
+class ChainChecker:
+    """Follows each product's movements in ledger order and records issues"""
+
+    def __init__(self, last_quantities=None):
+        self.last_quantities = dict(last_quantities or {})
+        self.issues = []
+        self.checked = 0
+
+    def feed(self, row):
+        self.checked += 1
+        # Only the quantity after a movement is stored, so where it started follows from it
+        signed = row.quantity if row.transaction_type == 'add' else -row.quantity
+        started = row.new_quantity - signed
+        previous = self.last_quantities.get(row.product_id)
+        if previous is not None and started != previous:
+            self.issues.append(LedgerIssue('gap', row.product_id, previous, started, row.id))
+        self.last_quantities[row.product_id] = row.new_quantity
+
+    def finish(self, current_quantities):
+        """Compare current stock with where each ledger ends; returns needed adjustments"""
+        adjustments = []
+        for product_id, quantity in current_quantities.items():
+            ledger_quantity = self.last_quantities.get(product_id)
+            if ledger_quantity is None:
+                if quantity != 0:
+                    self.issues.append(LedgerIssue('untracked', product_id, 0, quantity))
+                    adjustments.append((product_id, 0, quantity))
+            elif ledger_quantity != quantity:
+                self.issues.append(LedgerIssue('drift', product_id, ledger_quantity, quantity))
+                adjustments.append((product_id, ledger_quantity, quantity))
+        return adjustments
+
+
+_worker_app = None
+
+
+def _init_worker(config):
+    """Build an app (and with it a fresh engine) once per worker process"""
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app(config)
+
+
+def _check_range(first_id, last_id, carried_quantities):
+    """Check products with ids in [first_id, last_id]; runs in a worker"""
+    with _worker_app.app_context():
+        checker = ChainChecker(carried_quantities)
+        rows = db.session.execute(
+            select(Transaction.id, Transaction.product_id, Transaction.transaction_type,
+                   Transaction.quantity, Transaction.new_quantity)
+            .where(Transaction.product_id.between(first_id, last_id))
+            .order_by(Transaction.product_id, Transaction.created_at, Transaction.id)
+            .execution_options(yield_per=10000)
+        )
+        for row in rows:
+            checker.feed(row)
+
+        current = dict(db.session.execute(
+            select(Product.id, Product.quantity).where(Product.id.between(first_id, last_id))
+        ).all())
+        adjustments = checker.finish(current)
+        
+        located = dict(db.session.execute(
+            select(StockLevel.product_id, func.sum(StockLevel.quantity))
+            .where(StockLevel.product_id.between(first_id, last_id))
+            .group_by(StockLevel.product_id)
+        ).all())
+        for product_id, quantity in current.items():
+            if located.get(product_id, 0) != quantity:
+                checker.issues.append(LedgerIssue('locations', product_id, quantity, located.get(product_id, 0)))
+        return checker.checked, checker.issues, adjustments
+
+
+def _product_ranges(chunk_size):
+    ids = [product_id for (product_id,) in db.session.query(Product.id).order_by(Product.id)]
+    return [(ids[i], ids[min(i + chunk_size, len(ids)) - 1]) for i in range(0, len(ids), chunk_size)]
+
+
+def reconcile(workers=None, chunk_size=1000):
+    """Check every product's ledger.
+
+    Returns (movements checked, issues, adjustments) where adjustments are
+    (product_id, ledger_quantity, current_quantity) tuples for products
+    whose stock no longer matches their ledger.
+    """
+    # Archived movements precede the whole hot table, so check them first
+    archive_checker = ChainChecker()
+    if range_reaches_archive(None):
+        for row in iter_archived_transactions():
+            archive_checker.feed(row)
+
+    ranges = _product_ranges(chunk_size)
+    checked = archive_checker.checked
+    issues = list(archive_checker.issues)
+    adjustments = []
+
+    def carried(first_id, last_id):
+        return {product_id: quantity for product_id, quantity in archive_checker.last_quantities.items()
+                if first_id <= product_id <= last_id}
+
+    url = db.engine.url
+    in_memory = url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+    if in_memory or workers == 1 or len(ranges) <= 1:
+        # Same work inline: nothing to gain from a pool (in-memory databases cannot be shared)
+        global _worker_app
+        _worker_app = current_app._get_current_object()
+        results = [_check_range(first_id, last_id, carried(first_id, last_id)) for first_id, last_id in ranges]
+    else:
+        config = {
+            'SQLALCHEMY_DATABASE_URI': url.render_as_string(hide_password=False),
+            'ARCHIVE_DIR': archive_dir()
+        }
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 initializer=_init_worker, initargs=(config,)) as pool:
+            futures = [pool.submit(_check_range, first_id, last_id, carried(first_id, last_id))
+                       for first_id, last_id in ranges]
+            results = [future.result() for future in futures]
+
+    for range_checked, range_issues, range_adjustments in results:
+        checked += range_checked
+        issues.extend(range_issues)
+        adjustments.extend(range_adjustments)
+    return checked, issues, adjustments
+
+
+def _adjustment_location(product_id, change):
+    """Location an adjustment is booked at: the best-stocked one when stock leaves, else the default"""
+    if change < 0:
+        level = StockLevel.query.filter_by(product_id=product_id)\
+            .order_by(StockLevel.quantity.desc()).first()
+        if level is not None:
+            return level.location_id
+    return get_default_location().id
+
+
+def write_adjustments(adjustments, user_id):
+    """Append ledger entries that bring each ledger in line with current stock.
+
+    The stock count is taken as the truth: each product keeps its current
+    quantity and the ledger gains an explicit movement explaining the
+    difference. The product and one of its locations are first set back to
+    where the ledger ends, then Product.update_stock records the movement,
+    so the location rows add up to the product total afterwards and
+    everything commits together.
+    """
+    products = Product.__table__
+    levels = StockLevel.__table__
+    for product_id, ledger_quantity, quantity in adjustments:
+        difference = quantity - ledger_quantity
+        located = db.session.query(func.coalesce(func.sum(StockLevel.quantity), 0))\
+            .filter(StockLevel.product_id == product_id).scalar()
+        location_id = _adjustment_location(product_id, quantity - located)
+
+        db.session.execute(products.update().where(products.c.id == product_id).values(quantity=ledger_quantity))
+        if ledger_quantity != located:
+            moved = db.session.execute(
+                levels.update()
+                .where(levels.c.product_id == product_id, levels.c.location_id == location_id)
+                .values(quantity=levels.c.quantity + ledger_quantity - located)
+            ).rowcount
+            if not moved:
+                db.session.execute(levels.insert().values(
+                    product_id=product_id, location_id=location_id, quantity=ledger_quantity - located,
+                    updated_at=datetime.utcnow()
+                ))
+
+        product = db.session.get(Product, product_id)
+        db.session.refresh(product)
+        try:
+            product.update_stock(abs(difference), 'add' if difference > 0 else 'remove', user_id,
+                                 notes=ADJUSTMENT_NOTE, location_id=location_id)
+        except ValueError:
+            db.session.rollback()
+            raise
+    return len(adjustments)
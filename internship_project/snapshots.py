@@ -0,0 +1,118 @@
+"""
+Point-in-time stock levels
+Periodic snapshots record every product's quantity and price. Stock as of
+any date is rebuilt from the nearest snapshot (or from current stock) by
+replaying only the ledger rows between that snapshot and the date, so the
+cost is bounded by the snapshot interval rather than the ledger size.
+
+Stock is valued at the price its snapshot recorded, or at the current list
+price for products no snapshot holds, whichever way the ledger is replayed:
+movement prices never leak in, so one date always has one value.
+"""
+
+from datetime import datetime
+
+from sqlalchemy.orm import joinedload
+
+from archive import iter_ledger
+from models import db, Product, StockSnapshot
+
+
+class StockLevelAsOf:
+    """Reconstructed stock level of one product at a point in time"""
+
+    def __init__(self, product, quantity, unit_price):
+        self.product = product
+        self.quantity = quantity
+        self.unit_price = unit_price
+
+    def get_total_value(self):
+        """Get total value of stock at the snapshot price"""
+        return self.quantity * self.unit_price
+
+
+def take_snapshot(taken_at=None):
+    """Record stock levels for every product, now or reconstructed for a past time"""
+    if taken_at is None:
+        taken_at = datetime.utcnow()
+        levels = [(p.id, p.quantity, p.price) for p in Product.query.all()]
+    else:
+        levels = [(l.product.id, l.quantity, l.unit_price) for l in inventory_as_of(taken_at, active_only=False)]
+
+    StockSnapshot.query.filter_by(taken_at=taken_at).delete()
+    if levels:
+        db.session.execute(StockSnapshot.__table__.insert(), [
+            {'taken_at': taken_at, 'product_id': product_id, 'quantity': quantity, 'unit_price': unit_price}
+            for product_id, quantity, unit_price in levels
+        ])
+    db.session.commit()
+    return taken_at, len(levels)
+
+
+def _nearest_snapshots(when):
+    before = db.session.query(db.func.max(StockSnapshot.taken_at))\
+        .filter(StockSnapshot.taken_at <= when).scalar()
+    after = db.session.query(db.func.min(StockSnapshot.taken_at))\
+        .filter(StockSnapshot.taken_at > when).scalar()
+    return before, after
+
+
+def _snapshot_levels(taken_at):
+    return {s.product_id: (s.quantity, s.unit_price)
+            for s in StockSnapshot.query.filter_by(taken_at=taken_at)}
+
+
+def _replay_backward(levels, when, until, product_ids=None):
+    """Undo movements in (when, until]: the first one per product gives its old quantity"""
+    seen = set()
+    for row in iter_ledger(start_date=when, end_date=until):
+        if row.created_at <= when or row.product_id in seen:
+            continue
+        if product_ids is not None and row.product_id not in product_ids:
+            continue
+        seen.add(row.product_id)
+        _, price = levels.get(row.product_id, (0, None))
+        levels[row.product_id] = (row.old_quantity, price)
+    return levels
+
+
+def inventory_as_of(when, active_only=True):
+    """Stock level of every product that existed at `when`.
+
+    Replays forward from the latest snapshot before `when`, or backward from
+    the next snapshot (or current stock) after it, whichever is closer.
+    """
+    now = datetime.utcnow()
+    query = Product.query.options(joinedload(Product.supplier)).filter(Product.created_at <= when)
+    if active_only:
+        query = query.filter(Product.is_active == True)
+    products = query.order_by(Product.name).all()
+
+    before, after = _nearest_snapshots(when)
+    after_point = after or now
+
+    if before is not None and (when - before) <= (after_point - when):
+        levels = _snapshot_levels(before)
+        for row in iter_ledger(start_date=before, end_date=when):
+            if row.created_at <= before:
+                continue
+            _, price = levels.get(row.product_id, (0, None))
+            levels[row.product_id] = (row.new_quantity, price)
+
+        # Products created after the snapshot without movements yet: rebuild from current stock
+        missing = {p.id for p in products if p.id not in levels}
+        if missing:
+            current = {p.id: (p.quantity, p.price) for p in products if p.id in missing}
+            levels.update(_replay_backward(current, when, now, product_ids=missing))
+    else:
+        if after is not None:
+            levels = _snapshot_levels(after)
+        else:
+            levels = {p.id: (p.quantity, p.price) for p in products}
+        levels = _replay_backward(levels, when, after_point)
+
+    result = []
+    for product in products:
+        quantity, price = levels.get(product.id, (product.quantity, product.price))
+        result.append(StockLevelAsOf(product, quantity, price if price is not None else product.price))
+    return result
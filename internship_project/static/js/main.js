@@ -33,23 +33,61 @@ document.addEventListener("DOMContentLoaded", () => {
     )
   })
 
-  // Search functionality
-  const searchInput = document.getElementById("searchInput")
-  if (searchInput) {
-    searchInput.addEventListener("input", function () {
-      const searchTerm = this.value.toLowerCase()
-      const tableRows = document.querySelectorAll("tbody tr")
-
-      tableRows.forEach((row) => {
-        const text = row.textContent.toLowerCase()
-        if (text.includes(searchTerm)) {
-          row.style.display = ""
-        } else {
-          row.style.display = "none"
-        }
+  // Live search: as the user types, fetch just the table rows for the
+  // current filters (?partial=rows) and swap them in. Each keystroke
+  // aborts the previous request so stale results never overwrite newer ones.
+  document.querySelectorAll("[data-live-rows]").forEach((input) => {
+    const tbody = document.querySelector(input.dataset.liveRows)
+    if (!tbody || !input.form) return
+
+    const form = input.form
+    const card = tbody.closest(".card")
+    const total = card && card.querySelector("[data-live-total]")
+    const pagination = card && card.querySelector("[data-live-pagination]")
+    let controller = null
+    let timer = null
+
+    const refresh = () => {
+      const params = new URLSearchParams(new FormData(form))
+      const pageUrl = `${window.location.pathname}?${params}`
+      params.set("partial", "rows")
+
+      if (controller) controller.abort()
+      const current = (controller = new AbortController())
+      tbody.setAttribute("aria-busy", "true")
+
+      fetch(`${window.location.pathname}?${params}`, {
+        signal: current.signal,
+        credentials: "same-origin",
+        headers: { "X-Requested-With": "fetch" },
       })
+        .then((response) => {
+          if (response.redirected || !response.ok) {
+            // Session expired or the server failed: fall back to a full page load
+            window.location.href = pageUrl
+            return
+          }
+          return response.text().then((html) => {
+            tbody.innerHTML = html
+            if (total) total.textContent = `${response.headers.get("X-Total-Count")} total`
+            // The page links describe the previous filters; Enter reloads with fresh ones
+            if (pagination) pagination.hidden = true
+            window.history.replaceState(null, "", pageUrl)
+          })
+        })
+        .catch((error) => {
+          if (error.name !== "AbortError") console.error("Live search failed", error)
+        })
+        .finally(() => {
+          if (controller === current) tbody.removeAttribute("aria-busy")
+        })
+    }
+
+    input.addEventListener("input", () => {
+      clearTimeout(timer)
+      timer = setTimeout(refresh, 250)
     })
-  }
+  })
 
   // Confirm delete actions
   const deleteButtons = document.querySelectorAll(".btn-delete")
@@ -0,0 +1,134 @@
+"""
+Template caching
+Compiled templates are kept in a Jinja bytecode cache on disk
+(JINJA_CACHE_DIR), so every worker loads bytecode instead of recompiling
+on a cold start; `flask precompile-templates` fills it ahead of time.
+
+Expensive, rarely changing markup is cached as rendered fragments:
+
+    {% cache 'product-row', product.id, product.updated_at %}
+        ...
+    {% endcache %}
+
+The arguments form the key, so they must include a version of every
+entity the fragment shows (an updated_at column, or catalog_version() for
+anything derived from the whole catalog). Fragments live in a per-process
+LRU and also expire after FRAGMENT_CACHE_TIMEOUT seconds.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from metrics import inc as inc_metric
+from models import db, ChangeLog
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments with a time limit"""
+
+    def __init__(self, max_entries=5000, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache name, key... %}body{% endcache %}"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        cache_key = tuple(str(part) for part in key)
+        value = cache.get(cache_key)
+        if value is None:
+            value = caller()
+            cache.set(cache_key, value)
+            inc_metric('template_fragment_cache_total', fragment=str(key[0]), result='miss')
+        else:
+            inc_metric('template_fragment_cache_total', fragment=str(key[0]), result='hit')
+        return value
+
+
+def catalog_version():
+    """Latest product/supplier change id, computed once per request"""
+    if not has_request_context():
+        return db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+    if 'catalog_version' not in g:
+        g.catalog_version = db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+    return g.catalog_version
+
+
+def jinja_cache_dir(app):
+    return app.config['JINJA_CACHE_DIR'] or os.path.join(app.instance_path, 'jinja_cache')
+
+
+def init_template_cache(app):
+    """Install the bytecode cache and the {% cache %} tag on the app's Jinja environment"""
+    if app.config['JINJA_BYTECODE_CACHE']:
+        directory = jinja_cache_dir(app)
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_options = {
+            **app.jinja_options,
+            'bytecode_cache': FileSystemBytecodeCache(directory),
+        }
+
+    app.jinja_options = {
+        **app.jinja_options,
+        'extensions': [*app.jinja_options.get('extensions', ()), FragmentCacheExtension],
+    }
+    app.jinja_env.fragment_cache = FragmentCache(
+        app.config['FRAGMENT_CACHE_SIZE'], app.config['FRAGMENT_CACHE_TIMEOUT']
+    ) if app.config['FRAGMENT_CACHE_SIZE'] else None
+    app.jinja_env.globals['catalog_version'] = catalog_version
+
+
+def precompile_templates(app):
+    """Compile every template into the bytecode cache; returns the number compiled"""
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        app.jinja_env.get_template(name)
+        compiled += 1
+    return compiled
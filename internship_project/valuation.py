@@ -0,0 +1,289 @@
+"""
+Inventory valuation over the transaction ledger
+The ledger is streamed in (created_at, id) order and every movement is
+costed two ways: FIFO cost layers and a moving weighted average. Stock-ins
+are costed at the transaction's unit price. Stock-outs produce cost of
+goods sold, accumulated per product per month.
+
+Running state (one row per product) and a ledger checkpoint are committed
+together in batches, so a rerun only processes movements recorded since
+the previous run. Movements backdated before the checkpoint need a rebuild.
+"""
+
+import json
+
+from sqlalchemy import select, or_, and_
+from sqlalchemy.orm import joinedload
+
+from archive import iter_archived_transactions, range_reaches_archive
+from models import db, Product, Transaction, ValuationState, ValuationPeriod, ValuationCheckpoint
+
+BATCH_SIZE = 5000
+
+
+class CostState:
+    """In-memory cost layers of one product while the ledger is replayed"""
+
+    def __init__(self, quantity=0, average_cost=0.0, layers=None):
+        self.quantity = quantity
+        self.average_cost = average_cost
+        self.layers = layers or []
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.quantity, row.average_cost, json.loads(row.fifo_layers))
+
+    def receive(self, quantity, unit_cost):
+        """Add stock at unit_cost"""
+        if self.layers and self.layers[-1][1] == unit_cost:
+            self.layers[-1][0] += quantity
+        else:
+            self.layers.append([quantity, unit_cost])
+        total = self.quantity + quantity
+        if total > 0:
+            self.average_cost = (max(self.quantity, 0) * self.average_cost + quantity * unit_cost) / total
+        self.quantity = total
+
+    def issue(self, quantity, fallback_cost):
+        """Remove stock and return (fifo_cogs, average_cogs)"""
+        average_cogs = quantity * (self.average_cost or fallback_cost)
+        fifo_cogs = 0.0
+        remaining = quantity
+        while remaining > 0 and self.layers:
+            layer = self.layers[0]
+            taken = min(layer[0], remaining)
+            fifo_cogs += taken * layer[1]
+            layer[0] -= taken
+            remaining -= taken
+            if layer[0] == 0:
+                self.layers.pop(0)
+        if remaining > 0:
+            # More removed than the ledger ever received: cost the shortfall at average
+            fifo_cogs += remaining * (self.average_cost or fallback_cost)
+        self.quantity -= quantity
+        return fifo_cogs, average_cogs
+
+    def fifo_value(self):
+        return sum(quantity * cost for quantity, cost in self.layers)
+
+
+def _get_checkpoint():
+    checkpoint = db.session.get(ValuationCheckpoint, 1)
+    if checkpoint is None:
+        checkpoint = ValuationCheckpoint(id=1, version=0)
+        db.session.add(checkpoint)
+        db.session.commit()
+    return checkpoint
+
+
+def _pending_movements(after_at, after_id, batch_size):
+    """Ledger rows after the (created_at, id) position, oldest first"""
+    def is_pending(row):
+        return after_at is None or (row.created_at, row.id) > (after_at, after_id or 0)
+
+    if range_reaches_archive(after_at):
+        for row in iter_archived_transactions(start_date=after_at):
+            if is_pending(row):
+                yield row
+
+    columns = (Transaction.id, Transaction.product_id, Transaction.transaction_type,
+               Transaction.quantity, Transaction.old_quantity, Transaction.unit_price,
+               Transaction.created_at)
+    while True:
+        statement = select(*columns).order_by(Transaction.created_at, Transaction.id).limit(batch_size)
+        if after_at is not None:
+            statement = statement.where(or_(
+                Transaction.created_at > after_at,
+                and_(Transaction.created_at == after_at, Transaction.id > (after_id or 0))
+            ))
+        rows = db.session.execute(statement).all()
+        if not rows:
+            return
+        yield from rows
+        after_at, after_id = rows[-1].created_at, rows[-1].id
+
+
+def run_valuation(rebuild=False, batch_size=BATCH_SIZE, log=None, max_batches=None):
+    """Bring valuation state up to date with the ledger.
+
+    Returns the number of movements processed. Each batch commits state,
+    period totals and the checkpoint together; if another run moved the
+    checkpoint in the meantime the batch is rolled back and the run stops.
+    With max_batches the run stops after that many batches, leaving the
+    rest for the next run.
+    """
+    if rebuild:
+        ValuationPeriod.query.delete()
+        ValuationState.query.delete()
+        ValuationCheckpoint.query.delete()
+        db.session.commit()
+
+    checkpoint = _get_checkpoint()
+    version = checkpoint.version
+    after_at, after_id = checkpoint.last_created_at, checkpoint.last_transaction_id
+
+    prices = dict(db.session.query(Product.id, Product.price))
+    stored_states = {row.product_id: row for row in ValuationState.query}
+    states = {}
+    dirty = set()
+    periods = {}
+    processed = 0
+    last = None
+
+    def state_for(row):
+        state = states.get(row.product_id)
+        if state is None:
+            stored = stored_states.get(row.product_id)
+            if stored is not None:
+                state = CostState.from_row(stored)
+            else:
+                state = CostState()
+                if row.old_quantity > 0:
+                    # Stock held before the first recorded movement
+                    state.receive(row.old_quantity, row.unit_price or prices.get(row.product_id, 0.0))
+            states[row.product_id] = state
+        return state
+
+    def period_totals(period, product_id):
+        key = (period, product_id)
+        totals = periods.get(key)
+        if totals is None:
+            totals = periods[key] = [0, 0.0, 0, 0.0, 0.0]
+        return totals
+
+    def commit_batch():
+        nonlocal version
+        for product_id in dirty:
+            state = states[product_id]
+            stored = stored_states.get(product_id)
+            if stored is None:
+                stored = stored_states[product_id] = ValuationState(product_id=product_id)
+                db.session.add(stored)
+            stored.quantity = state.quantity
+            stored.average_cost = state.average_cost
+            stored.fifo_layers = json.dumps(state.layers)
+
+        # Period rows this batch adds to, in one query
+        existing = {}
+        if periods:
+            keys = set(periods)
+            candidates = ValuationPeriod.query.filter(
+                ValuationPeriod.period.in_({period for period, _ in keys}),
+                ValuationPeriod.product_id.in_({product_id for _, product_id in keys})
+            )
+            existing = {(row.period, row.product_id): row for row in candidates
+                        if (row.period, row.product_id) in keys}
+        for (period, product_id), (qty_in, cost_in, qty_out, fifo_cogs, average_cogs) in periods.items():
+            row = existing.get((period, product_id))
+            if row is None:
+                row = ValuationPeriod(period=period, product_id=product_id, quantity_in=0, cost_in=0.0,
+                                      quantity_out=0, fifo_cogs=0.0, average_cogs=0.0)
+                db.session.add(row)
+            row.quantity_in += qty_in
+            row.cost_in += cost_in
+            row.quantity_out += qty_out
+            row.fifo_cogs += fifo_cogs
+            row.average_cogs += average_cogs
+
+        moved = ValuationCheckpoint.query.filter_by(id=1, version=version).update({
+            'last_created_at': last.created_at,
+            'last_transaction_id': last.id,
+            'version': version + 1,
+            'updated_at': db.func.now()
+        }, synchronize_session=False)
+        if not moved:
+            db.session.rollback()
+            return False
+        db.session.commit()
+        version += 1
+        dirty.clear()
+        periods.clear()
+        if log:
+            log(f'Valued through {last.created_at:%Y-%m-%d %H:%M:%S} ({processed} movements)')
+        return True
+
+    pending = 0
+    batches = 0
+    for row in _pending_movements(after_at, after_id, batch_size):
+        state = state_for(row)
+        dirty.add(row.product_id)
+        totals = period_totals(row.created_at.strftime('%Y-%m'), row.product_id)
+        unit_cost = row.unit_price or prices.get(row.product_id, 0.0)
+
+        if row.transaction_type == 'add':
+            state.receive(row.quantity, unit_cost)
+            totals[0] += row.quantity
+            totals[1] += row.quantity * unit_cost
+        elif row.transaction_type == 'remove':
+            fifo_cogs, average_cogs = state.issue(row.quantity, unit_cost)
+            totals[2] += row.quantity
+            totals[3] += fifo_cogs
+            totals[4] += average_cogs
+
+        last = row
+        processed += 1
+        pending += 1
+        if pending >= batch_size:
+            if not commit_batch():
+                return processed - pending
+            pending = 0
+            batches += 1
+            if max_batches and batches >= max_batches:
+                return processed
+
+    if pending and not commit_batch():
+        return processed - pending
+    return processed
+
+
+def valuation_by_product(active_only=True):
+    """Current FIFO and weighted-average value of each product's stock.
+
+    Products that never appear in the ledger are valued at their list price.
+    """
+    query = db.session.query(Product, ValuationState).outerjoin(
+        ValuationState, ValuationState.product_id == Product.id
+    ).options(joinedload(Product.supplier))
+    if active_only:
+        query = query.filter(Product.is_active == True)
+
+    rows = []
+    for product, stored in query.order_by(Product.name):
+        if stored is None:
+            state = CostState()
+            if product.quantity > 0:
+                state.receive(product.quantity, product.price)
+        else:
+            state = CostState.from_row(stored)
+        rows.append({
+            'product': product,
+            'quantity': state.quantity,
+            'fifo_value': state.fifo_value(),
+            'average_cost': state.average_cost,
+            'average_value': max(state.quantity, 0) * state.average_cost,
+            'list_value': product.get_total_value()
+        })
+    return rows
+
+
+def cogs_by_period(start_period=None, end_period=None):
+    """Monthly totals of goods received and cost of goods sold"""
+    query = db.session.query(
+        ValuationPeriod.period,
+        db.func.sum(ValuationPeriod.quantity_in).label('quantity_in'),
+        db.func.sum(ValuationPeriod.cost_in).label('cost_in'),
+        db.func.sum(ValuationPeriod.quantity_out).label('quantity_out'),
+        db.func.sum(ValuationPeriod.fifo_cogs).label('fifo_cogs'),
+        db.func.sum(ValuationPeriod.average_cogs).label('average_cogs')
+    )
+    if start_period:
+        query = query.filter(ValuationPeriod.period >= start_period)
+    if end_period:
+        query = query.filter(ValuationPeriod.period <= end_period)
+    return query.group_by(ValuationPeriod.period).order_by(ValuationPeriod.period).all()
+
+
+def valued_through():
+    """Timestamp of the last movement included in the valuation"""
+    checkpoint = db.session.get(ValuationCheckpoint, 1)
+    return checkpoint.last_created_at if checkpoint else None